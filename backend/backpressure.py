@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+
+OK = "ok"
+SLOW = "slow"
+STUCK = "stuck"
+
+class Backpressure:
+    """Slow-consumer handling based on each socket's outbound queue depth
+
+    queue_depth(sid) returns how many packets are waiting to be written to
+    a socket, or None when another worker holds it. Past soft_limit the
+    socket is slow: optional events (typing) are dropped, and deferrable
+    ones (file notices) wait in a small per-socket backlog that run()
+    flushes once it catches up. Past hard_limit the socket is stuck and is
+    disconnected, so its queue cannot grow without bound; the client
+    reconnects and picks up missed messages through offline delivery.
+    """
+
+    def __init__(self, queue_depth, emit, disconnect, soft_limit=64, hard_limit=1024,
+                 max_deferred=32, interval=0.5):
+        self.queue_depth = queue_depth
+        self.emit = emit  # emit(event, payload, to=sid)
+        self.disconnect = disconnect  # disconnect(sid)
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.max_deferred = max_deferred
+        self.interval = interval
+        self.deferred = {}  # {sid: deque of (event, payload)}
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {"dropped": 0, "deferred": 0, "deferred_sent": 0, "deferred_dropped": 0, "disconnected": 0}
+
+    def state(self, sid):
+        """OK, SLOW or STUCK; a stuck socket is disconnected the first time it is seen"""
+        depth = self.queue_depth(sid)
+        if depth is None or depth < self.soft_limit:
+            return OK
+        if depth < self.hard_limit:
+            return SLOW
+        with self.lock:
+            self.stats["disconnected"] += 1
+            self.deferred.pop(sid, None)
+        try:
+            self.disconnect(sid)
+        except Exception as e:
+            print(f"Error disconnecting slow consumer {sid}: {e}")
+        return STUCK
+
+    def allow_optional(self, sid):
+        """Whether an event the client can live without should go to sid now"""
+        if self.state(sid) == OK:
+            return True
+        with self.lock:
+            self.stats["dropped"] += 1
+        return False
+
+    def send_deferrable(self, sid, event, payload):
+        """Emit now, or hold the event until sid catches up; False if it was dropped"""
+        state = self.state(sid)
+        if state == STUCK:
+            return False
+        with self.lock:
+            backlog = self.deferred.get(sid)
+            # Anything already held goes first, so notices stay in order
+            if state == OK and not backlog:
+                send = True
+            else:
+                send = False
+                if backlog is None:
+                    backlog = self.deferred[sid] = deque()
+                if len(backlog) >= self.max_deferred:
+                    backlog.popleft()
+                    self.stats["deferred_dropped"] += 1
+                backlog.append((event, payload))
+                self.stats["deferred"] += 1
+        if send:
+            self.emit(event, payload, to=sid)
+        return True
+
+    def forget(self, sid):
+        """Drop a disconnected socket's backlog"""
+        with self.lock:
+            self.deferred.pop(sid, None)
+
+    def flush(self):
+        """Send held events to every socket that has caught up"""
+        with self.lock:
+            waiting = list(self.deferred)
+        for sid in waiting:
+            if self.state(sid) != OK:
+                continue
+            with self.lock:
+                backlog = self.deferred.pop(sid, None)
+                if backlog:
+                    self.stats["deferred_sent"] += len(backlog)
+            for event, payload in backlog or ():
+                self.emit(event, payload, to=sid)
+
+    def run(self, sleep):
+        """Flush loop; start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing deferred events: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "backlogged_sockets": len(self.deferred)}
@@ -0,0 +1,103 @@
+"""Call lifecycle cost under churn: linear scan + Timer per call vs indexed calls + one reaper.
+
+With --population calls already in progress, starts, accepts and ends
+--churn calls as fast as possible, then times get_active_call for users
+in the population. It reports peak thread count during churn, how long
+the tracked call table takes to drain after churn stops, and lookup cost.
+
+The "legacy" rows replay the previous implementation: a dict of call
+dicts scanned linearly by get_active_call, and one threading.Timer per
+ended call to drop it 5 s later.
+
+Run from the backend directory:
+    python benchmarks/bench_call_churn.py --population 100 1000 10000 --churn 2000
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_chat import VoiceChatManager
+
+
+class LegacyCalls:
+    """The call bookkeeping VoiceChatManager used to do"""
+
+    def __init__(self, ended_retention):
+        self.active_calls = {}
+        self.ended_retention = ended_retention
+
+    def initiate_call(self, caller, receiver):
+        call_id = f"{caller}_{receiver}_{datetime.now().timestamp()}"
+        self.active_calls[call_id] = {"caller": caller, "receiver": receiver, "status": "calling",
+                                      "started_at": datetime.now().isoformat()}
+        return {"success": True, "call_id": call_id}
+
+    def accept_call(self, call_id, username):
+        self.active_calls[call_id]["status"] = "active"
+
+    def end_call(self, call_id, username):
+        self.active_calls[call_id]["status"] = "ended"
+        threading.Timer(self.ended_retention, lambda: self.active_calls.pop(call_id, None)).start()
+
+    def get_active_call(self, username):
+        for call_id, call_info in self.active_calls.items():
+            if (call_info["caller"] == username or call_info["receiver"] == username) and \
+               call_info["status"] in ["calling", "active"]:
+                return {"call_id": call_id, **call_info}
+        return None
+
+
+def run(name, manager, population, churn, lookups, retention):
+    for i in range(population):
+        manager.accept_call(manager.initiate_call(f"p{i}a", f"p{i}b")["call_id"], f"p{i}b")
+
+    base_threads = threading.active_count()
+    peak_threads = base_threads
+    start = time.perf_counter()
+    for i in range(churn):
+        call_id = manager.initiate_call(f"c{i}a", f"c{i}b")["call_id"]
+        manager.accept_call(call_id, f"c{i}b")
+        manager.end_call(call_id, f"c{i}a")
+        if i % 50 == 0:
+            peak_threads = max(peak_threads, threading.active_count())
+    churn_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(lookups):
+        # Users spread over the population, so a scan has to walk part of the table
+        assert manager.get_active_call(f"p{(i * 7919) % population}b") is not None
+    lookup_time = (time.perf_counter() - start) / lookups
+
+    drain_start = time.monotonic()
+    while len(manager.active_calls) > population and time.monotonic() - drain_start < retention + 5:
+        time.sleep(0.05)
+    drained = time.monotonic() - drain_start
+
+    print(f"{name:<8} population {population:>6}   churn {churn / churn_time:>8.0f} calls/s   "
+          f"threads {base_threads} -> peak {peak_threads:>5}   lookup {lookup_time * 1e6:>9.2f} us   "
+          f"ended calls gone after {drained:>4.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--population", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--churn", type=int, default=2000, help="calls started, accepted and ended per run")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--retention", type=float, default=2.0, help="seconds ended calls are kept")
+    args = parser.parse_args()
+
+    for population in args.population:
+        lookups = args.lookups if population <= 1000 else max(1, args.lookups // 10)
+        run("legacy", LegacyCalls(args.retention), population, args.churn, lookups, args.retention)
+        manager = VoiceChatManager(udp_port=0, ended_retention=args.retention)
+        run("indexed", manager, population, args.churn, args.lookups, args.retention)
+        manager.stop_reaper()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Time history loads on a large synthetic chat_history, before and after the migration.
+
+Builds a legacy (unindexed) table, times the original OR query, migrates it
+through UserManager and times the keyset-paginated query at the newest page
+and deep into a conversation, then the newest page from the hot history
+cache and its hit rate on a mixed open/send workload. Building 10M rows
+takes a few minutes.
+
+Run from the backend directory:
+    python benchmarks/bench_chat_history.py --rows 10000000
+"""
+import argparse
+import random
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_manager import UserManager
+
+
+def build_legacy_table(db_path, rows, users):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            receiver TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+        INSERT INTO chat_history (sender, receiver, message)
+        SELECT 'user' || (n % ?), 'user' || ((n * 7 + 1) % ?), 'synthetic message ' || n FROM seq
+    ''', (rows, users, users))
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--opens", type=int, default=5000, help="history opens in the mixed workload")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "users.db")
+        start = time.perf_counter()
+        build_legacy_table(db_path, args.rows, args.users)
+        print(f"built {args.rows:,} rows in {time.perf_counter() - start:.1f}s")
+
+        user1, user2 = "user1", "user8"
+        conn = sqlite3.connect(db_path)
+        legacy = timed(lambda: conn.execute('''
+            SELECT sender, receiver, message, timestamp
+            FROM chat_history
+            WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
+            ORDER BY timestamp DESC
+            LIMIT ?
+        ''', (user1, user2, user2, user1, args.page)).fetchall(), args.repeat)
+        conn.close()
+        print(f"legacy OR scan:        {legacy * 1e3:>9.2f} ms/page")
+
+        start = time.perf_counter()
+        manager = UserManager(db_path, history_cache_bytes=0)
+        print(f"migration:             {time.perf_counter() - start:>9.2f} s (one-off)")
+
+        newest = timed(lambda: manager.get_chat_history_page(user1, user2, args.page), args.repeat)
+        print(f"keyset newest page:    {newest * 1e3:>9.2f} ms/page")
+
+        # Walk back a few pages to measure a deep cursor
+        cursor = None
+        for _ in range(5):
+            cursor = manager.get_chat_history_page(user1, user2, args.page, cursor)["next_before_id"]
+            if cursor is None:
+                break
+        deep = timed(lambda: manager.get_chat_history_page(user1, user2, args.page, cursor), args.repeat)
+        print(f"keyset deep page:      {deep * 1e3:>9.2f} ms/page")
+        manager.close()
+
+        cached_manager = UserManager(db_path)
+        cached_manager.get_chat_history_page(user1, user2, args.page)
+        cached = timed(lambda: cached_manager.get_chat_history_page(user1, user2, args.page), args.repeat)
+        print(f"cached newest page:    {cached * 1e3:>9.3f} ms/page")
+
+        # Chats reopened on reconnects and tab switches, with messages sent in between
+        rng = random.Random(1)
+        pairs = [(f"user{i}", f"user{(i * 7 + 1) % args.users}") for i in range(200)]
+        start = time.perf_counter()
+        for _ in range(args.opens):
+            a, b = pairs[min(int(rng.expovariate(1 / 20)), len(pairs) - 1)]
+            if rng.random() < 0.3:
+                cached_manager.save_message(a, b, "hello again")
+                cached_manager.flush_messages()
+            cached_manager.get_chat_history_page(a, b, args.page)
+        elapsed = time.perf_counter() - start
+        stats = cached_manager.history_cache.get_stats()
+        print(f"mixed workload:        {elapsed / args.opens * 1e3:>9.3f} ms/open, hit rate {stats['hit_rate']:.0%} "
+              f"({stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions)")
+        cached_manager.close()
+
+
+if __name__ == "__main__":
+    main()
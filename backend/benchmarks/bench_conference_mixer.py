@@ -0,0 +1,92 @@
+"""Conference mixing cost per 20 ms frame versus participant count.
+
+For each participant count, fills every participant's jitter buffer and
+times Conference.tick(), which pops one frame per participant, mixes them
+with mix_minus and serialises one output stream per listener. Also times
+mix_minus alone and a per-listener Python loop that re-sums the others
+(the naive O(N^2) mix), and compares relay egress with a forwarding mesh.
+
+No sockets are opened; this measures the mixer thread's CPU budget only.
+
+Run from the backend directory:
+    python benchmarks/bench_conference_mixer.py --participants 2 4 8 16 32 64
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conference import Conference, FRAME_INTERVAL, FRAME_SAMPLES, PCM, mix_minus
+from voice_chat import VoiceRoute
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def naive_mix(frames):
+    """Each listener sums everyone else separately"""
+    out = []
+    for row in range(frames.shape[0]):
+        total = np.zeros(frames.shape[1], dtype=np.int32)
+        for other in range(frames.shape[0]):
+            if other != row:
+                total += frames[other]
+        out.append(np.clip(total, -32768, 32767).astype(PCM))
+    return out
+
+
+def run(participants, repeat):
+    rng = np.random.default_rng(participants)
+    frames = rng.integers(-8000, 8000, size=(participants, FRAME_SAMPLES), dtype=np.int16)
+    payloads = [row.astype(PCM).tobytes() for row in frames]
+
+    conference = Conference("bench", "user0", max_participants=participants)
+    routes = []
+    for i in range(participants):
+        route = VoiceRoute(i, f"user{i}", "bench", conference)
+        route.addr = ("127.0.0.1", 10000 + i)
+        conference.add(route)
+        routes.append(route)
+
+    def tick():
+        for route, payload in zip(routes, payloads):
+            conference.receive(route.token, payload)
+        conference.tick()
+
+    tick()  # prime the jitter buffers
+    tick_time = timed(tick, repeat)
+    mix_time = timed(lambda: mix_minus(frames), repeat)
+    naive_time = timed(lambda: naive_mix(frames), max(1, repeat // 10))
+
+    frame_bytes = FRAME_SAMPLES * 2
+    mesh_egress = participants * (participants - 1) * frame_bytes / FRAME_INTERVAL
+    mixed_egress = participants * frame_bytes / FRAME_INTERVAL
+    print(f"{participants:>4} participants   tick {tick_time * 1e6:>8.1f} us "
+          f"({tick_time / FRAME_INTERVAL:>6.2%} of a frame)   mix_minus {mix_time * 1e6:>7.1f} us   "
+          f"naive {naive_time * 1e6:>8.1f} us   egress mixed {mixed_egress / 1e3:>7.0f} kB/s "
+          f"vs mesh {mesh_egress / 1e3:>8.0f} kB/s")
+    return tick_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--participants", type=int, nargs="+", default=[2, 4, 8, 16, 32, 64])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    for participants in args.participants:
+        tick_time = run(participants, args.repeat)
+        conferences = int(FRAME_INTERVAL / tick_time)
+        print(f"     ~{conferences} such conferences fit in one core's 20 ms budget")
+
+
+if __name__ == "__main__":
+    main()
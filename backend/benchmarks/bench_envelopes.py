@@ -0,0 +1,115 @@
+"""Serialization CPU and wire bytes per event: fresh dicts vs envelopes, JSON vs MessagePack.
+
+Drives a real python-socketio Server with fake connected sockets (no
+network), so each emit goes through the manager and the configured packet
+class exactly as it does in server.py, and the engine.io packets are
+counted instead of sent. Every scenario is run four ways:
+
+  json          stock Packet, payload built as a dict per emit (before)
+  json+env      EnvelopePacket, payload built once as an Envelope (after)
+  msgpack       stock MsgPackPacket with dicts
+  msgpack+env   envelope MsgPack packet
+
+Scenarios follow the handlers: a 1:1 message (receiver emit + sender ack),
+a conference invite sent to each invitee, and room_created/room_added sent
+to every member of a new room. msgpack rows need the msgpack package.
+
+Run from the backend directory:
+    python benchmarks/bench_envelopes.py --members 16 100 --repeat 2000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import socketio
+from socketio import packet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from envelopes import Envelope, create_packet_class
+
+
+def make_server(packet_class, sockets):
+    server = socketio.Server(serializer=packet_class)
+    wire = {"packets": 0, "bytes": 0}
+
+    def send_eio_packet(eio_sid, eio_pkt):
+        wire["packets"] += 1
+        wire["bytes"] += len(eio_pkt.data)
+
+    server._send_eio_packet = send_eio_packet
+    sids = [server.manager.connect(f"eio{i}", "/") for i in range(sockets)]
+    return server, sids, wire
+
+
+def private_message(server, sids, wrap):
+    timestamp = datetime.now().isoformat()
+    server.emit("private_message", wrap({
+        "sender": "alice",
+        "receiver": "bob",
+        "message": "Are we still on for the design review at 3? I moved it to the small room.",
+        "timestamp": timestamp,
+        "type": "text"
+    }), to=sids[1])
+    server.emit("message_sent", {"success": True, "timestamp": timestamp, "receiver": "bob"}, to=sids[0])
+
+
+def conference_invite(server, sids, wrap):
+    invite = wrap({"conference_id": "conf_alice_1760000000.123456", "host": "alice"})
+    for sid in sids[1:]:
+        server.emit("conference_invite", invite if wrap is Envelope else dict(invite), to=sid)
+
+
+def room_created(server, sids, wrap):
+    room = wrap({"id": 42, "name": "platform team", "owner": "user0",
+                 "members": [f"user{i}" for i in range(len(sids))]})
+    for sid in sids[1:]:
+        server.emit("room_added", room if wrap is Envelope else dict(room), to=sid)
+    server.emit("room_created", room if wrap is Envelope else dict(room), to=sids[0])
+
+
+def run(name, scenario, sockets, repeat, rounds):
+    variants = [("json", packet.Packet, dict), ("json+env", create_packet_class("json"), Envelope)]
+    try:
+        from socketio.msgpack_packet import MsgPackPacket
+        variants += [("msgpack", MsgPackPacket, dict), ("msgpack+env", create_packet_class("msgpack"), Envelope)]
+    except ImportError:
+        pass
+
+    print(f"{name} ({sockets} sockets)")
+    baseline = None
+    for label, packet_class, wrap in variants:
+        server, sids, wire = make_server(packet_class, sockets)
+        scenario(server, sids, wrap)
+        wire.update(packets=0, bytes=0)
+        # Best of several rounds; a busy VM only ever adds time
+        cpu = float("inf")
+        for _ in range(rounds):
+            start = time.process_time()
+            for _ in range(repeat):
+                scenario(server, sids, wrap)
+            cpu = min(cpu, (time.process_time() - start) / repeat)
+        wire = {key: value / rounds for key, value in wire.items()}
+        baseline = baseline or cpu
+        print(f"  {label:<12} {cpu * 1e6:>9.1f} us CPU/event ({cpu / baseline:>5.0%})   "
+              f"{wire['packets'] / repeat:>5.0f} packets   {wire['bytes'] / repeat:>9.0f} bytes on the wire")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, nargs="+", default=[16, 100])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    run("private_message + ack", private_message, 2, args.repeat * 10, args.rounds)
+    for members in args.members:
+        repeat = max(1, args.repeat * 10 // members)
+        run("conference_invite", conference_invite, members, repeat, args.rounds)
+        run("room_created + room_added", room_created, members, repeat, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
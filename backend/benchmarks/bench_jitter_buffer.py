@@ -0,0 +1,102 @@
+"""Added delay and audio quality of the adaptive jitter buffer under simulated network jitter.
+
+A sender emits one 20 ms frame per frame period with a millisecond
+timestamp. Each frame gets a network delay of --base-delay plus an
+exponentially distributed jitter term, and is lost with probability
+--loss. The relay runs on a simulated clock, ticking every 20 ms: it
+feeds frames that arrived since the last tick to StreamStats and the
+AdaptiveJitterBuffer, then plays out one frame.
+
+For each jitter level it reports:
+  - what plain forwarding would deliver: reordered frames and the p99
+    deviation of output gaps from 20 ms (burstiness)
+  - what the buffer delivers: added delay (buffer entry to playout) p50 and
+    p99, late, concealed and trimmed frames, and the jitter StreamStats
+    measured
+
+Run from the backend directory:
+    python benchmarks/bench_jitter_buffer.py --jitter 0 5 10 20 40 --loss 0.01
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_quality import AdaptiveJitterBuffer, StreamStats, FRAME_MS, SEQ_MODULO
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def simulate(frames, jitter_ms, loss, base_delay, seed):
+    rng = random.Random(seed)
+    arrivals = []  # (arrival ms, seq, media ms)
+    for k in range(frames):
+        if rng.random() < loss:
+            continue
+        delay = base_delay + (rng.expovariate(1 / jitter_ms) if jitter_ms else 0.0)
+        arrivals.append((k * FRAME_MS + delay, k % SEQ_MODULO, k * FRAME_MS))
+    arrivals.sort()
+
+    # Plain forwarding: frames leave in arrival order, as they arrive
+    reordered = sum(1 for a, b in zip(arrivals, arrivals[1:]) if (b[1] - a[1]) % SEQ_MODULO > SEQ_MODULO // 2)
+    gaps = [abs((b[0] - a[0]) - FRAME_MS) for a, b in zip(arrivals, arrivals[1:])]
+
+    # Buffered playout on a 20 ms tick with a random phase against the sender
+    quality = StreamStats()
+    buffer = AdaptiveJitterBuffer(quality)
+    entered = {}
+    added = []
+    tick = rng.uniform(0, FRAME_MS)
+    index = 0
+    end = frames * FRAME_MS + base_delay + 10 * max(jitter_ms, 1)
+    while tick < end:
+        while index < len(arrivals) and arrivals[index][0] <= tick:
+            arrival, seq, media = arrivals[index]
+            quality.update(seq, media, arrival)
+            buffer.push(seq, seq)
+            entered[seq] = arrival
+            index += 1
+        seq = buffer.pop()
+        if seq is not None:
+            added.append(tick - entered[seq])
+        tick += FRAME_MS
+
+    return {
+        "reordered": reordered,
+        "gap_p99": percentile(gaps, 99),
+        "added_p50": percentile(added, 50),
+        "added_p99": percentile(added, 99),
+        "stats": buffer.get_stats(),
+        "quality": quality.get_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=15000, help="frames per run (50 per second of audio)")
+    parser.add_argument("--jitter", type=float, nargs="+", default=[0, 5, 10, 20, 40],
+                        help="mean of the exponential jitter term, ms")
+    parser.add_argument("--loss", type=float, default=0.01)
+    parser.add_argument("--base-delay", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for jitter in args.jitter:
+        r = simulate(args.frames, jitter, args.loss, args.base_delay, args.seed)
+        stats, quality = r["stats"], r["quality"]
+        sent = args.frames
+        print(f"jitter {jitter:>4.0f} ms | forwarded: {r['reordered'] / sent:>6.2%} reordered, "
+              f"gap deviation p99 {r['gap_p99']:>6.1f} ms | buffered: added delay p50 {r['added_p50']:>5.1f} ms "
+              f"p99 {r['added_p99']:>5.1f} ms, late {stats['late'] / sent:>6.2%}, "
+              f"concealed {stats['concealed'] / sent:>6.2%}, trimmed {stats['trimmed'] / sent:>6.2%}, "
+              f"target {stats['delay_ms']} ms | measured jitter {quality['jitter_ms']:>5.1f} ms, "
+              f"loss {quality['loss_rate']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
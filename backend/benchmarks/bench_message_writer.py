@@ -0,0 +1,57 @@
+"""Compare save_message latency: one transaction per message vs the write-behind queue.
+
+Run from the backend directory:
+    python benchmarks/bench_message_writer.py --messages 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_manager import UserManager
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(label, save, count, finish=None):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        save("alice", "bob", f"message {i}")
+        latencies.append(time.perf_counter() - t0)
+    if finish:
+        finish()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {count / elapsed:>10.0f} msg/s   "
+          f"p50 {percentile(latencies, 50) * 1e6:>7.1f} us   p99 {percentile(latencies, 99) * 1e6:>7.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = UserManager(os.path.join(tmp, "users.db"))
+
+        def save_direct(sender, receiver, message):
+            manager.db.execute(
+                "INSERT INTO chat_history (sender, receiver, message) VALUES (?, ?, ?)",
+                (sender, receiver, message)
+            )
+
+        run("per-message", save_direct, args.messages)
+        run("write-behind", manager.save_message, args.messages, finish=manager.flush_messages)
+        print(f"writer stats: {manager.writer.get_stats()}")
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
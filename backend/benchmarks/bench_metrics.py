@@ -0,0 +1,131 @@
+"""Cost of the /metrics instrumentation relative to the handlers it measures.
+
+Loads server.py in-process with a throwaway database and drives the
+instrumented handlers (login over the Flask test client, private_message,
+get_chat_history and file_transfer over Socket.IO test clients). For each
+it reports the handler's mean time and SQLite operations per call, read
+back from the histograms themselves, and what the instrumentation adds to
+every call:
+
+  timed wrapper  two perf_counter() calls and one Histogram.observe()
+  per query      the same again for each SQLite operation the call makes
+
+Both costs are measured directly (best of --rounds, against the bare
+call), because a 1% difference in handler time is well inside the noise of
+timing the handlers twice. Overhead is their sum as a share of the
+handler's mean time.
+
+Run from the backend directory:
+    python benchmarks/bench_metrics.py --calls 500
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from metrics import Metrics
+
+
+def best_per_call(func, calls, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def instrumentation_costs(rounds):
+    """(timed wrapper, per-query observation) cost in seconds, bare call subtracted"""
+    metrics = Metrics()
+
+    def handler():
+        return None
+
+    timed = metrics.timed("bench_seconds", "benchmark", handler="noop")(handler)
+    observe = metrics.observer("bench_query_seconds", "benchmark", "operation")
+
+    def query():
+        start = time.perf_counter()
+        observe("fetchone", time.perf_counter() - start)
+
+    calls = 200000
+    bare = best_per_call(handler, calls, rounds)
+    return best_per_call(timed, calls, rounds) - bare, best_per_call(query, calls, rounds) - bare
+
+
+def counts(server):
+    """({handler: (calls, total seconds)}, SQLite operations so far)"""
+    handlers, queries = {}, 0
+    for name, (_, family) in server.metrics.histograms.items():
+        for key, histogram in family.items():
+            cumulative, total = histogram.snapshot()
+            if name.endswith("handler_seconds"):
+                handlers[dict(key)["handler"]] = (cumulative[-1], total)
+            elif name.endswith("sqlite_query_seconds"):
+                queries += cumulative[-1]
+    return handlers, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # server.py writes its log and database relative to the working directory
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("CHATTERBOX_BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("CHATTERBOX_RATE_LIMIT_SCALE", "0")
+    import server
+    logging.getLogger(server.__name__).setLevel(logging.WARNING)
+
+    http = server.app.test_client()
+    credentials = {"username": "alice", "password": "benchmark-password"}
+    for username in ("alice", "bob"):
+        http.post("/api/register", json={**credentials, "username": username})
+    tokens = {username: server.user_manager.sessions.issue(username) for username in ("alice", "bob")}
+    alice = server.socketio.test_client(server.app, auth={"token": tokens["alice"]})
+    bob = server.socketio.test_client(server.app, auth={"token": tokens["bob"]})
+    for client in (alice, bob):
+        client.emit("user_online", {})
+        client.get_received()
+
+    workloads = [
+        ("login", lambda i: http.post("/api/login", json=credentials)),
+        ("private_message", lambda i: alice.emit("private_message", {"receiver": "bob", "message": f"hello {i}"})),
+        ("get_chat_history", lambda i: alice.emit("get_chat_history", {"user2": "bob", "limit": 50})),
+        ("file_transfer", lambda i: alice.emit("file_transfer", {"receiver": "bob", "file_name": f"note{i}.txt",
+                                                                 "file_data": "aGVsbG8gd29ybGQ="})),
+    ]
+
+    try:
+        wrapper_cost, query_cost = instrumentation_costs(args.rounds)
+        print(f"timed wrapper {wrapper_cost * 1e6:.2f} us/call   SQLite observation {query_cost * 1e6:.2f} us/query")
+        for name, send in workloads:
+            before, queries_before = counts(server)
+            for i in range(args.calls):
+                send(i)
+                bob.get_received()
+                alice.get_received()
+            server.user_manager.flush_messages()
+            after, queries_after = counts(server)
+            calls = after[name][0] - before.get(name, (0, 0))[0]
+            mean = (after[name][1] - before.get(name, (0, 0))[1]) / calls
+            # Includes the write-behind writer's batch commits triggered by the handler
+            queries = (queries_after - queries_before) / calls
+            overhead = wrapper_cost + queries * query_cost
+            print(f"  {name:<17} handler {mean * 1e6:>9.1f} us   SQLite ops/call {queries:>5.2f}   "
+                  f"instrumentation {overhead * 1e6:>5.2f} us ({overhead / mean:.2%})")
+    finally:
+        server.stop_services()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Presence fan-out cost of N users connecting: full-list broadcasts vs coalesced deltas.
+
+Counts the bytes the server would push to clients (payload size x online
+recipients) while --users clients log in at --rate per second. No sockets
+are opened; the old broadcast is costed arithmetically since materialising
+it at 10k users means tens of gigabytes.
+
+Run from the backend directory:
+    python benchmarks/bench_presence.py --users 10000 --rate 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from presence import PresenceBroadcaster
+
+
+def full_list_cost(usernames):
+    """Old scheme: each join broadcasts user_status_changed with the whole list to everyone"""
+    total = 0
+    list_bytes = 2  # "[]"
+    for online, username in enumerate(usernames, start=1):
+        list_bytes += len(json.dumps(username)) + (2 if online > 1 else 0)  # name plus ", "
+        frame = len(json.dumps({"username": username, "status": "online", "online_users": []})) + list_bytes - 2
+        # Old handler also sent the joiner its own copy of the list
+        total += frame * online + list_bytes
+    return total
+
+
+def delta_cost(usernames, rate, window):
+    """New scheme: one delta per window to everyone online, plus a snapshot per joiner"""
+    total = {"bytes": 0, "frames": 0, "payload": 0, "snapshots": 0}
+    online = {"count": 0}
+
+    def emit(event, payload):
+        size = len(json.dumps(payload))
+        total["payload"] += size
+        total["bytes"] += size * online["count"]
+        total["frames"] += online["count"]
+
+    broadcaster = PresenceBroadcaster(emit, window=window)
+    per_window = max(1, int(rate * window))
+    snapshot_bytes = 2
+    for i, username in enumerate(usernames, start=1):
+        snapshot_bytes += len(json.dumps(username)) + (2 if i > 1 else 0)
+        total["snapshots"] += snapshot_bytes + 40  # joiner's snapshot: list plus source/seq
+        broadcaster.joined(username)
+        online["count"] += 1
+        if i % per_window == 0:
+            broadcaster.flush()
+    broadcaster.flush()
+    return total, broadcaster.get_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=1000.0, help="logins per second")
+    parser.add_argument("--window", type=float, default=0.1, help="delta coalescing window in seconds")
+    args = parser.parse_args()
+
+    usernames = [f"user{i:05d}" for i in range(args.users)]
+
+    old_bytes = full_list_cost(usernames)
+    old_frames = args.users * (args.users + 1) // 2
+    print(f"full lists   {old_bytes / 1e9:>9.2f} GB   {old_frames:>12,} frames   "
+          f"{old_bytes / args.users / 1e3:>9.1f} KB per change")
+
+    start = time.perf_counter()
+    total, stats = delta_cost(usernames, args.rate, args.window)
+    elapsed = time.perf_counter() - start
+    new_bytes = total["bytes"] + total["snapshots"]
+    new_frames = total["frames"] + args.users
+    print(f"deltas       {new_bytes / 1e9:>9.2f} GB   {new_frames:>12,} frames   "
+          f"{new_bytes / args.users / 1e3:>9.1f} KB per change")
+    print(f"  broadcast  {total['bytes'] / 1e9:>9.2f} GB in {stats['deltas']} deltas, "
+          f"{total['payload'] / args.users:.1f} bytes of delta payload per change")
+    print(f"  snapshots  {total['snapshots'] / 1e9:>9.2f} GB (one per joining user)")
+    print(f"reduction    {old_bytes / new_bytes:>9.0f}x bytes, {old_frames / new_frames:.0f}x frames "
+          f"({elapsed:.2f}s CPU to build the deltas)")
+
+
+if __name__ == "__main__":
+    main()
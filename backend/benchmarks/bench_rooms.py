@@ -0,0 +1,145 @@
+"""Group message delivery cost versus group size: per-recipient messages vs a room.
+
+Loads server.py in-process with a throwaway database, connects one
+Socket.IO test client per member and has one member send --messages
+messages to the rest of the group two ways:
+
+  direct  one private_message event per recipient (how a group had to be
+          faked before rooms): N-1 chat_history rows and N-1 serialisations
+  room    one room_message event: one chat_history row and one packet
+          encoded once and written to every member's socket
+
+For each it reports chat_history rows written, packets serialised and
+bytes handed to the transport per message, and the time from the send
+until every member has the message (median and p99). Test clients receive
+in-process, so the times are server-side write and fan-out cost with no
+network in the way.
+
+Run from the backend directory:
+    python benchmarks/bench_rooms.py --members 10 100 1000 --messages 20
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+class WireCounter:
+    """Counts packets the server serialises and the bytes it sends"""
+
+    def __init__(self, server):
+        self.serialised = 0
+        self.last = None
+        self.sent = 0
+        self.bytes = 0
+        # Wraps the test clients' delivery hook, which each new test client re-installs
+        self.send = server._send_eio_packet
+        server._send_eio_packet = self._send_eio_packet
+
+    def _send_eio_packet(self, eio_sid, eio_pkt):
+        # A room emit hands the same encoded packet to every socket in turn
+        if eio_pkt is not self.last:
+            self.serialised += 1
+            self.last = eio_pkt
+        self.sent += 1
+        self.bytes += len(eio_pkt.data)
+        return self.send(eio_sid, eio_pkt)
+
+    def reset(self):
+        self.serialised = 0
+        self.sent = 0
+        self.bytes = 0
+
+
+def chat_rows(server):
+    server.user_manager.flush_messages()
+    return server.user_manager.db.fetchone("SELECT COUNT(*) FROM chat_history")[0]
+
+
+def wait_delivered(clients, event, expected):
+    for client in clients:
+        received = [packet for packet in client.get_received() if packet["name"] == event]
+        assert len(received) == expected, (event, len(received), expected)
+
+
+def measure(name, server, counter, sender, recipients, messages, send, event):
+    rows_before = chat_rows(server)
+    counter.reset()
+    times = []
+    for i in range(messages):
+        start = time.perf_counter()
+        send(i)
+        # Test clients receive synchronously, so every member has it once the handler returns
+        times.append(time.perf_counter() - start)
+    wait_delivered(recipients, event, messages)
+    sender.get_received()
+    rows = chat_rows(server) - rows_before
+    times.sort()
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print(f"  {name:<7} rows/msg {rows / messages:>6.0f}   serialised/msg {counter.serialised / messages:>6.0f}   "
+          f"sent/msg {counter.sent / messages:>6.0f}   kB/msg {counter.bytes / messages / 1e3:>7.1f}   "
+          f"delivery p50 {statistics.median(times) * 1e3:>8.2f} ms  p99 {p99 * 1e3:>8.2f} ms")
+
+
+def run(server, members, messages, group):
+    usernames = [f"g{group}m{i}" for i in range(members)]
+    server.user_manager.db.executemany(
+        "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+        [(username, "unused") for username in usernames]
+    )
+    clients = []
+    for username in usernames:
+        token = server.user_manager.sessions.issue(username)
+        client = server.socketio.test_client(server.app, auth={"token": token})
+        client.emit("user_online", {})
+        client.get_received()
+        clients.append(client)
+    sender, recipients = clients[0], clients[1:]
+
+    sender.emit("create_room", {"name": f"group {group}", "members": usernames[1:]})
+    room = next(packet["args"][0] for packet in sender.get_received() if packet["name"] == "room_created")
+    for client in recipients:
+        client.get_received()
+
+    counter = WireCounter(server.socketio.server)
+    print(f"{members} members")
+    measure("direct", server, counter, sender, recipients, messages,
+            lambda i: [sender.emit("private_message", {"receiver": receiver, "message": f"hello {i}"})
+                       for receiver in usernames[1:]],
+            "private_message")
+    measure("room", server, counter, sender, recipients, messages,
+            lambda i: sender.emit("room_message", {"room_id": room["id"], "message": f"hello {i}"}),
+            "room_message")
+
+    for client in clients:
+        client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    # server.py writes its log and database relative to the working directory
+    os.chdir(tempfile.mkdtemp())
+    # The direct-send baseline floods private_message far past the per-socket limit
+    os.environ.setdefault("CHATTERBOX_RATE_LIMIT_SCALE", "0")
+    import server
+    logging.getLogger(server.__name__).setLevel(logging.WARNING)
+
+    try:
+        for group, members in enumerate(args.members):
+            run(server, members, args.messages, group)
+    finally:
+        server.stop_services()
+
+
+if __name__ == "__main__":
+    main()
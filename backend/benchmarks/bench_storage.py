@@ -0,0 +1,60 @@
+"""Compare chat_history insert throughput: connect-per-call vs the pooled Database.
+
+Run from the backend directory:
+    python benchmarks/bench_storage.py --messages 5000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_manager import UserManager
+
+
+def save_message_unpooled(db_path, sender, receiver, message):
+    """The original per-call connect/commit/close pattern"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO chat_history (sender, receiver, message) VALUES (?, ?, ?)",
+        (sender, receiver, message)
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(label, save, count):
+    start = time.perf_counter()
+    for i in range(count):
+        save("alice", "bob", f"message {i}")
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {count / elapsed:>10.0f} messages/sec  ({elapsed * 1e6 / count:.1f} us/message)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before_path = os.path.join(tmp, "before", "users.db")
+        after_path = os.path.join(tmp, "after", "users.db")
+
+        # Same schema for both runs, but the baseline keeps SQLite's default rollback journal
+        UserManager(before_path).close()
+        conn = sqlite3.connect(before_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        run("before", lambda s, r, m: save_message_unpooled(before_path, s, r, m), args.messages)
+
+        manager = UserManager(after_path)
+        run("after", manager.save_message, args.messages)
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
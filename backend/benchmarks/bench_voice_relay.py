@@ -0,0 +1,301 @@
+"""UDP voice relay throughput and latency: legacy text protocol vs binary fast path.
+
+Runs the relay in this process and a load generator (one sender, one
+receiver socket) in a child process. The generator registers both call
+legs, sends --packets 320-byte frames (20 ms of 8 kHz 16-bit PCM) and
+reports delivered packets/sec and relay latency. Relay CPU time per
+packet comes from this process's rusage.
+
+With --calls the benchmark measures concurrent-call capacity instead: the
+generator opens two sockets per call (one per leg, each with its own
+source port so SO_REUSEPORT spreads them over the relay's shards) and
+every leg sends a frame to the other every 20 ms for --seconds. A call
+counts as carried when both directions deliver at least 95% of frames.
+
+--junk N also sends N packets per frame from a third socket that is not in
+the call: legacy VOICE:mallory:bob: text, binary frames with unknown
+tokens and REGISTER:bob: with guessed tokens. Forwarded junk reaching the
+receiver is counted; call-scoped routing should forward none of it.
+
+--batch N switches the relay to recvmmsg/sendmmsg with N datagrams per
+call (Linux only); both modes then also report syscalls per relayed packet.
+
+Run from the backend directory:
+    python benchmarks/bench_voice_relay.py --packets 200000
+    python benchmarks/bench_voice_relay.py --rate 5000    # latency at a fixed packet rate
+    python benchmarks/bench_voice_relay.py --calls 200 --shards 1 2 4
+    python benchmarks/bench_voice_relay.py --mode binary --batch 0 32
+    python benchmarks/bench_voice_relay.py --rate 5000 --junk 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_chat import VoiceChatManager, HEADER, PACKET_REGISTER, PACKET_VOICE
+
+FRAME = 320
+FRAME_INTERVAL = 0.02  # one frame per leg every 20 ms
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+JUNK_SIZE = 64  # junk payloads are far smaller than a frame, so the receiver can tell them apart
+
+
+def junk_packets(count):
+    """Packets from someone outside the call, cycling through the ways to ask for relaying"""
+    rng = random.Random(0)
+    kinds = [
+        lambda: b"VOICE:mallory:bob:" + b"j" * JUNK_SIZE,
+        lambda: HEADER.pack(PACKET_VOICE, rng.getrandbits(64)) + b"j" * JUNK_SIZE,
+        lambda: f"REGISTER:bob:{rng.getrandbits(64):016x}".encode(),
+    ]
+    return [kinds[i % len(kinds)]() for i in range(count)]
+
+
+def generate(port, mode, tokens, packets, rate, junk, results):
+    relay = ("127.0.0.1", port)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    receiver.settimeout(1.0)
+
+    if mode == "binary":
+        sender.sendto(HEADER.pack(PACKET_REGISTER, tokens[0]), relay)
+        receiver.sendto(HEADER.pack(PACKET_REGISTER, tokens[1]), relay)
+        sender.recv(64)
+        receiver.recv(64)
+        prefix = HEADER.pack(PACKET_VOICE, tokens[0])
+        stamp_at = 1  # relayed frames are [kind:1][payload]
+    else:
+        sender.sendto(f"REGISTER:alice:{tokens[0]:016x}".encode(), relay)
+        receiver.sendto(f"REGISTER:bob:{tokens[1]:016x}".encode(), relay)
+        time.sleep(0.2)
+        prefix = b"VOICE:alice:bob:"
+        stamp_at = len(b"FROM:alice:")
+
+    attacker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    junk_cycle = junk_packets(max(junk, 1) * 3)
+    latencies = []
+    received = [0]
+    junk_received = [0]
+
+    def receive():
+        while True:
+            try:
+                data = receiver.recv(2048)
+            except socket.timeout:
+                return
+            if len(data) < FRAME:
+                junk_received[0] += 1
+                continue
+            received[0] += 1
+            if received[0] % 16 == 0:
+                latencies.append(time.monotonic() - struct.unpack_from("!d", data, stamp_at)[0])
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+
+    padding = b"\0" * (FRAME - 8)
+    interval = 1.0 / rate if rate else 0
+    start = time.monotonic()
+    for i in range(packets):
+        if interval:
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        sender.sendto(prefix + struct.pack("!d", time.monotonic()) + padding, relay)
+        for j in range(junk):
+            attacker.sendto(junk_cycle[(i * junk + j) % len(junk_cycle)], relay)
+    send_elapsed = time.monotonic() - start
+    thread.join()
+    elapsed = time.monotonic() - start - 1.0  # minus the receiver's idle timeout
+    results.put((received[0], max(elapsed, send_elapsed), latencies, junk_received[0]))
+
+
+def generate_calls(port, tokens, seconds, results):
+    relay = ("127.0.0.1", port)
+    legs = []  # (socket, send prefix) per call leg
+    for leg_tokens in tokens:
+        for token in leg_tokens:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.sendto(HEADER.pack(PACKET_REGISTER, token), relay)
+            sock.settimeout(2.0)
+            sock.recv(64)
+            sock.setblocking(False)
+            legs.append((sock, HEADER.pack(PACKET_VOICE, token)))
+
+    received = [0] * len(legs)
+    latencies = []
+    done = threading.Event()
+
+    def receive():
+        selector = selectors.DefaultSelector()
+        for index, (sock, _) in enumerate(legs):
+            selector.register(sock, selectors.EVENT_READ, index)
+        idle_since = None
+        while True:
+            events = selector.select(0.2)
+            if not events:
+                if done.is_set():
+                    idle_since = idle_since or time.monotonic()
+                    if time.monotonic() - idle_since > 0.5:
+                        return
+                continue
+            for key, _ in events:
+                while True:
+                    try:
+                        data = key.fileobj.recv(2048)
+                    except BlockingIOError:
+                        break
+                    received[key.data] += 1
+                    if received[key.data] % 25 == 0:
+                        latencies.append(time.monotonic() - struct.unpack_from("!d", data, 1)[0])
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+
+    padding = b"\0" * (FRAME - 8)
+    ticks = int(seconds / FRAME_INTERVAL)
+    start = time.monotonic()
+    late = 0
+    for tick in range(ticks):
+        delay = start + tick * FRAME_INTERVAL - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            late += 1
+        for sock, prefix in legs:
+            try:
+                sock.sendto(prefix + struct.pack("!d", time.monotonic()) + padding, relay)
+            except BlockingIOError:
+                pass
+    done.set()
+    thread.join()
+    results.put((ticks, received, latencies, late))
+
+
+def syscalls_per_packet(stats):
+    """Relay syscalls per binary frame relayed, formatted for the report line"""
+    if stats["relayed"] == 0:
+        return "n/a"
+    if "recv_calls" in stats:
+        calls = stats["recv_calls"] + stats["send_calls"]
+    else:
+        # Unbatched: one recvfrom_into per datagram plus one sendto per relayed frame
+        calls = stats["relayed"] + stats["mixed"] + stats["dropped"] + stats["legacy"] + stats["relayed"]
+    return f"{calls / stats['relayed']:.2f}"
+
+
+def run_calls(calls, shards, seconds, batch):
+    manager = VoiceChatManager(udp_port=0, shards=shards, batch_size=batch)
+    manager.start_udp_server()
+    for sock in manager.udp_sockets:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+    tokens = []
+    for i in range(calls):
+        call_id = manager.initiate_call(f"caller{i}", f"callee{i}")["call_id"]
+        manager.accept_call(call_id, f"callee{i}")
+        call_tokens = manager.get_call(call_id).tokens
+        tokens.append((call_tokens[f"caller{i}"], call_tokens[f"callee{i}"]))
+
+    results = multiprocessing.Queue()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    child = multiprocessing.Process(target=generate_calls, args=(manager.udp_port, tokens, seconds, results))
+    child.start()
+    ticks, received, latencies, late = results.get()
+    child.join()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    stats = manager.get_stats()
+    manager.stop_udp_server()
+
+    # Leg 2i receives what leg 2i+1 sent and vice versa
+    carried = sum(1 for i in range(calls) if min(received[2 * i], received[2 * i + 1]) >= ticks * 0.95)
+    delivered = sum(received) / (ticks * len(received))
+    line = (f"{calls:>5} calls  {manager.shards} shards  batch {manager.batch_size:>3}   "
+            f"{delivered:>6.1%} frames delivered   {carried:>5} calls carried   "
+            f"relay CPU {cpu / seconds:>5.0%} ({cpu / seconds / calls * 1e3:.2f} ms/s per call)   "
+            f"{syscalls_per_packet(stats)} syscalls/pkt")
+    if latencies:
+        line += (f"   latency p50 {percentile(latencies, 50) * 1e6:>6.0f} us"
+                 f"  p99 {percentile(latencies, 99) * 1e6:>7.0f} us")
+    if late > ticks * 0.05:
+        line += f"   (generator fell behind on {late}/{ticks} ticks)"
+    print(line)
+
+
+def run(mode, packets, rate, batch, junk):
+    manager = VoiceChatManager(udp_port=0, batch_size=batch, legacy_protocol=mode == "legacy")
+    manager.start_udp_server()
+    port = manager.udp_socket.getsockname()[1]
+    manager.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+    call_id = manager.initiate_call("alice", "bob")["call_id"]
+    manager.accept_call(call_id, "bob")
+    tokens = [manager.get_call(call_id).tokens[user] for user in ("alice", "bob")]
+
+    results = multiprocessing.Queue()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    child = multiprocessing.Process(target=generate, args=(port, mode, tokens, packets, rate, junk, results))
+    child.start()
+    received, elapsed, latencies, junk_received = results.get()
+    child.join()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    stats = manager.get_stats()
+    manager.stop_udp_server()
+
+    line = (f"{mode:<7} batch {manager.batch_size:>3} {received:>8} / {packets} delivered   "
+            f"{received / elapsed:>9.0f} pkt/s   relay CPU {cpu / max(received, 1) * 1e6:>6.1f} us/pkt   "
+            f"{syscalls_per_packet(stats)} syscalls/pkt")
+    if latencies:
+        line += (f"   latency p50 {percentile(latencies, 50) * 1e6:>7.0f} us"
+                 f"  p99 {percentile(latencies, 99) * 1e6:>7.0f} us")
+    if junk:
+        line += f"   junk forwarded {junk_received} / {packets * junk}, dropped {stats['dropped']}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--packets", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=0, help="packets/sec to send (0 = as fast as possible)")
+    parser.add_argument("--mode", choices=["legacy", "binary", "both"], default="both")
+    parser.add_argument("--calls", type=int, nargs="+", default=None,
+                        help="measure concurrent-call capacity at these call counts instead")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1], help="relay sockets (with --calls)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="call duration (with --calls)")
+    parser.add_argument("--batch", type=int, nargs="+", default=[0],
+                        help="recvmmsg/sendmmsg batch sizes to compare (0 = unbatched)")
+    parser.add_argument("--junk", type=int, default=0, help="non-call packets sent per frame")
+    args = parser.parse_args()
+
+    if args.calls:
+        for calls in args.calls:
+            for shards in args.shards:
+                for batch in args.batch:
+                    run_calls(calls, shards, args.seconds, batch)
+        return
+
+    for mode in (["legacy", "binary"] if args.mode == "both" else [args.mode]):
+        for batch in args.batch:
+            run(mode, args.packets, args.rate, batch, args.junk)
+
+
+if __name__ == "__main__":
+    main()
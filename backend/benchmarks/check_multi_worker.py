@@ -0,0 +1,100 @@
+"""Route a private message between two server workers over a stand-in broker.
+
+Loads server.py twice as independent workers (separate Socket.IO servers,
+managers and presence tables) wired to the same in-process memory:// bus,
+serves them on two ports, connects alice to worker A and bob to worker B
+with real Socket.IO clients, and checks that a message from alice reaches
+bob and presence is visible on both sides.
+
+Needs the python-socketio client extras (pip install "python-socketio[client]").
+Run from the backend directory:
+    python benchmarks/check_multi_worker.py
+"""
+import importlib.util
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+import socketio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def load_worker(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BACKEND_DIR, "server.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def serve(worker, port):
+    thread = threading.Thread(
+        target=worker.socketio.run, args=(worker.app,),
+        kwargs={"host": "127.0.0.1", "port": port, "allow_unsafe_werkzeug": True, "log_output": False},
+        daemon=True
+    )
+    thread.start()
+
+
+def connect(port, username, token):
+    client = socketio.Client()
+    inbox = queue.Queue()
+    client.on("private_message", inbox.put)
+    for _ in range(50):
+        try:
+            client.connect(f"http://127.0.0.1:{port}", transports=["websocket"], auth={"token": token})
+            break
+        except socketio.exceptions.ConnectionError:
+            time.sleep(0.1)
+    client.emit("user_online", {"username": username})
+    return client, inbox
+
+
+def main():
+    os.environ["CHATTERBOX_MESSAGE_QUEUE"] = "memory://check-multi-worker"
+    os.environ["CHATTERBOX_BCRYPT_ROUNDS"] = "4"
+    # Both workers must sign and check session tokens with the same key
+    os.environ.setdefault("CHATTERBOX_SECRET_KEY", "check-multi-worker")
+    os.chdir(tempfile.mkdtemp())
+
+    worker_a = load_worker("worker_a")
+    worker_b = load_worker("worker_b")
+    worker_a.start_services(voice=False)
+    worker_b.start_services(voice=False)
+
+    # Both workers share the users database and signing key, so either accepts the tokens
+    tokens = {}
+    for username in ("alice", "bob"):
+        worker_a.user_manager.register_user(username, "password")
+        tokens[username] = worker_a.user_manager.login_user(username, "password")["token"]
+
+    serve(worker_a, 5101)
+    serve(worker_b, 5102)
+    alice, _ = connect(5101, "alice", tokens["alice"])
+    bob, bob_inbox = connect(5102, "bob", tokens["bob"])
+    time.sleep(0.3)
+
+    assert worker_a.user_manager.is_user_online("bob"), "worker A does not see bob"
+    assert worker_b.user_manager.is_user_online("alice"), "worker B does not see alice"
+
+    alice.emit("private_message", {"sender": "alice", "receiver": "bob", "message": "hello from A"})
+    message = bob_inbox.get(timeout=2)
+    assert message["message"] == "hello from A", message
+    print(f"bob on worker B received: {message['message']!r} from {message['sender']}")
+
+    bob.disconnect()
+    time.sleep(0.3)
+    assert not worker_a.user_manager.is_user_online("bob"), "worker A still routes to bob"
+    print("presence and routing are shared across workers")
+    alice.disconnect()
+
+    for worker in (worker_a, worker_b):
+        worker.stop_services()
+
+
+if __name__ == "__main__":
+    main()
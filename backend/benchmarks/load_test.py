@@ -0,0 +1,319 @@
+"""Socket.IO load test: hold many connections open and measure message latency.
+
+Start a server first (e.g. python serve.py --async-mode eventlet), then:
+    python benchmarks/load_test.py --url http://localhost:5000 --clients 1000 --duration 30
+
+Clients are paired up; each sends private messages to its partner at --rate
+per second. Latency is measured from send to delivery at the partner, so
+run the load generator on the server host (or on clock-synced machines).
+
+Every client registers and logs in over HTTP for its session token; start
+the server with CHATTERBOX_BCRYPT_ROUNDS=4 to keep that ramp fast.
+
+--logins N adds N concurrent /api/login loops during the measurement, to
+check that a login storm (bcrypt) does not hold up message delivery:
+    python benchmarks/load_test.py --clients 200 --logins 50
+
+--abusers N adds N clients that flood private_message and typing at the
+regular clients at --abuse-rate events per second each, to check that per-socket rate limits
+keep the regular clients' tail latency flat (compare against a server
+started with CHATTERBOX_RATE_LIMIT_SCALE=0). The abusers run in a child
+process, so their own send work does not hold up the regular clients'
+event loop and show up as server latency:
+    python benchmarks/load_test.py --clients 200 --abusers 10
+
+--typing K makes every regular client also type at its partner: bursts of
+K keystrokes per second (one typing event each) separated by pauses, with
+only every other client sending is_typing false at the end of a burst. The
+server should forward start/stop transitions only, so compare typing events
+sent with user_typing events received (and against a server started with
+CHATTERBOX_TYPING_WINDOW=0, which forwards every event):
+    python benchmarks/load_test.py --clients 200 --typing 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+import aiohttp
+import socketio
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.peak_connected = 0
+        self.connect_failures = 0
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.latencies = []
+        self.logins = 0
+        self.logins_busy = 0
+        self.login_latencies = []
+        self.abuse_sent = 0
+        self.abuse_rejected = 0
+        self.abuse_received = 0
+        self.abuse_disconnected = 0
+        self.typing_sent = 0
+        self.typing_received = 0
+
+
+async def login(url, username, password="load-test-password"):
+    """Register username if needed and return a session token"""
+    credentials = {"username": username, "password": password}
+    async with aiohttp.ClientSession() as session:
+        for endpoint in ("register", "login"):
+            # The server sheds hashing load with 503 + Retry-After
+            while True:
+                async with session.post(f"{url}/api/{endpoint}", json=credentials) as response:
+                    body = await response.json()
+                    if response.status != 503:
+                        break
+                    await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+        return body["token"]
+
+
+async def run_client(index, args, stats, started, stop):
+    client = socketio.AsyncClient(reconnection=False)
+    username = f"load_{os.getpid()}_{index}"
+    partner = f"load_{os.getpid()}_{index ^ 1}"
+
+    @client.on('private_message')
+    async def on_message(data):
+        # Abusers' messages that got through carry their own (client-side queued) timestamps
+        if data.get("sender") != partner:
+            stats.abuse_received += 1
+            return
+        stats.received += 1
+        stats.latencies.append(time.time() - float(data["timestamp"]))
+
+    @client.on('error')
+    async def on_error(data):
+        stats.errors += 1
+
+    @client.on('user_typing')
+    async def on_typing(data):
+        stats.typing_received += 1
+
+    try:
+        token = await login(args.url, username)
+        await client.connect(args.url, transports=['websocket'], wait_timeout=30, auth={"token": token})
+    except Exception:
+        stats.connect_failures += 1
+        started.release()
+        return
+
+    stats.connected += 1
+    stats.peak_connected = max(stats.peak_connected, stats.connected)
+    await client.emit('user_online', {"username": username})
+    started.release()
+
+    interval = 1.0 / args.rate if args.rate > 0 else None
+    typing = asyncio.create_task(run_typing(client, index, partner, args, stats, stop)) if args.typing else None
+    try:
+        while not stop.is_set():
+            if interval:
+                await client.emit('private_message', {
+                    "sender": username,
+                    "receiver": partner,
+                    "message": "x" * args.size,
+                    "timestamp": str(time.time())
+                })
+                stats.sent += 1
+            try:
+                await asyncio.wait_for(stop.wait(), interval or 1.0)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if typing:
+            await typing
+        stats.connected -= 1
+        await client.disconnect()
+
+
+async def run_typing(client, index, partner, args, stats, stop):
+    """Keystroke-rate typing events at partner: --typing-burst seconds of typing, then a pause"""
+    # Stagger the bursts so the server sees a steady stream rather than waves
+    await asyncio.sleep((index % 10) / 10 * args.typing_burst)
+    while not stop.is_set():
+        burst_end = time.perf_counter() + args.typing_burst
+        while time.perf_counter() < burst_end and not stop.is_set():
+            await client.emit('typing', {"receiver": partner, "is_typing": True})
+            stats.typing_sent += 1
+            await asyncio.sleep(1.0 / args.typing)
+        # Half the clients never say they stopped; the server times them out
+        if index % 2 and not stop.is_set():
+            await client.emit('typing', {"receiver": partner, "is_typing": False})
+            stats.typing_sent += 1
+        try:
+            await asyncio.wait_for(stop.wait(), args.typing_pause)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_logins(args, stats, stop):
+    """Log the same user in over and over until stop is set"""
+    username = f"login_{os.getpid()}"
+    credentials = {"username": username, "password": "load-test-password"}
+    async with aiohttp.ClientSession() as session:
+        # Registration fails harmlessly if another loop got there first
+        async with session.post(f"{args.url}/api/register", json=credentials) as response:
+            await response.read()
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            async with session.post(f"{args.url}/api/login", json=credentials) as response:
+                await response.read()
+                if response.status == 200:
+                    stats.logins += 1
+                    stats.login_latencies.append(time.perf_counter() - t0)
+                elif response.status == 503:
+                    stats.logins_busy += 1
+                    await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+async def run_abuser(index, args, target_pid, stats, stop):
+    """Flood messages and typing events at the regular clients until stop is set"""
+    client = socketio.AsyncClient(reconnection=False)
+    username = f"abuse_{os.getpid()}_{index}"
+
+    @client.on('error')
+    async def on_error(data):
+        stats.abuse_rejected += 1
+
+    @client.on('disconnect')
+    async def on_disconnect(*args):
+        # The server cuts off sockets that keep flooding
+        if not stop.is_set():
+            stats.abuse_disconnected += 1
+
+    token = await login(args.url, username)
+    await client.connect(args.url, transports=['websocket'], wait_timeout=30, auth={"token": token})
+    await client.emit('user_online', {"username": username})
+    target = 0
+    # Sent in 10 ms bursts; an unpaced flood mostly measures the load generator starving itself
+    burst = max(1, int(args.abuse_rate / 200))
+    try:
+        while not stop.is_set() and client.connected:
+            for _ in range(burst):
+                target = (target + 1) % args.clients
+                receiver = f"load_{target_pid}_{target}"
+                await client.emit('private_message', {"receiver": receiver, "message": "spam" * 16,
+                                                      "timestamp": str(time.time())})
+                await client.emit('typing', {"receiver": receiver, "is_typing": True})
+                stats.abuse_sent += 2
+            await asyncio.sleep(0.01)
+    finally:
+        await client.disconnect()
+
+
+def run_abusers(args, target_pid, stop, results):
+    """Child process: flood from args.abusers clients until stop is set, then report counts"""
+    stats = Stats()
+
+    async def flood():
+        done = asyncio.Event()
+        tasks = [asyncio.create_task(run_abuser(i, args, target_pid, stats, done)) for i in range(args.abusers)]
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        done.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(flood())
+    results.put((stats.abuse_sent, stats.abuse_rejected, stats.abuse_disconnected))
+
+
+async def main_async(args):
+    stats = Stats()
+    stop = asyncio.Event()
+    started = asyncio.Semaphore(0)
+
+    tasks = []
+    ramp_start = time.perf_counter()
+    for i in range(args.clients):
+        tasks.append(asyncio.create_task(run_client(i, args, stats, started, stop)))
+        if args.ramp and i % args.ramp == args.ramp - 1:
+            await asyncio.sleep(0.1)
+    for _ in range(args.clients):
+        await started.acquire()
+    print(f"connected {stats.connected}/{args.clients} clients in "
+          f"{time.perf_counter() - ramp_start:.1f}s ({stats.connect_failures} failed)")
+
+    # Let connect-time broadcasts settle before measuring
+    await asyncio.sleep(args.warmup)
+    login_stop = asyncio.Event()
+    login_tasks = [asyncio.create_task(run_logins(args, stats, login_stop)) for _ in range(args.logins)]
+    abuse_stop, abuse_results = multiprocessing.Event(), multiprocessing.Queue()
+    abusers = multiprocessing.Process(target=run_abusers, args=(args, os.getpid(), abuse_stop, abuse_results))
+    if args.abusers:
+        abusers.start()
+    stats.latencies.clear()
+    sent, received = stats.sent, stats.received
+    typing_sent, typing_received = stats.typing_sent, stats.typing_received
+    measure_start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - measure_start
+    concurrent = stats.connected
+    sent, received = stats.sent - sent, stats.received - received
+    typing_sent, typing_received = stats.typing_sent - typing_sent, stats.typing_received - typing_received
+    latencies = list(stats.latencies)
+    stop.set()
+    login_stop.set()
+    await asyncio.gather(*tasks, *login_tasks, return_exceptions=True)
+    if args.abusers:
+        abuse_stop.set()
+        stats.abuse_sent, stats.abuse_rejected, stats.abuse_disconnected = abuse_results.get()
+        abusers.join()
+
+    print(f"concurrent connections  {concurrent} (peak {stats.peak_connected})")
+    print(f"messages sent/received  {sent}/{received} "
+          f"({received / elapsed:.0f} msg/s delivered, {stats.errors} errors)")
+    if latencies:
+        print(f"latency                 p50 {percentile(latencies, 50) * 1e3:.1f} ms   "
+              f"p99 {percentile(latencies, 99) * 1e3:.1f} ms   "
+              f"max {max(latencies) * 1e3:.1f} ms")
+    if args.typing:
+        print(f"typing sent/received    {typing_sent}/{typing_received} "
+              f"({typing_received / max(1, typing_sent):.1%} of typing events forwarded)")
+    if args.abusers:
+        print(f"abusive events sent     {stats.abuse_sent} ({stats.abuse_sent / elapsed:.0f}/s), "
+              f"{stats.abuse_rejected} rate-limit errors received, "
+              f"{stats.abuse_received} delivered, {stats.abuse_disconnected} abusers disconnected")
+    if args.logins:
+        print(f"logins                  {stats.logins / elapsed:.1f}/s ok, {stats.logins_busy} rejected as busy")
+        if stats.login_latencies:
+            print(f"login latency           p50 {percentile(stats.login_latencies, 50) * 1e3:.1f} ms   "
+                  f"p99 {percentile(stats.login_latencies, 99) * 1e3:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds to wait before measuring")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per client")
+    parser.add_argument("--size", type=int, default=64, help="message body size in bytes")
+    parser.add_argument("--logins", type=int, default=0, help="concurrent login loops while measuring")
+    parser.add_argument("--abusers", type=int, default=0, help="clients flooding messages while measuring")
+    parser.add_argument("--abuse-rate", type=float, default=1000, help="events per second per abusive client")
+    parser.add_argument("--typing", type=float, default=0, help="keystrokes per second while typing")
+    parser.add_argument("--typing-burst", type=float, default=3.0, help="seconds of typing per burst")
+    parser.add_argument("--typing-pause", type=float, default=7.0,
+                        help="seconds between bursts; longer than the server's typing timeout")
+    parser.add_argument("--ramp", type=int, default=100, help="clients to connect per 100 ms")
+    args = parser.parse_args()
+    if args.clients % 2:
+        sys.exit("--clients must be even so every client has a partner")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
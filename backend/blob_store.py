@@ -0,0 +1,69 @@
+import os
+import hashlib
+import shutil
+import tempfile
+
+class BlobStore:
+    """Content-addressed file storage; per-user copies are hard links to one blob"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def is_valid_digest(digest):
+        """True for a lowercase hex SHA-256 digest"""
+        return (
+            isinstance(digest, str) and len(digest) == 64
+            and all(c in "0123456789abcdef" for c in digest)
+        )
+
+    def path_for(self, digest):
+        """On-disk location of a blob, fanned out by digest prefix"""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def has(self, digest):
+        """Check whether a blob is already stored"""
+        return self.is_valid_digest(digest) and os.path.isfile(self.path_for(digest))
+
+    def put_file(self, src_path, digest):
+        """Move src_path into the store, or drop it if the blob already exists"""
+        blob_path = self.path_for(digest)
+        if os.path.exists(blob_path):
+            os.remove(src_path)
+            return blob_path, False
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(src_path, blob_path)
+        return blob_path, True
+
+    def put_bytes(self, data):
+        """Store an in-memory payload and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self.path_for(digest)):
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self.put_file(tmp_path, digest)
+        return digest
+
+    def link(self, digest, dest_path):
+        """Expose a blob at dest_path without copying its data"""
+        blob_path = self.path_for(digest)
+        try:
+            os.link(blob_path, dest_path)
+        except FileExistsError:
+            raise
+        except OSError:
+            # Filesystems without hard links (or a different device) get a real copy
+            with open(blob_path, 'rb') as src, open(dest_path, 'xb') as dst:
+                shutil.copyfileobj(src, dst)
+        return dest_path
+
+    def remove(self, digest):
+        """Delete a blob once nothing references it any more"""
+        try:
+            os.remove(self.path_for(digest))
+            return True
+        except OSError:
+            return False
@@ -0,0 +1,102 @@
+import threading
+import numpy as np
+from voice_quality import AdaptiveJitterBuffer
+
+FRAME_SAMPLES = 160  # 20 ms of 8 kHz mono 16-bit PCM
+FRAME_INTERVAL = 0.02
+PCM = np.dtype("<i2")
+
+def mix_minus(frames):
+    """Mix an (N, samples) int16 array into N streams, each without its own row
+
+    The sum is taken once in int32 and every participant's own audio is
+    subtracted from it, so the cost is O(N) rather than O(N^2), then
+    clipped back to the int16 range.
+    """
+    total = frames.sum(axis=0, dtype=np.int32)
+    mixed = total - frames
+    np.clip(mixed, -32768, 32767, out=mixed)
+    return mixed.astype(PCM)
+
+class Conference:
+    """Participants of one conference call, mixed into one stream per listener"""
+
+    def __init__(self, conference_id, host, max_participants=16, frame_samples=FRAME_SAMPLES, invited=()):
+        self.conference_id = conference_id
+        self.host = host
+        self.invited = set(invited)  # Besides the host, the only users who may join
+        self.max_participants = max_participants
+        self.frame_samples = frame_samples
+        self.members = {}  # {token: (route, AdaptiveJitterBuffer)}
+        self.lock = threading.Lock()
+        self.frames = np.zeros((0, frame_samples), dtype=PCM)
+        self.stats = {"ticks": 0, "mixed": 0, "sent": 0}
+
+    def may_join(self, username):
+        """Whether username is the host or was invited"""
+        return username == self.host or username in self.invited
+
+    def add(self, route):
+        """Start mixing for route; False when the conference is full"""
+        with self.lock:
+            if len(self.members) >= self.max_participants:
+                return False
+            self.members[route.token] = (route, AdaptiveJitterBuffer(route.quality))
+            return True
+
+    def remove(self, token):
+        """Stop mixing for token; returns the route that was removed, if any"""
+        with self.lock:
+            member = self.members.pop(token, None)
+            return member[0] if member else None
+
+    def receive(self, token, frame, seq=None):
+        """Buffer one PCM frame sent by a participant"""
+        member = self.members.get(token)
+        if member is not None:
+            member[1].push(seq, frame)
+
+    def tick(self):
+        """Mix one frame period; returns [(address, pcm bytes)] for every reachable listener"""
+        with self.lock:
+            members = list(self.members.values())
+        self.stats["ticks"] += 1
+        if len(members) < 2:
+            return []
+        if self.frames.shape[0] != len(members):
+            self.frames = np.zeros((len(members), self.frame_samples), dtype=PCM)
+
+        frames = self.frames
+        samples = self.frame_samples
+        speaking = 0
+        for row, (_, jitter) in enumerate(members):
+            frame = jitter.pop()
+            if frame is None:
+                frames[row] = 0
+                continue
+            count = min(len(frame) // 2, samples)
+            frames[row, :count] = np.frombuffer(frame, dtype=PCM, count=count)
+            frames[row, count:] = 0
+            speaking += 1
+        if not speaking:
+            # Nobody to hear; clients fill silence themselves
+            return []
+
+        mixed = mix_minus(frames)
+        self.stats["mixed"] += 1
+        out = [(route.addr, mixed[row].tobytes()) for row, (route, _) in enumerate(members) if route.addr]
+        self.stats["sent"] += len(out)
+        return out
+
+    def get_info(self):
+        """Participants and mixer/jitter counters"""
+        with self.lock:
+            members = list(self.members.values())
+        return {
+            "conference_id": self.conference_id,
+            "host": self.host,
+            "participants": [route.username for route, _ in members],
+            "quality": {route.username: route.quality.get_stats() for route, _ in members},
+            "jitter": {route.username: jitter.get_stats() for route, jitter in members},
+            **self.stats
+        }
@@ -0,0 +1,122 @@
+from socketio import packet
+
+class Envelope(dict):
+    """Event payload that is serialized at most once per wire format
+
+    Build it like a dict and treat it as read-only afterwards: the first
+    packet that carries it caches the encoded bytes, and every later emit
+    of the same envelope (another recipient, a broadcast, an ack) splices
+    them in instead of encoding the payload again. It stays a plain dict
+    to everything else, so the message queue and test clients see no
+    difference.
+    """
+    __slots__ = ("encoded",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoded = {}  # {wire format: str or bytes}
+
+    def encode(self, wire_format, dumps):
+        """Cached encoding of the payload; dumps(payload) produces it on first use"""
+        encoded = self.encoded.get(wire_format)
+        if encoded is None:
+            encoded = self.encoded[wire_format] = dumps(self)
+        return encoded
+
+def _envelope_event(pkt):
+    """(event name, envelope) when pkt is a plain event carrying one envelope"""
+    data = pkt.data
+    if pkt.packet_type == packet.EVENT and isinstance(data, list) and len(data) == 2 \
+            and isinstance(data[1], Envelope):
+        return data[0], data[1]
+    return None, None
+
+class EnvelopePacket(packet.Packet):
+    """Socket.IO JSON packet that reuses an envelope's cached JSON"""
+
+    @classmethod
+    def data_is_binary(cls, data):
+        # Same answer as Packet.data_is_binary, but an envelope is only scanned once
+        if isinstance(data, Envelope):
+            binary = data.encoded.get("binary")
+            if binary is None:
+                try:
+                    # JSON cannot hold bytes, so an envelope that encodes has none;
+                    # the encoding is needed next anyway
+                    cls._encode_json(data)
+                    binary = False
+                except TypeError:
+                    binary = any(cls.data_is_binary(item) for item in data.values())
+                data.encoded["binary"] = binary
+            return binary
+        if isinstance(data, (bytes, bytearray)):
+            return True
+        if isinstance(data, list):
+            return any(cls.data_is_binary(item) for item in data)
+        if isinstance(data, dict):
+            return any(cls.data_is_binary(item) for item in data.values())
+        return False
+
+    # python-socketio before 5.15 (the pinned 5.10 included) asks through the private name
+    _data_is_binary = data_is_binary
+
+    def encode(self):
+        event, envelope = _envelope_event(self)
+        if envelope is None:
+            return super().encode()
+        # Same layout as Packet.encode: type, namespace, ack id, then the JSON array
+        encoded_packet = str(self.packet_type)
+        if self.namespace is not None and self.namespace != '/':
+            encoded_packet += self.namespace + ','
+        if self.id is not None:
+            encoded_packet += str(self.id)
+        # Default arguments reuse json's shared encoder; separators make no difference to a string
+        return f"{encoded_packet}[{self.json.dumps(event)},{self._encode_json(envelope)}]"
+
+    @classmethod
+    def _encode_json(cls, envelope):
+        return envelope.encode("json", lambda data: cls.json.dumps(data, separators=(',', ':')))
+
+def create_packet_class(wire_format="json"):
+    """Socket.IO packet class for the configured wire format ("json" or "msgpack")"""
+    if wire_format == "json":
+        return EnvelopePacket
+    if wire_format != "msgpack":
+        raise ValueError(f"Unknown wire format: {wire_format}")
+
+    # Optional dependency: pip install msgpack
+    import msgpack
+    from socketio.msgpack_packet import MsgPackPacket
+
+    data_key = msgpack.packb("data")
+    heads = {}  # {(packet type, namespace, None): packed fields before the data array}
+
+    class EnvelopeMsgPackPacket(MsgPackPacket):
+        """Socket.IO MessagePack packet that reuses an envelope's cached bytes
+
+        Clients must use the socket.io-msgpack-parser; /health advertises
+        the server's wire format so they can pick it before connecting.
+        The bundled web frontend does not, so it needs the JSON format.
+        """
+
+        def encode(self):
+            event, envelope = _envelope_event(self)
+            if envelope is None:
+                return super().encode()
+            default = getattr(self.__class__, "dumps_default", None)
+            key = (self.packet_type, self.namespace, self.id)
+            head = heads.get(key) if self.id is None else None
+            if head is None:
+                fields = self._to_dict()
+                del fields["data"]
+                # A MessagePack map is a header followed by its entries in any order, so
+                # pack the other fields and widen the (one byte, fixmap) header by one
+                head = msgpack.packb(fields, default=default)
+                head = bytes((0x80 | len(fields) + 1,)) + head[1:] + data_key + b"\x92"
+                if self.id is None:
+                    heads[key] = head
+            # ...then "data": [event, payload] with the payload's cached bytes
+            payload = envelope.encode("msgpack", lambda data: msgpack.packb(data, default=default))
+            return head + msgpack.packb(event) + payload
+
+    return EnvelopeMsgPackPacket
@@ -0,0 +1,154 @@
+import time
+from storage import Database
+
+class FileIndex:
+    """SQLite index of stored uploads: paths, owners, hashes, expiry and quotas"""
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path="database/files.db", db_observer=None):
+        self.db = Database(db_path, pool_size=4, observe=db_observer)
+        self.created = False
+        self.init_database()
+
+    def init_database(self):
+        """Create the index tables and remember whether this is a fresh index"""
+        with self.db.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            self.created = version == 0
+
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL DEFAULT 'file',
+                    owner TEXT NOT NULL,
+                    sender TEXT,
+                    name TEXT NOT NULL,
+                    path TEXT UNIQUE NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    sha256 TEXT,
+                    created_at REAL NOT NULL,
+                    expires_at REAL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_expires ON files (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)")
+
+            # Next free "_N" suffix per (owner, name), so unique names need no directory probing
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS file_names (
+                    owner TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    next_suffix INTEGER NOT NULL,
+                    PRIMARY KEY (owner, name)
+                )
+            ''')
+
+            # Running per-user totals, kept in step with files rows of kind 'file'
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS quotas (
+                    owner TEXT PRIMARY KEY,
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    files INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def next_name_suffix(self, owner, name):
+        """Reserve the next suffix for name in owner's directory (0 means the bare name)"""
+        with self.db.transaction() as conn:
+            conn.execute('''
+                INSERT INTO file_names (owner, name, next_suffix) VALUES (?, ?, 1)
+                ON CONFLICT (owner, name) DO UPDATE SET next_suffix = next_suffix + 1
+            ''', (owner, name))
+            return conn.execute(
+                "SELECT next_suffix - 1 FROM file_names WHERE owner = ? AND name = ?",
+                (owner, name)
+            ).fetchone()[0]
+
+    def add_file(self, owner, name, path, size, sha256=None, ttl=None, kind="file", sender=None):
+        """Record a stored file and charge it to the owner's quota"""
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self.db.transaction() as conn:
+            file_id = conn.execute('''
+                INSERT INTO files (kind, owner, sender, name, path, size, sha256, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (kind, owner, sender, name, path, size, sha256, now, expires_at)).lastrowid
+            if kind == "file":
+                self._charge(conn, owner, size, 1)
+        return file_id
+
+    def remove_file(self, file_id):
+        """Forget a file and refund its owner's quota; returns the removed row"""
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT kind, owner, path, size, sha256 FROM files WHERE id = ?", (file_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            kind, owner, path, size, sha256 = row
+            if kind == "file":
+                self._charge(conn, owner, -size, -1)
+        return {"kind": kind, "owner": owner, "path": path, "size": size, "sha256": sha256}
+
+    def remove_path(self, path):
+        """Forget the entry for a path, if indexed"""
+        row = self.db.fetchone("SELECT id FROM files WHERE path = ?", (path,))
+        return self.remove_file(row[0]) if row else None
+
+    def _charge(self, conn, owner, size, count):
+        """Adjust an owner's running quota totals"""
+        conn.execute('''
+            INSERT INTO quotas (owner, bytes, files) VALUES (?, ?, ?)
+            ON CONFLICT (owner) DO UPDATE SET bytes = bytes + excluded.bytes, files = files + excluded.files
+        ''', (owner, size, count))
+
+    def expired(self, now=None, limit=100):
+        """Oldest-expiring entries whose expiry has passed, at most limit of them"""
+        return self.db.fetchall('''
+            SELECT id FROM files
+            WHERE expires_at IS NOT NULL AND expires_at <= ?
+            ORDER BY expires_at
+            LIMIT ?
+        ''', (now if now is not None else time.time(), limit))
+
+    def hash_in_use(self, sha256):
+        """Whether any stored file still references a blob"""
+        return self.db.fetchone(
+            "SELECT 1 FROM files WHERE sha256 = ? AND kind = 'file' LIMIT 1", (sha256,)
+        ) is not None
+
+    def has_access(self, username, sha256):
+        """Whether username sent or received a stored file with this content"""
+        return self.db.fetchone('''
+            SELECT 1 FROM files
+            WHERE sha256 = ? AND kind = 'file' AND (owner = ? OR sender = ?)
+            LIMIT 1
+        ''', (sha256, username, username)) is not None
+
+    def unhashed_files(self, limit=100):
+        """(id, path) of stored files indexed without a digest"""
+        return self.db.fetchall(
+            "SELECT id, path FROM files WHERE sha256 IS NULL AND kind = 'file' LIMIT ?", (limit,)
+        )
+
+    def set_sha256(self, file_id, sha256):
+        """Record the content digest of an indexed file"""
+        self.db.execute("UPDATE files SET sha256 = ? WHERE id = ?", (sha256, file_id))
+
+    def get_usage(self, owner):
+        """Bytes and file count currently charged to owner"""
+        row = self.db.fetchone("SELECT bytes, files FROM quotas WHERE owner = ?", (owner,))
+        return {"bytes": row[0], "files": row[1]} if row else {"bytes": 0, "files": 0}
+
+    def get_quota_stats(self):
+        """Per-owner usage for every owner with stored files"""
+        rows = self.db.fetchall("SELECT owner, bytes, files FROM quotas WHERE files > 0")
+        return {owner: {"bytes": size, "files": count} for owner, size, count in rows}
+
+    def close(self):
+        """Release pooled index connections"""
+        self.db.close()
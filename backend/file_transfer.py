@@ -1,13 +1,39 @@
 import os
 import base64
 import hashlib
+import json
+import threading
+import time
+import uuid
 from datetime import datetime
+from blob_store import BlobStore
+from file_index import FileIndex
 
 class FileTransferManager:
-    def __init__(self, upload_dir="uploads"):
+    CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 512 * 1024
+    MAX_FILE_SIZE = 10 * 1024 * 1024
+    PARTIAL_TTL = 24 * 3600
+    
+    def __init__(self, upload_dir="uploads", max_file_size=MAX_FILE_SIZE,
+                 index_path="database/files.db", retention_days=7, db_observer=None):
         self.upload_dir = upload_dir
-        os.makedirs(upload_dir, exist_ok=True)
-        self.active_transfers = {}
+        self.partial_dir = os.path.join(upload_dir, ".partial")
+        self.max_file_size = max_file_size
+        self.retention = retention_days * 86400 if retention_days else None
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.blobs = BlobStore(os.path.join(upload_dir, ".blobs"))
+        self.index = FileIndex(index_path, db_observer=db_observer)
+        self.active_transfers = {}  # {transfer_id: transfer_state}
+        self.lock = threading.Lock()
+        self.janitor_thread = None
+        self.janitor_stop = threading.Event()
+        self.stats = {"files_expired": 0, "janitor_sweeps": 0}
+        
+        if self.index.created:
+            self._import_existing_files()
+        # Rows indexed without a digest (imports by older versions) would pin their blobs forever
+        self._hash_unhashed_files()
         
     def prepare_file_for_transfer(self, file_path):
         """Read and encode file for transfer"""
@@ -46,25 +72,191 @@ class FileTransferManager:
             # Decode base64 data
             decoded_data = base64.b64decode(file_data)
             
-            # Generate unique filename if file exists
-            file_path = os.path.join(user_dir, file_name)
-            counter = 1
-            base_name, extension = os.path.splitext(file_name)
-            
-            while os.path.exists(file_path):
-                new_name = f"{base_name}_{counter}{extension}"
-                file_path = os.path.join(user_dir, new_name)
-                counter += 1
-            
-            # Save file
-            with open(file_path, 'wb') as f:
-                f.write(decoded_data)
+            # Store the content once and link it into the receiver's directory
+            with self.lock:
+                digest = self.blobs.put_bytes(decoded_data)
+                file_path = self._store_for_user(
+                    receiver, os.path.basename(file_name), digest, len(decoded_data), sender
+                )
             
             return {
                 "success": True,
                 "file_path": file_path,
                 "file_name": os.path.basename(file_path),
-                "file_size": len(decoded_data)
+                "file_size": len(decoded_data),
+                "file_hash": digest
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    def _store_for_user(self, receiver, file_name, digest, size, sender):
+        """Link a blob into the receiver's directory under an index-allocated name"""
+        user_dir = os.path.join(self.upload_dir, receiver)
+        os.makedirs(user_dir, exist_ok=True)
+        base_name, extension = os.path.splitext(file_name)
+        
+        while True:
+            suffix = self.index.next_name_suffix(receiver, file_name)
+            name = file_name if suffix == 0 else f"{base_name}_{suffix}{extension}"
+            file_path = os.path.join(user_dir, name)
+            try:
+                self.blobs.link(digest, file_path)
+                break
+            except FileExistsError:
+                # Taken by a file the index never allocated; try the next suffix
+                continue
+        
+        self.index.add_file(receiver, name, file_path, size, digest,
+                            ttl=self.retention, sender=sender)
+        return file_path
+    
+    def _import_existing_files(self):
+        """One-off walk that indexes files stored before the index existed"""
+        now = time.time()
+        for owner in os.listdir(self.upload_dir):
+            user_dir = os.path.join(self.upload_dir, owner)
+            if owner.startswith(".") or not os.path.isdir(user_dir):
+                continue
+            for name in os.listdir(user_dir):
+                file_path = os.path.join(user_dir, name)
+                try:
+                    st = os.stat(file_path)
+                    ttl = max(0, st.st_mtime + self.retention - now) if self.retention else None
+                    # Hashed so the janitor can tell when the last link to a blob goes
+                    self.index.add_file(owner, name, file_path, st.st_size,
+                                        self._hash_file(file_path), ttl=ttl)
+                except Exception as e:
+                    print(f"Error indexing {file_path}: {e}")
+    
+    def _hash_unhashed_files(self):
+        """Fill in the SHA-256 of indexed files that were recorded without one"""
+        while True:
+            rows = self.index.unhashed_files()
+            if not rows:
+                return
+            for file_id, file_path in rows:
+                try:
+                    digest = self._hash_file(file_path)
+                except OSError:
+                    digest = ""  # Gone from disk: nothing to hash, and the janitor skips ""
+                self.index.set_sha256(file_id, digest)
+    
+    def _hash_file(self, file_path):
+        """SHA-256 of a file on disk, read in chunks"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+    
+    def _partial_paths(self, transfer_id):
+        """Data and metadata paths for an in-progress upload"""
+        base = os.path.join(self.partial_dir, transfer_id)
+        return base + ".part", base + ".json"
+    
+    def _load_transfer(self, transfer_id):
+        """Rebuild upload state from disk after a server restart"""
+        part_path, meta_path = self._partial_paths(transfer_id)
+        if not os.path.exists(meta_path) or not os.path.exists(part_path):
+            return None
+        
+        with open(meta_path) as f:
+            transfer = json.load(f)
+        
+        # Re-hash what already arrived, streaming so memory stays bounded
+        hasher = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                hasher.update(block)
+        
+        transfer["offset"] = os.path.getsize(part_path)
+        transfer["hasher"] = hasher
+        transfer["lock"] = threading.Lock()
+        transfer["part_path"] = part_path
+        transfer["meta_path"] = meta_path
+        return transfer
+    
+    def start_upload(self, sender, receiver, file_name, file_size, transfer_id=None, file_hash=None):
+        """Begin a chunked upload, or resume one when transfer_id is known"""
+        try:
+            with self.lock:
+                if transfer_id:
+                    # Only hex ids we issued, so the id can't escape partial_dir
+                    transfer = self.active_transfers.get(transfer_id)
+                    if transfer is None and transfer_id.isalnum():
+                        transfer = self._load_transfer(transfer_id)
+                        if transfer:
+                            self.active_transfers[transfer_id] = transfer
+                    if transfer is None or transfer["sender"] != sender:
+                        return {"success": False, "error": "Unknown transfer"}
+                    return {
+                        "success": True,
+                        "transfer_id": transfer_id,
+                        "offset": transfer["offset"],
+                        "chunk_size": self.CHUNK_SIZE
+                    }
+                
+                file_size = int(file_size)
+                if file_size < 0 or file_size > self.max_file_size:
+                    return {"success": False, "error": "File too large"}
+                
+                file_name = os.path.basename(file_name)
+                if not file_name:
+                    return {"success": False, "error": "Invalid file name"}
+                
+                transfer_id = uuid.uuid4().hex
+                
+                file_hash = file_hash.lower() if isinstance(file_hash, str) else None
+                # Content already stored: skip the upload and just link it on completion. Only
+                # for content the sender already sent or received, so a bare hash neither
+                # grants access to a file nor reveals whether one exists
+                if file_hash and self.blobs.has(file_hash) and self.index.has_access(sender, file_hash):
+                    # The stored blob decides the size, not the client's claim
+                    file_size = os.path.getsize(self.blobs.path_for(file_hash))
+                    self.active_transfers[transfer_id] = {
+                        "sender": sender,
+                        "receiver": receiver,
+                        "file_name": file_name,
+                        "file_size": file_size,
+                        "file_hash": file_hash,
+                        "existing": True,
+                        "offset": file_size,
+                        "lock": threading.Lock()
+                    }
+                    return {
+                        "success": True,
+                        "transfer_id": transfer_id,
+                        "offset": file_size,
+                        "chunk_size": self.CHUNK_SIZE
+                    }
+                
+                part_path, meta_path = self._partial_paths(transfer_id)
+                transfer = {
+                    "sender": sender,
+                    "receiver": receiver,
+                    "file_name": file_name,
+                    "file_size": file_size,
+                    "started_at": datetime.now().isoformat()
+                }
+                with open(meta_path, 'w') as f:
+                    json.dump(transfer, f)
+                open(part_path, 'wb').close()
+                # Indexed so abandoned uploads expire without scanning .partial
+                self.index.add_file(sender, transfer_id, part_path, 0,
+                                    ttl=self.PARTIAL_TTL, kind="partial")
+                
+                transfer.update(offset=0, hasher=hashlib.sha256(), lock=threading.Lock(),
+                                part_path=part_path, meta_path=meta_path)
+                self.active_transfers[transfer_id] = transfer
+            
+            return {
+                "success": True,
+                "transfer_id": transfer_id,
+                "offset": 0,
+                "chunk_size": self.CHUNK_SIZE
             }
         except Exception as e:
             return {
@@ -72,6 +264,114 @@ class FileTransferManager:
                 "error": str(e)
             }
     
+    def write_chunk(self, transfer_id, offset, data, sender):
+        """Append one chunk at offset; returns the next offset the sender should use"""
+        transfer = self.active_transfers.get(transfer_id)
+        # Someone else's upload looks the same as one that does not exist
+        if transfer is None or transfer["sender"] != sender:
+            return {"success": False, "error": "Unknown transfer"}
+        if transfer.get("existing"):
+            return {"success": True, "offset": transfer["offset"]}
+        if not isinstance(data, (bytes, bytearray)):
+            return {"success": False, "error": "Chunk must be binary"}
+        if len(data) > self.MAX_CHUNK_SIZE:
+            return {"success": False, "error": "Chunk too large"}
+        
+        # Per-transfer lock so concurrent uploads don't serialize on each other's disk writes
+        with transfer["lock"]:
+            expected = transfer["offset"]
+            if offset < expected:
+                # Retransmit of data already on disk: acknowledge with the real offset
+                return {"success": True, "offset": expected}
+            if offset > expected:
+                return {"success": False, "error": "Unexpected offset", "offset": expected}
+            if expected + len(data) > transfer["file_size"]:
+                return {"success": False, "error": "Chunk exceeds declared size", "offset": expected}
+            
+            try:
+                with open(transfer["part_path"], 'ab') as f:
+                    f.write(data)
+            except Exception as e:
+                return {"success": False, "error": str(e), "offset": expected}
+            
+            transfer["hasher"].update(data)
+            transfer["offset"] = expected + len(data)
+            return {"success": True, "offset": transfer["offset"]}
+    
+    def finish_upload(self, transfer_id, file_hash, sender):
+        """Verify the SHA-256 of a completed upload and move it into place"""
+        with self.lock:
+            transfer = self.active_transfers.get(transfer_id)
+            if transfer is None or transfer["sender"] != sender:
+                return {"success": False, "error": "Unknown transfer"}
+            
+            with transfer["lock"]:
+                offset = transfer["offset"]
+            if offset != transfer["file_size"]:
+                return {
+                    "success": False,
+                    "error": "Upload incomplete",
+                    "offset": offset
+                }
+            
+            del self.active_transfers[transfer_id]
+            if transfer.get("existing"):
+                digest = transfer["file_hash"]
+            else:
+                digest = transfer["hasher"].hexdigest()
+            if not file_hash or digest != file_hash.lower():
+                self._discard(transfer)
+                return {"success": False, "error": "Hash mismatch"}
+            
+            try:
+                if not transfer.get("existing"):
+                    self.blobs.put_file(transfer["part_path"], digest)
+                    os.remove(transfer["meta_path"])
+                    self.index.remove_path(transfer["part_path"])
+                file_path = self._store_for_user(
+                    transfer["receiver"], transfer["file_name"], digest,
+                    transfer["file_size"], transfer["sender"]
+                )
+            except Exception as e:
+                self._discard(transfer)
+                return {"success": False, "error": str(e)}
+        
+        return {
+            "success": True,
+            "transfer_id": transfer_id,
+            "sender": transfer["sender"],
+            "receiver": transfer["receiver"],
+            "file_path": file_path,
+            "file_name": os.path.basename(file_path),
+            "file_size": transfer["file_size"],
+            "file_hash": digest
+        }
+    
+    def abort_upload(self, transfer_id):
+        """Drop an upload and its partial data"""
+        with self.lock:
+            transfer = self.active_transfers.pop(transfer_id, None)
+            if transfer:
+                self._discard(transfer)
+        return {"success": transfer is not None}
+    
+    def _discard(self, transfer):
+        """Remove the partial files for a transfer"""
+        if transfer.get("existing"):
+            return
+        for path in (transfer["part_path"], transfer["meta_path"]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.index.remove_path(transfer["part_path"])
+    
+    def get_blob_path(self, file_hash, username):
+        """Resolve a content reference to its stored blob, or None unless username sent or received it"""
+        if not self.blobs.has(file_hash) or not self.index.has_access(username, file_hash):
+            return None
+        return self.blobs.path_for(file_hash)
+    
     def create_file_message(self, sender, receiver, file_name, file_size, file_data):
         """Create a file transfer message"""
         return {
@@ -105,16 +405,70 @@ class FileTransferManager:
                 "error": str(e)
             }
     
-    def cleanup_old_files(self, days=7):
-        """Clean up files older than specified days"""
+    def cleanup_old_files(self, batch_size=100):
+        """Remove one batch of expired files found through the index"""
+        removed = 0
         try:
-            current_time = datetime.now()
-            for root, dirs, files in os.walk(self.upload_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                    if (current_time - file_time).days > days:
-                        os.remove(file_path)
-                        print(f"Removed old file: {file_path}")
+            for (file_id,) in self.index.expired(limit=batch_size):
+                entry = self.index.remove_file(file_id)
+                if entry is None:
+                    continue
+                try:
+                    os.remove(entry["path"])
+                except FileNotFoundError:
+                    pass
+                
+                if entry["kind"] == "partial":
+                    transfer_id = os.path.splitext(os.path.basename(entry["path"]))[0]
+                    with self.lock:
+                        self.active_transfers.pop(transfer_id, None)
+                    try:
+                        os.remove(self._partial_paths(transfer_id)[1])
+                    except FileNotFoundError:
+                        pass
+                elif entry["sha256"]:
+                    # Under the transfer lock so a concurrent dedup can't link a blob we delete
+                    with self.lock:
+                        if not self.index.hash_in_use(entry["sha256"]):
+                            self.blobs.remove(entry["sha256"])
+                
+                removed += 1
+                print(f"Removed old file: {entry['path']}")
         except Exception as e:
             print(f"Error cleaning up files: {e}")
+        
+        self.stats["files_expired"] += removed
+        self.stats["janitor_sweeps"] += 1
+        return removed
+    
+    def start_janitor(self, interval=60, batch_size=100):
+        """Expire files in the background, one small batch at a time"""
+        if self.janitor_thread:
+            return
+        self.janitor_stop.clear()
+        
+        def run():
+            delay = 0
+            while not self.janitor_stop.wait(delay):
+                removed = self.cleanup_old_files(batch_size)
+                # A full batch means a backlog: keep going, otherwise idle until next sweep
+                delay = 0.1 if removed >= batch_size else interval
+        
+        self.janitor_thread = threading.Thread(target=run, name="upload-janitor", daemon=True)
+        self.janitor_thread.start()
+    
+    def stop_janitor(self):
+        """Stop the background sweep and close the index"""
+        self.janitor_stop.set()
+        if self.janitor_thread:
+            self.janitor_thread.join(timeout=5)
+            self.janitor_thread = None
+        self.index.close()
+    
+    def get_stats(self):
+        """Transfer, expiry and per-user quota counters"""
+        return {
+            "active_transfers": len(self.active_transfers),
+            **self.stats,
+            "quotas": self.index.get_quota_stats()
+        }
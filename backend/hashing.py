@@ -0,0 +1,87 @@
+import os
+import threading
+import bcrypt
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already queued"""
+
+def create_offload(async_mode="threading", max_workers=None):
+    """Callable that runs fn(*args) on a real OS thread without blocking the event loop"""
+    if async_mode == "eventlet":
+        from eventlet import tpool
+        return tpool.execute
+    if async_mode == "gevent":
+        import gevent
+        return lambda fn, *args: gevent.get_hub().threadpool.apply(fn, args)
+
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+    return lambda fn, *args: executor.submit(fn, *args).result()
+
+class PasswordHasher:
+    """bcrypt hashing on a bounded worker pool with admission control
+
+    At most `workers` hashes run at once (bcrypt releases the GIL, so they
+    run in parallel) and at most `max_queue` more wait for a slot; callers
+    beyond that get HasherBusy straight away instead of piling up behind a
+    login storm.
+    """
+
+    def __init__(self, rounds=12, workers=None, max_queue=64, offload=None):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 2
+        self.max_queue = max_queue
+        self.offload = offload or create_offload(max_workers=self.workers)
+        self.slots = threading.Semaphore(self.workers)
+        self.admission = threading.BoundedSemaphore(self.workers + max_queue)
+        self.stats = {"hashed": 0, "checked": 0, "rejected": 0, "in_flight": 0}
+        self.stats_lock = threading.Lock()
+
+    def hash(self, password):
+        """bcrypt hash of password at the configured work factor"""
+        salt = bcrypt.gensalt(self.rounds)
+        result = self._run(bcrypt.hashpw, password.encode('utf-8'), salt)
+        self._count("hashed")
+        return result
+
+    def check(self, password, password_hash):
+        """Whether password matches a stored bcrypt hash"""
+        if isinstance(password_hash, str):
+            password_hash = password_hash.encode('utf-8')
+        result = self._run(bcrypt.checkpw, password.encode('utf-8'), password_hash)
+        self._count("checked")
+        return result
+
+    def needs_rehash(self, password_hash):
+        """True when a stored hash was made with a different work factor"""
+        if isinstance(password_hash, bytes):
+            password_hash = password_hash.decode('utf-8', 'replace')
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def _run(self, fn, *args):
+        if not self.admission.acquire(blocking=False):
+            self._count("rejected")
+            raise HasherBusy("Too many logins in progress, try again shortly")
+        try:
+            with self.slots:
+                self._count("in_flight")
+                try:
+                    return self.offload(fn, *args)
+                finally:
+                    self._count("in_flight", -1)
+        finally:
+            self.admission.release()
+
+    def _count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def get_stats(self):
+        """Hashing counters plus pool configuration"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats.update(rounds=self.rounds, workers=self.workers, max_queue=self.max_queue)
+        return stats
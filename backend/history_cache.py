@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict, deque
+
+# Rough per-message overhead of the dict, deque slot and strings beyond their text
+MESSAGE_OVERHEAD = 400
+
+class _Conversation:
+    __slots__ = ("messages", "complete", "size")
+
+    def __init__(self, messages, complete, capacity):
+        self.messages = deque(messages, maxlen=capacity)
+        # True when the deque holds the whole conversation, not just its tail
+        self.complete = complete
+        self.size = sum(message_size(m) for m in self.messages)
+
+def message_size(message):
+    """Approximate memory held by one cached history message"""
+    return (
+        MESSAGE_OVERHEAD + len(message["message"]) + len(message["sender"])
+        + len(message["receiver"]) + len(message["timestamp"] or "")
+    )
+
+class HistoryCache:
+    """Most recent messages of active conversations, under one global memory budget
+
+    Each conversation keeps a ring buffer of its newest `per_conversation`
+    messages, seeded from the first history page and then appended to as
+    batches are committed. Whole conversations are evicted least recently
+    used first once the total exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, per_conversation=200):
+        self.max_bytes = max_bytes
+        self.per_conversation = per_conversation
+        self.entries = OrderedDict()  # {conversation: _Conversation}
+        self.size = 0
+        self.generation = 0  # bumped on every commit, so stale page loads are not cached
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, conversation, limit):
+        """(messages, has_more) for the newest page, or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(conversation)
+            if entry is None or (limit > len(entry.messages) and not entry.complete):
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(conversation)
+            self.stats["hits"] += 1
+            count = min(limit, len(entry.messages))
+            messages = [entry.messages[i] for i in range(len(entry.messages) - count, len(entry.messages))]
+            has_more = len(entry.messages) > limit or not entry.complete
+            return messages, has_more
+
+    def get_generation(self):
+        """Token to pass to put_page for a database read about to start"""
+        return self.generation
+
+    def put_page(self, conversation, messages, has_more, generation):
+        """Seed a conversation from its newest page, unless a commit raced the read"""
+        with self.lock:
+            if generation != self.generation:
+                return False
+            self._drop(conversation)
+            entry = _Conversation(messages, not has_more, self.per_conversation)
+            if len(messages) > self.per_conversation:
+                entry.complete = False
+            self.entries[conversation] = entry
+            self.size += entry.size
+            self._evict()
+            return True
+
+    def append_committed(self, messages):
+        """Add freshly committed messages to the conversations already cached"""
+        with self.lock:
+            self.generation += 1
+            for conversation, message in messages:
+                entry = self.entries.get(conversation)
+                if entry is None:
+                    continue
+                if len(entry.messages) == entry.messages.maxlen:
+                    self.size -= message_size(entry.messages[0])
+                    entry.size -= message_size(entry.messages[0])
+                    entry.complete = False
+                entry.messages.append(message)
+                size = message_size(message)
+                entry.size += size
+                self.size += size
+            self._evict()
+
+    def _drop(self, conversation):
+        entry = self.entries.pop(conversation, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.stats["evictions"] += 1
+
+    def get_stats(self):
+        """Hit/miss/eviction counters and current footprint"""
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+                "conversations": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,102 @@
+import json
+import queue
+import threading
+import uuid
+import socketio
+
+class MemoryBus:
+    """In-process fan-out broker; stands in for Redis/RabbitMQ in local tests"""
+
+    def __init__(self):
+        self.subscribers = {}  # {channel: [queue.Queue, ...]}
+        self.lock = threading.Lock()
+
+    def publish(self, channel, message):
+        """Deliver a JSON-serializable message to every subscriber of channel"""
+        payload = json.dumps(message)
+        with self.lock:
+            targets = list(self.subscribers.get(channel, ()))
+        for target in targets:
+            target.put(payload)
+
+    def listen(self, channel):
+        """Subscribe now and return an iterator over channel's messages"""
+        inbox = queue.Queue()
+        with self.lock:
+            self.subscribers.setdefault(channel, []).append(inbox)
+        
+        def messages():
+            while True:
+                yield json.loads(inbox.get())
+        return messages()
+
+class KombuBus:
+    """Fan-out pub/sub over any kombu transport (redis://, amqp://, ...)"""
+
+    def __init__(self, url):
+        import kombu
+        self.kombu = kombu
+        self.url = url
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _exchange(self, channel):
+        return self.kombu.Exchange(channel, type='fanout', durable=False)
+
+    def publish(self, channel, message):
+        """Publish message to every worker listening on channel"""
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.kombu.Connection(self.url)
+            producer = self.connection.Producer(exchange=self._exchange(channel))
+            producer.publish(json.dumps(message), retry=True)
+
+    def listen(self, channel):
+        """Bind a private auto-deleted queue to channel and iterate its messages"""
+        inbox = self.kombu.Queue(
+            f"{channel}.{uuid.uuid4().hex}", self._exchange(channel),
+            durable=False, auto_delete=True
+        )
+        connection = self.kombu.Connection(self.url)
+        simple_queue = connection.SimpleQueue(inbox)
+        
+        def messages():
+            try:
+                while True:
+                    message = simple_queue.get(block=True)
+                    message.ack()
+                    yield json.loads(message.payload)
+            finally:
+                simple_queue.close()
+                connection.close()
+        return messages()
+
+_memory_buses = {}
+
+def create_bus(url):
+    """Bus for a message queue URL; memory:// buses are shared per name in-process"""
+    if url.startswith("memory://"):
+        return _memory_buses.setdefault(url, MemoryBus())
+    return KombuBus(url)
+
+class BusManager(socketio.PubSubManager):
+    """Socket.IO client manager that relays emits between workers over a bus"""
+    name = 'bus'
+
+    def __init__(self, bus, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    def _listen(self):
+        return self.bus.listen(self.channel)
+
+def create_socketio_options(url):
+    """SocketIO keyword arguments that wire up cross-worker emits for url"""
+    if not url:
+        return {}
+    if url.startswith("memory://"):
+        return {"client_manager": BusManager(create_bus(url))}
+    return {"message_queue": url}
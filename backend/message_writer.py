@@ -0,0 +1,163 @@
+import threading
+import queue
+import time
+
+class _FlushMarker:
+    """Queue entry that asks the writer to commit everything queued before it"""
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+_STOP = object()
+
+class MessageWriter:
+    """Write-behind queue that group-commits chat_history inserts"""
+
+    INSERT_SQL = (
+        "INSERT INTO chat_history (sender, receiver, message, timestamp, conversation, delivered) "
+        "VALUES (?, ?, ?, ?, ?, ?)"
+    )
+
+    def __init__(self, db, max_queue=10000, batch_size=256, flush_interval=0.05, put_timeout=1.0,
+                 on_commit=None):
+        self.db = db
+        # Called as on_commit(batch, first_id) after each batch is durable
+        self.on_commit = on_commit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.running = False
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "rejected": 0,
+            "failed": 0,
+            "max_queue_depth": 0
+        }
+
+    def start(self):
+        """Start the background writer thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, record):
+        """Queue a (sender, receiver, message, timestamp, conversation, delivered) row; blocks while full"""
+        if not self.running:
+            return False
+        # Count before queueing so get_pending never under-reports a row in flight
+        with self.stats_lock:
+            self.stats["enqueued"] += 1
+        try:
+            self.queue.put(record, timeout=self.put_timeout)
+        except queue.Full:
+            with self.stats_lock:
+                self.stats["enqueued"] -= 1
+                self.stats["rejected"] += 1
+            return False
+        depth = self.queue.qsize()
+        if depth > self.stats["max_queue_depth"]:
+            self.stats["max_queue_depth"] = depth
+        return True
+
+    def flush(self, timeout=5.0):
+        """Block until every row queued before this call is committed"""
+        if not self.running or self.get_pending() == 0:
+            return True
+        marker = _FlushMarker()
+        self.queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def stop(self, timeout=10.0):
+        """Flush pending rows and stop the writer thread"""
+        if not self.running:
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self.running = False
+
+    def get_pending(self):
+        """Rows accepted but not yet committed, including the batch in flight"""
+        return self.stats["enqueued"] - self.stats["written"] - self.stats["failed"]
+
+    def get_queue_depth(self):
+        """Number of rows waiting to be committed"""
+        return self.queue.qsize()
+
+    def get_stats(self):
+        """Counters for monitoring the write-behind pipeline"""
+        return {"queue_depth": self.get_queue_depth(), **self.stats}
+
+    def _run(self):
+        """Collect rows until the batch is full or the interval passes, then commit"""
+        while True:
+            item = self.queue.get()
+            batch = []
+            markers = []
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, _FlushMarker):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+
+                if stopping or markers or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stopping:
+                # Drain whatever producers managed to queue before shutdown
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, _FlushMarker):
+                        markers.append(item)
+                    elif item is not _STOP:
+                        batch.append(item)
+
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.done.set()
+            if stopping:
+                return
+
+    def _write(self, batch):
+        """Insert a batch in one transaction, retrying once on failure"""
+        for attempt in range(2):
+            try:
+                with self.db.transaction() as conn:
+                    conn.executemany(self.INSERT_SQL, batch)
+                    # The write lock is held, so the batch got consecutive ids ending here
+                    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+                if self.on_commit:
+                    try:
+                        self.on_commit(batch, last_id - len(batch) + 1)
+                    except Exception as e:
+                        print(f"Error in message commit hook: {e}")
+                return
+            except Exception as e:
+                print(f"Error writing message batch (attempt {attempt + 1}): {e}")
+                time.sleep(0.1)
+        self.stats["failed"] += len(batch)
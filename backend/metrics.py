@@ -0,0 +1,132 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Seconds; handler and query times of interest run from well under a millisecond to a slow bcrypt
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """Latency histogram rendered as Prometheus cumulative buckets"""
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, not cumulative; the last is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        """(cumulative counts per bucket including +Inf, sum)"""
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+class Metrics:
+    """Registry behind the /metrics endpoint (Prometheus text format 0.0.4)
+
+    Only latency histograms are recorded on the hot path: one perf_counter
+    pair, a bisect and a locked increment per observation. Counters and
+    gauges are not duplicated here; collectors read them from the managers'
+    own get_stats() when /metrics is scraped, so relay loops and queues pay
+    nothing for being exported.
+    """
+
+    def __init__(self, namespace="chatterbox", buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self.histograms = {}  # {name: (help, {label values: Histogram})}
+        self.collectors = []  # callables returning [(name, type, help, [(labels, value)])]
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help, **labels):
+        """The histogram for name and labels, created on first use"""
+        name = f"{self.namespace}_{name}"
+        key = tuple(labels.items())
+        with self.lock:
+            family = self.histograms.setdefault(name, (help, {}))[1]
+            histogram = family.get(key)
+            if histogram is None:
+                histogram = family[key] = Histogram(self.buckets)
+            return histogram
+
+    def timed(self, name, help, **labels):
+        """Decorator recording how long each call takes, exceptions included"""
+        histogram = self.histogram(name, help, **labels)
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def observer(self, name, help, label, **labels):
+        """observe(label value, seconds) for one histogram family, e.g. SQLite time per operation"""
+        cache = {}
+
+        def observe(value, seconds):
+            histogram = cache.get(value)
+            if histogram is None:
+                histogram = cache[value] = self.histogram(name, help, **labels, **{label: value})
+            histogram.observe(seconds)
+        return observe
+
+    def add_collector(self, collect):
+        """Register collect() -> [(name, "counter" or "gauge", help, [(labels, value)])]"""
+        self.collectors.append(collect)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            families = [(name, help, list(family.items())) for name, (help, family) in self.histograms.items()]
+        for name, help, family in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in family:
+                labels = dict(key)
+                cumulative, total = histogram.snapshot()
+                for bound, count in zip(self.buckets + (float("inf"),), cumulative):
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': _number(float(bound))})} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative[-1]}")
+        for collect in self.collectors:
+            try:
+                collected = collect()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, kind, help, samples in collected:
+                name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
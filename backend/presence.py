@@ -0,0 +1,273 @@
+import threading
+import uuid
+from datetime import datetime
+from message_bus import create_bus
+
+class LocalPresence:
+    """Process-local presence and routing table for a single server worker"""
+
+    def __init__(self):
+        self.online_users = {}  # {username: socket_info}
+        self.socket_to_user = {}  # {socket_id: username}
+        self.lock = threading.Lock()
+        # Called as (username, channel, joined) on every worker by join_channel/leave_channel
+        self.channel_handler = None
+
+    def start(self, start_task):
+        """Nothing to synchronise for a single worker"""
+
+    def stop(self):
+        """Nothing to tear down for a single worker"""
+
+    def add(self, username, socket_id):
+        """Route username to socket_id on this worker"""
+        with self.lock:
+            previous = self.online_users.get(username)
+            if previous:
+                self.socket_to_user.pop(previous["socket_id"], None)
+            self.online_users[username] = {
+                "socket_id": socket_id,
+                "connected_at": datetime.now().isoformat()
+            }
+            self.socket_to_user[socket_id] = username
+
+    def remove_socket(self, socket_id):
+        """Drop a socket's route; returns the user that went offline, if any"""
+        with self.lock:
+            username = self.socket_to_user.pop(socket_id, None)
+            if username is None:
+                return None
+            # A newer tab may already own the username
+            info = self.online_users.get(username)
+            if info and info["socket_id"] == socket_id:
+                del self.online_users[username]
+                return username
+            return None
+
+    def remove_user(self, username):
+        """Drop a user's route regardless of which socket it points at"""
+        with self.lock:
+            info = self.online_users.pop(username, None)
+            if info:
+                self.socket_to_user.pop(info["socket_id"], None)
+
+    def get_socket(self, username):
+        """Socket ID a user can be reached at, or None"""
+        info = self.online_users.get(username)
+        return info["socket_id"] if info else None
+
+    def get_user(self, socket_id):
+        """Username bound to a socket on this worker, or None"""
+        return self.socket_to_user.get(socket_id)
+
+    def is_online(self, username):
+        return username in self.online_users
+
+    def get_online_users(self):
+        return list(self.online_users.keys())
+
+    def join_channel(self, username, channel):
+        """Subscribe every socket username has open to a Socket.IO room"""
+        self._update_channel(username, channel, True)
+
+    def leave_channel(self, username, channel):
+        """Take every socket username has open out of a Socket.IO room"""
+        self._update_channel(username, channel, False)
+
+    def _update_channel(self, username, channel, joined):
+        if self.channel_handler:
+            self.channel_handler(username, channel, joined)
+
+class SharedPresence(LocalPresence):
+    """Presence replicated across workers over a message bus
+
+    Each worker is authoritative for its own sockets and publishes changes;
+    the other workers keep a replica so any of them can route to any user.
+    Socket.IO's client manager then delivers emits to whichever worker
+    holds the target socket.
+    """
+
+    CHANNEL = "chatterbox.presence"
+
+    def __init__(self, bus, worker_id=None):
+        super().__init__()
+        self.bus = bus
+        self.worker_id = worker_id or uuid.uuid4().hex
+        self.remote = {}  # {worker_id: {username: socket_id}}
+        self.remote_index = {}  # {username: (worker_id, socket_id)}
+
+    def start(self, start_task):
+        """Subscribe, then ask running workers to announce their users"""
+        messages = self.bus.listen(self.CHANNEL)
+        start_task(self._listen, messages)
+        self._publish("sync_request")
+
+    def stop(self):
+        """Tell the other workers to forget this worker's users"""
+        self._publish("worker_down")
+
+    def add(self, username, socket_id):
+        super().add(username, socket_id)
+        self._publish("join", username=username, socket_id=socket_id)
+
+    def remove_socket(self, socket_id):
+        username = super().remove_socket(socket_id)
+        if username:
+            self._publish("leave", username=username, socket_id=socket_id)
+        return username
+
+    def remove_user(self, username):
+        info = self.online_users.get(username)
+        super().remove_user(username)
+        if info:
+            self._publish("leave", username=username, socket_id=info["socket_id"])
+
+    def get_socket(self, username):
+        local = super().get_socket(username)
+        if local:
+            return local
+        remote = self.remote_index.get(username)
+        return remote[1] if remote else None
+
+    def is_online(self, username):
+        return username in self.online_users or username in self.remote_index
+
+    def get_online_users(self):
+        users = dict.fromkeys(self.online_users)
+        users.update(dict.fromkeys(self.remote_index))
+        return list(users)
+
+    def _update_channel(self, username, channel, joined):
+        """Change username's sockets here and have the other workers do the same with theirs"""
+        super()._update_channel(username, channel, joined)
+        self._publish("channel", username=username, channel=channel, joined=joined)
+
+    def _publish(self, op, **fields):
+        self.bus.publish(self.CHANNEL, {"op": op, "worker": self.worker_id, **fields})
+
+    def _listen(self, messages):
+        """Apply presence changes published by other workers"""
+        for message in messages:
+            worker = message.get("worker")
+            if worker == self.worker_id:
+                continue
+            try:
+                self._apply(worker, message)
+            except Exception as e:
+                print(f"Error applying presence update: {e}")
+
+    def _apply(self, worker, message):
+        op = message["op"]
+        if op == "channel":
+            # Socket.IO room membership is per worker, so each one changes its own sockets
+            super()._update_channel(message["username"], message["channel"], message["joined"])
+            return
+        with self.lock:
+            users = self.remote.setdefault(worker, {})
+            if op == "join":
+                users[message["username"]] = message["socket_id"]
+                self.remote_index[message["username"]] = (worker, message["socket_id"])
+            elif op == "leave":
+                if users.get(message["username"]) == message["socket_id"]:
+                    del users[message["username"]]
+                    if self.remote_index.get(message["username"], (None,))[0] == worker:
+                        del self.remote_index[message["username"]]
+            elif op == "sync":
+                for username, socket_id in message["users"].items():
+                    users[username] = socket_id
+                    self.remote_index[username] = (worker, socket_id)
+            elif op == "worker_down":
+                for username in self.remote.pop(worker, {}):
+                    if self.remote_index.get(username, (None,))[0] == worker:
+                        del self.remote_index[username]
+
+        if op == "sync_request":
+            with self.lock:
+                users = {name: info["socket_id"] for name, info in self.online_users.items()}
+            self._publish("sync", users=users)
+
+class PresenceBroadcaster:
+    """Coalesces presence changes into small, versioned delta broadcasts
+
+    Instead of pushing the whole online list on every change, changes are
+    collected for `window` seconds and sent as one {source, seq, joined, left}
+    frame. A user who joins and leaves inside one window is not mentioned at
+    all. Clients apply deltas in order per source. When they see a gap in
+    seq, they ask for a snapshot; deltas are idempotent, so a snapshot
+    overlapping a pending delta is harmless.
+    """
+
+    EVENT = "presence_delta"
+
+    def __init__(self, emit, source=None, window=0.1):
+        self.emit = emit  # emit(event, payload) to every client
+        self.source = source or uuid.uuid4().hex[:12]
+        self.window = window
+        self.seq = 0
+        self.pending = {}  # {username: (status before the window, latest status)}
+        self.recorded = 0
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {"changes": 0, "deltas": 0, "coalesced": 0}
+
+    def joined(self, username):
+        self._record(username, "online")
+
+    def left(self, username):
+        self._record(username, "offline")
+
+    def _record(self, username, status):
+        with self.lock:
+            self.stats["changes"] += 1
+            self.recorded += 1
+            before = self.pending[username][0] if username in self.pending else (
+                "offline" if status == "online" else "online"
+            )
+            self.pending[username] = (before, status)
+
+    def run(self, sleep):
+        """Flush loop; start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error broadcasting presence: {e}")
+
+    def stop(self):
+        self.running = False
+        self.flush()
+
+    def flush(self):
+        """Broadcast the changes collected since the last flush, if any"""
+        with self.lock:
+            if not self.pending:
+                return None
+            pending, self.pending = self.pending, {}
+            joined = [user for user, (before, now) in pending.items() if now == "online" and before != now]
+            left = [user for user, (before, now) in pending.items() if now == "offline" and before != now]
+            # Changes that never reach a client: repeats and join/leave pairs inside the window
+            self.stats["coalesced"] += self.recorded - len(joined) - len(left)
+            self.recorded = 0
+            if not joined and not left:
+                return None
+            self.seq += 1
+            delta = {"source": self.source, "seq": self.seq, "joined": joined, "left": left}
+            self.stats["deltas"] += 1
+        self.emit(self.EVENT, delta)
+        return delta
+
+    def snapshot(self, users):
+        """Full online list stamped with this worker's current sequence number"""
+        return {"users": users, "source": self.source, "seq": self.seq}
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "seq": self.seq, "pending": len(self.pending)}
+
+def create_presence(message_queue_url=None):
+    """Local presence for one worker, bus-replicated presence when a queue is configured"""
+    if not message_queue_url:
+        return LocalPresence()
+    return SharedPresence(create_bus(message_queue_url))
@@ -0,0 +1,145 @@
+import threading
+import time
+
+# (events per second, burst) allowed per socket; events not listed are unlimited
+DEFAULT_LIMITS = {
+    "private_message": (10, 30),
+    "room_message": (10, 30),
+    "typing": (4, 8),
+    "file_transfer": (1, 5),
+    "file_upload_start": (2, 10),
+    "file_upload_chunk": (256, 512),  # 64 KB chunks: about 16 MB/s per socket
+    "file_upload_complete": (2, 10),
+    "get_chat_history": (5, 20),
+    "get_room_history": (5, 20),
+    "get_online_users": (1, 5),
+    "create_room": (0.2, 5),
+    "add_room_member": (2, 20),
+    "initiate_voice_call": (0.5, 5),
+    "start_conference": (0.5, 5),
+}
+
+# Key of the per-socket bucket that rejections draw on (event names are strings)
+FLOOD = None
+
+class TokenBucket:
+    """Refills at `rate` tokens a second up to `burst`; each event spends one"""
+    __slots__ = ("tokens", "updated", "limited")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+        self.limited = False  # rejected since the last allowed event
+
+    def take(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class RateLimiter:
+    """Token buckets per (socket, event type)
+
+    A rejected event is dropped before its handler touches SQLite or the
+    disk (see limit_incoming_events), so a flooding client costs little
+    more than decoding its packets. Even that adds up on a busy worker, so
+    rejections themselves draw on a bucket of flood_limit that refills at
+    flood_drain a second: a socket that empties it is flooding and should
+    be disconnected. Buckets live as long as the socket; call forget() on
+    disconnect.
+    """
+
+    def __init__(self, limits=None, scale=1.0, flood_limit=50, flood_drain=20, clock=time.monotonic):
+        # scale multiplies every rate and burst; 0 turns limiting off
+        limits = DEFAULT_LIMITS if limits is None else limits
+        self.limits = {
+            event: (rate * scale, max(1.0, burst * scale)) for event, (rate, burst) in limits.items()
+        } if scale else {}
+        # 0 never treats a socket as flooding
+        self.flood_limit = flood_limit
+        self.flood_drain = flood_drain
+        self.clock = clock
+        self.buckets = {}  # {sid: {event: TokenBucket}}
+        self.lock = threading.Lock()
+        self.stats = {"allowed": 0, "rejected": 0, "flooding": 0}
+        self.rejected = {}  # {event: count}
+
+    def check(self, sid, event):
+        """(allowed, notify, flooding)
+
+        notify is True for the first rejection in a run of them, flooding
+        the first time a socket's rejections outrun flood_drain by flood_limit.
+        """
+        limit = self.limits.get(event)
+        if limit is None:
+            return True, False, False
+        now = self.clock()
+        with self.lock:
+            buckets = self.buckets.setdefault(sid, {})
+            bucket = buckets.get(event)
+            if bucket is None:
+                bucket = buckets[event] = TokenBucket(limit[1], now)
+            if bucket.take(limit[0], limit[1], now):
+                bucket.limited = False
+                self.stats["allowed"] += 1
+                return True, False, False
+            # Tell the client once; answering every flooded event would be a flood of its own
+            notify = not bucket.limited
+            bucket.limited = True
+            self.stats["rejected"] += 1
+            self.rejected[event] = self.rejected.get(event, 0) + 1
+            flooding = False
+            if self.flood_limit:
+                allowance = buckets.get(FLOOD)
+                if allowance is None:
+                    allowance = buckets[FLOOD] = TokenBucket(self.flood_limit, now)
+                if not allowance.take(self.flood_drain, self.flood_limit, now) and not allowance.limited:
+                    allowance.limited = flooding = True
+                    self.stats["flooding"] += 1
+            return False, notify, flooding
+
+    def retry_after(self, sid, event):
+        """Seconds until sid may send event again"""
+        limit = self.limits.get(event)
+        with self.lock:
+            bucket = self.buckets.get(sid, {}).get(event)
+            if limit is None or bucket is None or not limit[0]:
+                return 0.0
+            return max(0.0, (1 - bucket.tokens) / limit[0])
+
+    def forget(self, sid):
+        """Drop a disconnected socket's buckets"""
+        with self.lock:
+            self.buckets.pop(sid, None)
+
+    def get_stats(self):
+        """Allowed/rejected counters, rejections per event and tracked sockets"""
+        with self.lock:
+            return {**self.stats, "rejected_by_event": dict(self.rejected), "sockets": len(self.buckets)}
+
+def limit_incoming_events(server, limiter, on_reject=None, on_flood=None):
+    """Check every incoming event of a python-socketio Server against limiter
+
+    Wraps Server._handle_event, the last step before a handler task is
+    started and Flask-SocketIO sets up the request context and session,
+    which cost far more than the check itself. on_reject(sid, event) is
+    called for the first rejection in a run, on_flood(sid) once when a
+    socket starts flooding.
+    """
+    handle_event = server._handle_event
+
+    def _handle_event(eio_sid, namespace, id, data):
+        sid = server.manager.sid_from_eio_sid(eio_sid, namespace or '/')
+        if sid is not None and data:
+            allowed, notify, flooding = limiter.check(sid, data[0])
+            if not allowed:
+                if flooding and on_flood:
+                    on_flood(sid)
+                elif notify and on_reject:
+                    on_reject(sid, data[0])
+                return
+        handle_event(eio_sid, namespace, id, data)
+
+    server._handle_event = _handle_event
@@ -0,0 +1,158 @@
+import threading
+
+MAX_ROOM_MEMBERS = 1000
+
+def room_key(room_id):
+    """chat_history conversation key for a room's messages"""
+    # \x1e (record separator) cannot appear in a username, so this never matches a 1:1 key
+    return f"\x1eroom:{room_id}"
+
+def room_channel(room_id):
+    """Socket.IO room that every online member's socket joins"""
+    return f"chatroom:{room_id}"
+
+def user_channel(username):
+    """Socket.IO room holding every socket a user has open, older tabs included"""
+    return f"\x1euser:{username}"
+
+class RoomManager:
+    """Group chat rooms and their membership, stored once per member
+
+    Membership lives in room_members and is cached per room, so checking a
+    sender costs no database read on the message path. Workers sharing the
+    database through a message queue must run with cache_members=False,
+    since one worker cannot see another's membership changes. Messages
+    themselves are written by UserManager, one chat_history row per
+    message whatever the room size.
+    """
+
+    def __init__(self, db, max_members=MAX_ROOM_MEMBERS, cache_members=True):
+        self.db = db
+        self.max_members = max_members
+        self.cache_members = cache_members
+        self.members = {}  # {room_id: set of usernames}, loaded on first use
+        self.lock = threading.Lock()
+
+    def create_room(self, name, owner, members=()):
+        """Create a room owned by owner with the given initial members"""
+        name = (name or "").strip()
+        if not name:
+            return {"success": False, "error": "Room name is required"}
+        usernames = {owner, *members}
+        if len(usernames) > self.max_members:
+            return {"success": False, "error": f"Rooms are limited to {self.max_members} members"}
+        known = self._existing_users(usernames)
+        try:
+            with self.db.transaction() as conn:
+                room_id = conn.execute(
+                    "INSERT INTO rooms (name, owner) VALUES (?, ?)", (name, owner)
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO room_members (room_id, username) VALUES (?, ?)",
+                    [(room_id, username) for username in known]
+                )
+        except Exception as e:
+            print(f"Error creating room: {e}")
+            return {"success": False, "error": "Could not create room"}
+        if self.cache_members:
+            with self.lock:
+                self.members[room_id] = set(known)
+        return {"success": True, "room": {"id": room_id, "name": name, "owner": owner, "members": sorted(known)}}
+
+    def add_member(self, room_id, username, added_by):
+        """Add username to a room; only existing members may add people"""
+        members = self._members(room_id)
+        if added_by not in members:
+            return {"success": False, "error": "Not a member of this room"}
+        if username in members:
+            return {"success": True, "room_id": room_id, "username": username}
+        if len(members) >= self.max_members:
+            return {"success": False, "error": f"Rooms are limited to {self.max_members} members"}
+        if not self._existing_users([username]):
+            return {"success": False, "error": "User not found"}
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO room_members (room_id, username) VALUES (?, ?)", (room_id, username)
+            )
+        with self.lock:
+            if room_id in self.members:
+                self.members[room_id].add(username)
+        return {"success": True, "room_id": room_id, "username": username}
+
+    def remove_member(self, room_id, username):
+        """Take username out of a room"""
+        with self.db.transaction() as conn:
+            removed = conn.execute(
+                "DELETE FROM room_members WHERE room_id = ? AND username = ?", (room_id, username)
+            ).rowcount
+        with self.lock:
+            if room_id in self.members:
+                self.members[room_id].discard(username)
+        if not removed:
+            return {"success": False, "error": "Not a member of this room"}
+        return {"success": True, "room_id": room_id, "username": username}
+
+    def get_members(self, room_id):
+        """Usernames in a room (empty for an unknown room)"""
+        members = self._members(room_id)
+        with self.lock:
+            return set(members)
+
+    def _members(self, room_id):
+        """The cached member set itself; callers must not modify it"""
+        with self.lock:
+            members = self.members.get(room_id)
+            if members is not None:
+                return members
+        rows = self.db.fetchall("SELECT username FROM room_members WHERE room_id = ?", (room_id,))
+        members = {row[0] for row in rows}
+        if not self.cache_members:
+            return members
+        with self.lock:
+            # Only cache rooms that exist, so probing random ids cannot fill the cache
+            if members:
+                members = self.members.setdefault(room_id, members)
+        return members
+
+    def is_member(self, room_id, username):
+        """Whether username belongs to room_id"""
+        if not self.cache_members:
+            return self.db.fetchone(
+                "SELECT 1 FROM room_members WHERE room_id = ? AND username = ?", (room_id, username)
+            ) is not None
+        return username in self._members(room_id)
+
+    def get_room(self, room_id):
+        """Room details with its member list, or None"""
+        row = self.db.fetchone("SELECT id, name, owner, created_at FROM rooms WHERE id = ?", (room_id,))
+        if row is None:
+            return None
+        return {"id": row[0], "name": row[1], "owner": row[2], "created_at": row[3],
+                "members": sorted(self.get_members(room_id))}
+
+    def get_user_rooms(self, username):
+        """Rooms username belongs to, newest first"""
+        rows = self.db.fetchall('''
+            SELECT r.id, r.name, r.owner, r.created_at
+            FROM room_members m JOIN rooms r ON r.id = m.room_id
+            WHERE m.username = ?
+            ORDER BY r.id DESC
+        ''', (username,))
+        return [{"id": row[0], "name": row[1], "owner": row[2], "created_at": row[3]} for row in rows]
+
+    def _existing_users(self, usernames):
+        usernames = list(usernames)
+        found = set()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(usernames), 500):
+            chunk = usernames[start:start + 500]
+            rows = self.db.fetchall(
+                f"SELECT username FROM users WHERE username IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def get_stats(self):
+        """Number of rooms with cached membership"""
+        with self.lock:
+            return {"cached_rooms": len(self.members)}
@@ -0,0 +1,172 @@
+"""Production entry point for the ChatterBox server.
+
+    python serve.py --workers 4 --port 5000 --async-mode eventlet --max-connections 5000
+
+Each worker is its own process on port + index. With more than one worker,
+put a load balancer with sticky sessions (e.g. nginx ip_hash) in front of
+them and set CHATTERBOX_MESSAGE_QUEUE so they share presence and emits,
+and CHATTERBOX_SECRET_KEY so a session token from one worker is valid on all.
+
+Voice calls need a single worker. Call and relay-route state lives in the
+worker whose sockets handled the call events, and only that worker's UDP
+relay knows the call's tokens, so --workers > 1 refuses to start unless
+--no-voice is given. Workers started without voice reject call and
+conference events.
+
+On SIGTERM a worker drains: it stops accepting connections, closes client
+transports (clients reconnect through the load balancer), flushes queued
+message writes and stops the UDP relay before exiting.
+"""
+import argparse
+import logging
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ASYNC_MODES = ("eventlet", "gevent", "threading")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the ChatterBox server")
+    parser.add_argument("--host", default=os.environ.get("CHATTERBOX_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("CHATTERBOX_PORT", 5000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("CHATTERBOX_WORKERS", 1)))
+    parser.add_argument("--async-mode", choices=ASYNC_MODES,
+                        default=os.environ.get("CHATTERBOX_ASYNC_MODE", "eventlet"))
+    parser.add_argument("--max-connections", type=int,
+                        default=int(os.environ.get("CHATTERBOX_MAX_CONNECTIONS", 10000)),
+                        help="concurrent connections per worker")
+    parser.add_argument("--drain-timeout", type=float, default=10.0,
+                        help="seconds a worker may spend draining after SIGTERM")
+    parser.add_argument("--no-voice", action="store_true", help="do not run the UDP voice relay")
+    parser.add_argument("--worker-index", type=int, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def run_supervisor(args):
+    """Spawn one process per worker and forward termination signals to them"""
+    if args.workers > 1 and not os.environ.get("CHATTERBOX_MESSAGE_QUEUE"):
+        sys.exit("--workers > 1 needs CHATTERBOX_MESSAGE_QUEUE so workers can share presence")
+    if args.workers > 1 and not args.no_voice:
+        sys.exit("--workers > 1 needs --no-voice: call state is per worker, so voice needs a single worker")
+
+    children = []
+    for index in range(args.workers):
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            "--host", args.host,
+            "--port", str(args.port),
+            "--async-mode", args.async_mode,
+            "--max-connections", str(args.max_connections),
+            "--drain-timeout", str(args.drain_timeout),
+            "--worker-index", str(index),
+        ]
+        if args.no_voice:
+            command.append("--no-voice")
+        children.append(subprocess.Popen(command))
+        print(f"worker {index} (pid {children[-1].pid}) on {args.host}:{args.port + index}")
+
+    def forward(signum, frame):
+        for child in children:
+            if child.poll() is None:
+                child.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    exit_code = 0
+    for child in children:
+        exit_code = child.wait() or exit_code
+    return exit_code
+
+def run_worker(args):
+    """Serve one worker on the chosen async stack until SIGTERM"""
+    # Monkey patching has to happen before server (and its threads/sockets) is imported
+    if args.async_mode == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    elif args.async_mode == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+    os.environ["CHATTERBOX_ASYNC_MODE"] = args.async_mode
+
+    import server
+
+    port = args.port + args.worker_index
+    server.start_services(voice=not args.no_voice)
+    listener = {}
+
+    def drain():
+        # Signal handlers cannot wake a blocked event loop, so poll for the request
+        while not listener.get("draining"):
+            server.socketio.sleep(0.25)
+        server.logger.info(f"Worker {args.worker_index} draining...")
+        stop = listener.get("stop")
+        if stop:
+            stop()
+        # Closing the Engine.IO transports makes clients reconnect elsewhere. Each close
+        # waits for its send queue, so a half-dead socket must not hold up the rest.
+        eio = server.socketio.server.eio
+        for sid in list(eio.sockets):
+            server.socketio.start_background_task(eio.disconnect, sid)
+        server.socketio.sleep(0.5)
+        server.stop_services()
+        server.logger.info(f"Worker {args.worker_index} stopped")
+        logging.shutdown()
+        os._exit(0)
+
+    def drain_expired(signum, frame):
+        server.logger.error(f"Worker {args.worker_index} did not drain in {args.drain_timeout}s")
+        logging.shutdown()
+        os._exit(1)
+
+    def on_signal(signum, frame):
+        if listener.get("draining"):
+            return
+        listener["draining"] = True
+        # SIGALRM fires even when the event loop is too busy to run the drain task
+        if hasattr(signal, "SIGALRM"):
+            signal.signal(signal.SIGALRM, drain_expired)
+            signal.alarm(max(1, math.ceil(args.drain_timeout)))
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    server.socketio.start_background_task(drain)
+
+    server.logger.info(f"Worker {args.worker_index} serving on {args.host}:{port} "
+                       f"({args.async_mode}, max {args.max_connections} connections)")
+
+    if args.async_mode == "eventlet":
+        import eventlet
+        import eventlet.wsgi
+        sock = eventlet.listen((args.host, port), backlog=2048)
+        listener["stop"] = sock.close
+        eventlet.wsgi.server(sock, server.app, max_size=args.max_connections, log_output=False)
+    elif args.async_mode == "gevent":
+        from gevent import pywsgi
+        from gevent.pool import Pool
+        try:
+            from geventwebsocket.handler import WebSocketHandler as handler_class
+        except ImportError:
+            handler_class = pywsgi.WSGIHandler
+        http_server = pywsgi.WSGIServer((args.host, port), server.app, spawn=Pool(args.max_connections),
+                                        handler_class=handler_class, log=None)
+        listener["stop"] = http_server.close
+        http_server.serve_forever()
+    else:
+        server.logger.warning("threading mode has no connection limit; use eventlet or gevent in production")
+        server.socketio.run(server.app, host=args.host, port=port, allow_unsafe_werkzeug=True)
+
+    # Reached only if the server loop returns on its own
+    while True:
+        time.sleep(1)
+
+def main():
+    args = parse_args()
+    if args.worker_index is None:
+        sys.exit(run_supervisor(args))
+    run_worker(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
-from flask import Flask, request, jsonify
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask import Flask, request, jsonify, send_file, abort, session
+from flask_socketio import SocketIO, emit, join_room, ConnectionRefusedError
 from flask_cors import CORS
 from user_manager import UserManager
 from file_transfer import FileTransferManager
-from voice_chat import VoiceChatManager
+from voice_chat import VoiceChatManager, MAX_CONFERENCE_PARTICIPANTS
+from rooms import room_channel, user_channel, MAX_ROOM_MEMBERS
+from envelopes import Envelope, create_packet_class
+from message_bus import create_socketio_options
+from presence import create_presence, PresenceBroadcaster
+from hashing import PasswordHasher, create_offload
+from rate_limit import RateLimiter, limit_incoming_events
+from backpressure import Backpressure, STUCK
+from typing_state import TypingCoalescer
+from metrics import Metrics
 import logging
+import secrets
 from datetime import datetime
+from urllib.parse import quote
 import os
 
 # Configure logging
@@ -21,21 +32,142 @@ logger = logging.getLogger(__name__)
 
 # Initialize Flask app and SocketIO
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'chatterbox-secret-key-2025'
+# Signs session tokens; set it in production so tokens survive restarts and work on every worker
+SECRET_KEY = os.environ.get('CHATTERBOX_SECRET_KEY')
+if not SECRET_KEY:
+    if os.environ.get('CHATTERBOX_MESSAGE_QUEUE'):
+        # Every worker would sign with its own key and reject the others' tokens
+        raise RuntimeError("CHATTERBOX_SECRET_KEY must be set when workers share a message queue")
+    SECRET_KEY = secrets.token_hex(32)
+    logger.warning("CHATTERBOX_SECRET_KEY is not set; using a random key, so sessions end on restart")
+app.config['SECRET_KEY'] = SECRET_KEY
+# Set to an nginx internal location aliased to uploads/.blobs to offload file downloads
+app.config['ACCEL_REDIRECT_PREFIX'] = os.environ.get('CHATTERBOX_ACCEL_REDIRECT_PREFIX')
 CORS(app, resources={r"/*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25)
+
+# With a message queue (redis://, amqp://, or memory:// for local tests) several
+# workers share presence and emits; without one the server is a single process
+MESSAGE_QUEUE = os.environ.get('CHATTERBOX_MESSAGE_QUEUE')
+# serve.py picks eventlet/gevent (after monkey patching) for production
+ASYNC_MODE = os.environ.get('CHATTERBOX_ASYNC_MODE', 'threading')
+# "msgpack" needs the msgpack package and clients using socket.io-msgpack-parser. The
+# bundled React frontend only speaks JSON, so msgpack is for deployments with other clients.
+WIRE_FORMAT = os.environ.get('CHATTERBOX_WIRE_FORMAT', 'json')
+if WIRE_FORMAT == 'msgpack':
+    logger.warning("CHATTERBOX_WIRE_FORMAT=msgpack: the bundled web frontend cannot connect (JSON only)")
+socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25,
+                    async_mode=ASYNC_MODE, serializer=create_packet_class(WIRE_FORMAT),
+                    **create_socketio_options(MESSAGE_QUEUE))
 
 # Initialize managers
-user_manager = UserManager()
-file_manager = FileTransferManager()
-voice_manager = VoiceChatManager(udp_port=5001)
+# Handler and SQLite latency histograms; everything else is read from get_stats() per scrape
+metrics = Metrics()
+presence = create_presence(MESSAGE_QUEUE)
+# Online/offline changes go out as coalesced deltas rather than full user lists
+presence_broadcaster = PresenceBroadcaster(socketio.emit)
+hasher = PasswordHasher(
+    rounds=int(os.environ.get('CHATTERBOX_BCRYPT_ROUNDS', 12)),
+    workers=int(os.environ.get('CHATTERBOX_HASH_WORKERS', 0)) or None,
+    max_queue=int(os.environ.get('CHATTERBOX_HASH_QUEUE', 64)),
+    offload=create_offload(ASYNC_MODE)
+)
+# Other workers' writes would not reach this worker's history cache, so it is single-worker only
+HISTORY_CACHE_BYTES = 0 if MESSAGE_QUEUE else int(os.environ.get('CHATTERBOX_HISTORY_CACHE_MB', 32)) * 1024 * 1024
+# Room membership is cached per worker for the same reason
+user_manager = UserManager(presence=presence, hasher=hasher, secret_key=app.config['SECRET_KEY'],
+                           history_cache_bytes=HISTORY_CACHE_BYTES, cache_room_members=not MESSAGE_QUEUE,
+                           db_observer=metrics.observer('sqlite_query_seconds', 'SQLite query and transaction time',
+                                                        'operation', database='users'))
+file_manager = FileTransferManager(
+    db_observer=metrics.observer('sqlite_query_seconds', 'SQLite query and transaction time',
+                                 'operation', database='files')
+)
+voice_manager = VoiceChatManager(
+    udp_port=int(os.environ.get('CHATTERBOX_UDP_PORT', 5001)),
+    shards=int(os.environ.get('CHATTERBOX_UDP_SHARDS', 1)),
+    batch_size=int(os.environ.get('CHATTERBOX_UDP_BATCH', 0)),
+    jitter_buffer=os.environ.get('CHATTERBOX_VOICE_JITTER_BUFFER', '0') == '1',
+    legacy_protocol=os.environ.get('CHATTERBOX_VOICE_LEGACY', '0') == '1'
+)
+# Per-socket token buckets for every event that does database or disk work; 0 disables them
+rate_limiter = RateLimiter(
+    scale=float(os.environ.get('CHATTERBOX_RATE_LIMIT_SCALE', 1)),
+    # Rejected events a socket may bank up (refilled at 20/s) before it is cut off; 0 never
+    flood_limit=int(os.environ.get('CHATTERBOX_RATE_LIMIT_FLOOD', 50))
+)
+
+def reject_event(sid, event):
+    """Tell a client it is being rate limited (once per run of rejected events)"""
+    if event == 'typing':
+        return  # The next keystroke, or the typing timeout, settles the state
+    socketio.emit('error', {
+        "message": "Too many requests, slow down",
+        "event": event,
+        "retry_after": round(rate_limiter.retry_after(sid, event), 2)
+    }, to=sid)
+
+def disconnect_flooder(sid):
+    """Cut off a socket that keeps sending far past its rate limits"""
+    logger.warning(f"Disconnecting {sid}: flooding past its rate limits")
+    socketio.server.disconnect(sid, namespace='/')
+
+limit_incoming_events(socketio.server, rate_limiter, reject_event, disconnect_flooder)
+
+def outbound_queue_depth(sid):
+    """Packets waiting to be written to a socket held by this worker, or None"""
+    eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+    eio_socket = socketio.server.eio.sockets.get(eio_sid) if eio_sid else None
+    return eio_socket.queue.qsize() if eio_socket else None
+
+backpressure = Backpressure(
+    outbound_queue_depth, socketio.emit,
+    lambda sid: socketio.server.disconnect(sid, namespace='/'),
+    soft_limit=int(os.environ.get('CHATTERBOX_SLOW_CONSUMER_QUEUE', 64)),
+    hard_limit=int(os.environ.get('CHATTERBOX_STUCK_CONSUMER_QUEUE', 1024))
+)
+
+def send_typing_state(sender, receiver, is_typing):
+    """Tell a receiver that sender started or stopped typing; False to retry later"""
+    receiver_socket = user_manager.get_user_socket(receiver)
+    if not receiver_socket:
+        return True  # Nobody to tell
+    # Held back while the receiver is falling behind, then retried with the latest state
+    if not backpressure.allow_optional(receiver_socket):
+        return False
+    socketio.emit('user_typing', {"username": sender, "is_typing": is_typing}, to=receiver_socket)
+    return True
 
-# Store socket ID to username mapping
-socket_to_user = {}
-user_to_socket = {}
+# Keystroke-rate typing events go out as start/stop transitions, expired server-side;
+# a window of 0 forwards every event
+typing_coalescer = TypingCoalescer(
+    send_typing_state,
+    window=float(os.environ.get('CHATTERBOX_TYPING_WINDOW', 0.25)),
+    timeout=float(os.environ.get('CHATTERBOX_TYPING_TIMEOUT', 5))
+)
+
+def start_services(voice=True):
+    """Start background listeners; called once per worker process"""
+    presence.start(socketio.start_background_task)
+    socketio.start_background_task(presence_broadcaster.run, socketio.sleep)
+    socketio.start_background_task(backpressure.run, socketio.sleep)
+    socketio.start_background_task(typing_coalescer.run, socketio.sleep)
+    
+    # Only one worker per host owns the voice UDP port
+    if voice:
+        voice_manager.start_udp_server()
+    
+    # Expire old uploads in the background
+    file_manager.start_janitor()
 
-# Start voice chat UDP server
-voice_manager.start_udp_server()
+def stop_services():
+    """Stop background listeners and flush pending writes"""
+    voice_manager.stop_udp_server()
+    file_manager.stop_janitor()
+    presence_broadcaster.stop()
+    backpressure.stop()
+    typing_coalescer.stop()
+    presence.stop()
+    user_manager.close()
 
 # HTTP Routes for basic endpoints
 @app.route('/health', methods=['GET'])
@@ -44,7 +176,65 @@ def health_check():
     return jsonify({
         "status": "running",
         "timestamp": datetime.now().isoformat(),
-        "online_users": len(user_manager.get_online_users())
+        "online_users": len(user_manager.get_online_users()),
+        # Clients pick their Socket.IO parser from this before connecting
+        "wire_format": WIRE_FORMAT
+    })
+
+def collect_metrics():
+    """Counters and gauges for /metrics, read from the managers' own stats"""
+    voice = voice_manager.get_stats()
+    writer = user_manager.writer.get_stats()
+    depths = [eio_socket.queue.qsize() for eio_socket in list(socketio.server.eio.sockets.values())]
+    return [
+        ("connected_sockets", "gauge", "Engine.IO connections held by this worker",
+         [({}, len(depths))]),
+        ("online_users", "gauge", "Users online across all workers",
+         [({}, len(user_manager.get_online_users()))]),
+        ("voice_relay_packets_total", "counter", "UDP voice packets by outcome",
+         [({"outcome": outcome}, voice[outcome]) for outcome in ("relayed", "buffered", "mixed", "dropped")]),
+        ("voice_relay_bytes_total", "counter", "UDP voice payload bytes relayed or buffered for relay",
+         [({}, voice["relayed_bytes"])]),
+        ("voice_active_calls", "gauge", "Calls ringing or in progress",
+         [({}, voice["calls"]["live"])]),
+        ("voice_conferences", "gauge", "Conferences being mixed",
+         [({}, voice["conferences"])]),
+        ("outbound_queue_packets", "gauge", "Packets waiting to be written to this worker's sockets",
+         [({"stat": "total"}, sum(depths)), ({"stat": "max"}, max(depths, default=0))]),
+        ("deferred_event_sockets", "gauge", "Slow sockets with file notices held back",
+         [({}, backpressure.get_stats()["backlogged_sockets"])]),
+        ("message_writer_queue_depth", "gauge", "Messages accepted but not yet committed",
+         [({}, writer["queue_depth"])]),
+        ("message_writer_written_total", "counter", "Messages committed by the write-behind writer",
+         [({}, writer["written"])]),
+        ("password_hashes_in_flight", "gauge", "bcrypt jobs queued or running",
+         [({}, hasher.get_stats()["in_flight"])]),
+        ("rate_limited_events_total", "counter", "Socket.IO events dropped by per-socket rate limits",
+         [({"event": event}, count) for event, count in rate_limiter.get_stats()["rejected_by_event"].items()]),
+    ]
+
+metrics.add_collector(collect_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Internal counters for the background pipelines"""
+    return jsonify({
+        "message_writer": user_manager.writer.get_stats(),
+        "password_hasher": hasher.get_stats(),
+        "sessions": user_manager.sessions.get_stats(),
+        "presence": presence_broadcaster.get_stats(),
+        "history_cache": user_manager.history_cache.get_stats() if user_manager.history_cache else None,
+        "rate_limits": rate_limiter.get_stats(),
+        "backpressure": backpressure.get_stats(),
+        "typing": typing_coalescer.get_stats(),
+        "rooms": user_manager.rooms.get_stats(),
+        "voice": voice_manager.get_stats(),
+        "files": file_manager.get_stats()
     })
 
 @app.route('/api/register', methods=['POST'])
@@ -60,9 +250,12 @@ def register():
     result = user_manager.register_user(username, password)
     logger.info(f"Registration attempt for {username}: {result['message']}")
     
+    if result.get('busy'):
+        return jsonify(result), 503, {"Retry-After": "1"}
     return jsonify(result), 200 if result['success'] else 400
 
 @app.route('/api/login', methods=['POST'])
+@metrics.timed('handler_seconds', 'Socket.IO event and HTTP handler time', handler='login')
 def login():
     """User login endpoint"""
     data = request.json
@@ -75,13 +268,64 @@ def login():
     result = user_manager.login_user(username, password)
     logger.info(f"Login attempt for {username}: {result['message']}")
     
+    if result.get('busy'):
+        return jsonify(result), 503, {"Retry-After": "1"}
     return jsonify(result), 200 if result['success'] else 401
 
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    """Revoke a session token"""
+    data = request.json or {}
+    result = user_manager.logout_user(data.get('token'))
+    return jsonify(result), 200 if result['success'] else 400
+
+def file_download_url(file_hash, file_name):
+    """Reference a stored blob instead of shipping its bytes over the socket"""
+    return f"/api/files/{file_hash}?name={quote(file_name)}"
+
+@app.route('/api/files/<file_hash>', methods=['GET'])
+def download_file(file_hash):
+    """Serve a stored file by content hash, honouring Range requests"""
+    # Authorization: Bearer <session token>; only the file's sender and receivers may fetch it
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    username = user_manager.authenticate_token(token) if scheme.lower() == 'bearer' else None
+    if username is None:
+        abort(401)
+    # 404 rather than 403, so a hash cannot be used to probe for stored files
+    blob_path = file_manager.get_blob_path(file_hash, username)
+    if blob_path is None:
+        abort(404)
+    download_name = os.path.basename(request.args.get('name') or file_hash)
+    
+    accel_prefix = app.config.get('ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        # Behind nginx: hand the file off so it is sent with sendfile() and nginx's Range support
+        relative_path = os.path.relpath(blob_path, file_manager.blobs.root).replace(os.sep, '/')
+        response = app.response_class()
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + relative_path
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+        return response
+    
+    # Full-body responses go through wsgi.file_wrapper, which servers map to sendfile()
+    return send_file(os.path.abspath(blob_path), as_attachment=True,
+                     download_name=download_name, conditional=True, etag=file_hash)
+
+def current_user():
+    """Username this socket authenticated as on connect"""
+    return session.get('username')
+
 # Socket.IO Events
 @socketio.on('connect')
-def handle_connect():
-    """Handle client connection"""
-    logger.info(f"Client connected: {request.sid}")
+def handle_connect(auth=None):
+    """Handle client connection; the client must present its session token"""
+    token = auth.get('token') if isinstance(auth, dict) else None
+    username = user_manager.authenticate_token(token)
+    if username is None:
+        logger.info(f"Rejected unauthenticated connection: {request.sid}")
+        raise ConnectionRefusedError('unauthorized')
+    session['username'] = username
+    
+    logger.info(f"Client connected: {username} ({request.sid})")
     emit('connection_response', {
         "success": True,
         "message": "Connected to ChatterBox server",
@@ -92,19 +336,14 @@ def handle_connect():
 def handle_disconnect():
     """Handle client disconnection"""
     socket_id = request.sid
-    username = socket_to_user.get(socket_id)
+    username = user_manager.set_socket_offline(socket_id)
+    rate_limiter.forget(socket_id)
+    backpressure.forget(socket_id)
     
     if username:
-        user_manager.set_user_offline(username)
-        del socket_to_user[socket_id]
-        del user_to_socket[username]
-        
-        # Notify all clients about user going offline
-        emit('user_status_changed', {
-            "username": username,
-            "status": "offline",
-            "online_users": user_manager.get_online_users()
-        }, broadcast=True)
+        # Other clients learn about it from the next presence delta
+        presence_broadcaster.left(username)
+        typing_coalescer.forget(username)
         
         logger.info(f"User disconnected: {username} ({socket_id})")
     else:
@@ -113,39 +352,51 @@ def handle_disconnect():
 @socketio.on('user_online')
 def handle_user_online(data):
     """Handle user coming online after login"""
-    username = data.get('username')
+    username = current_user()
     socket_id = request.sid
     
     if username:
         user_manager.set_user_online(username, socket_id)
-        socket_to_user[socket_id] = username
-        user_to_socket[username] = socket_id
         
         logger.info(f"User online: {username} ({socket_id})")
         
-        # Send online users list to the new user
-        emit('online_users', {
-            "users": user_manager.get_online_users()
-        })
+        # The new user starts from a snapshot; everyone else gets a delta
+        emit('online_users', presence_broadcaster.snapshot(user_manager.get_online_users()))
+        presence_broadcaster.joined(username)
+        
+        # Lets a leave_room reach this socket even after a newer tab takes over presence
+        join_room(user_channel(username))
+        # Room messages reach this socket through one emit per room, whatever its size
+        for room in user_manager.rooms.get_user_rooms(username):
+            join_room(room_channel(room["id"]))
         
-        # Broadcast to all clients that this user is online
-        emit('user_status_changed', {
-            "username": username,
-            "status": "online",
-            "online_users": user_manager.get_online_users()
-        }, broadcast=True)
+        deliver_offline_messages(username)
+
+def deliver_offline_messages(username):
+    """Push messages queued while username was offline, a few large batches per reconnect"""
+    after_id = 0
+    while True:
+        batch = user_manager.get_undelivered_messages(username, after_id)
+        if not batch:
+            return
+        after_id = batch[-1]["id"]
+        # Rows are marked delivered only once the client acknowledges the batch
+        emit('offline_messages', {"messages": batch},
+             callback=lambda *args, up_to=after_id: user_manager.mark_delivered(username, up_to))
+        logger.info(f"Delivered {len(batch)} offline messages to {username}")
+        if len(batch) < user_manager.OFFLINE_BATCH_SIZE:
+            return
 
 @socketio.on('get_online_users')
 def handle_get_online_users():
-    """Get list of online users"""
-    emit('online_users', {
-        "users": user_manager.get_online_users()
-    })
+    """Full online list; clients ask for it when they miss a presence delta"""
+    emit('online_users', presence_broadcaster.snapshot(user_manager.get_online_users()))
 
 @socketio.on('private_message')
+@metrics.timed('handler_seconds', 'Socket.IO event and HTTP handler time', handler='private_message')
 def handle_private_message(data):
     """Handle private message between users"""
-    sender = data.get('sender')
+    sender = current_user()
     receiver = data.get('receiver')
     message = data.get('message')
     timestamp = data.get('timestamp', datetime.now().isoformat())
@@ -154,26 +405,33 @@ def handle_private_message(data):
         emit('error', {"message": "Invalid message data"})
         return
     
-    # Save message to database
-    user_manager.save_message(sender, receiver, message)
+    receiver_socket = user_manager.get_user_socket(receiver)
+    # A receiver that stopped reading is disconnected and gets this with its offline messages
+    if receiver_socket and backpressure.state(receiver_socket) == STUCK:
+        receiver_socket = None
     
-    # Create message object
-    message_data = {
+    # Queue message for the background writer; blocks briefly when the queue is full.
+    # Messages for offline users stay undelivered until they come back online.
+    if not user_manager.save_message(sender, receiver, message, delivered=receiver_socket is not None):
+        logger.warning(f"Message queue full, rejecting message from {sender}")
+        emit('error', {"message": "Server busy, message not sent"})
+        return
+    
+    # Create message object, encoded once however many emits carry it
+    message_data = Envelope({
         "sender": sender,
         "receiver": receiver,
         "message": message,
         "timestamp": timestamp,
         "type": "text"
-    }
+    })
     
     # Send to receiver if online
-    receiver_socket = user_to_socket.get(receiver)
     if receiver_socket:
         emit('private_message', message_data, room=receiver_socket)
         logger.info(f"Message sent from {sender} to {receiver}")
     else:
-        # Store for offline delivery
-        logger.info(f"Message stored for offline user {receiver}")
+        logger.info(f"Message queued for offline user {receiver}")
     
     # Send acknowledgment to sender
     emit('message_sent', {
@@ -183,12 +441,12 @@ def handle_private_message(data):
     })
 
 @socketio.on('file_transfer')
+@metrics.timed('handler_seconds', 'Socket.IO event and HTTP handler time', handler='file_transfer')
 def handle_file_transfer(data):
     """Handle file transfer between users"""
-    sender = data.get('sender')
+    sender = current_user()
     receiver = data.get('receiver')
     file_name = data.get('file_name')
-    file_size = data.get('file_size')
     file_data = data.get('file_data')
     
     if not all([sender, receiver, file_name, file_data]):
@@ -201,21 +459,19 @@ def handle_file_transfer(data):
     result = file_manager.receive_file(file_data, file_name, sender, receiver)
     
     if result['success']:
-        # Create file message
-        file_message = {
+        # Forward a reference; the receiver downloads the stored blob over HTTP
+        file_message = Envelope({
             "type": "file",
             "sender": sender,
             "receiver": receiver,
             "file_name": file_name,
-            "file_size": file_size,
-            "file_data": file_data,
+            "file_size": result['file_size'],
+            "file_hash": result['file_hash'],
+            "download_url": file_download_url(result['file_hash'], file_name),
             "timestamp": datetime.now().isoformat()
-        }
+        })
         
-        # Send to receiver if online
-        receiver_socket = user_to_socket.get(receiver)
-        if receiver_socket:
-            emit('file_received', file_message, room=receiver_socket)
+        if send_file_notice(receiver, file_message):
             logger.info(f"File sent from {sender} to {receiver}: {file_name}")
         
         # Send acknowledgment to sender
@@ -227,35 +483,139 @@ def handle_file_transfer(data):
     else:
         emit('error', {"message": f"File transfer failed: {result.get('error', 'Unknown error')}"})
 
+def send_file_notice(receiver, file_message):
+    """Tell an online receiver about a stored file; held back while its socket is falling behind"""
+    receiver_socket = user_manager.get_user_socket(receiver)
+    if not receiver_socket:
+        return False
+    return backpressure.send_deferrable(receiver_socket, 'file_received', file_message)
+
+@socketio.on('file_upload_start')
+def handle_file_upload_start(data):
+    """Open (or resume) a chunked file upload"""
+    sender = current_user()
+    receiver = data.get('receiver')
+    file_name = data.get('file_name')
+    file_size = data.get('file_size')
+    transfer_id = data.get('transfer_id')
+    file_hash = data.get('file_hash')
+    client_ref = data.get('client_ref')
+    
+    if not transfer_id and not all([sender, receiver, file_name, file_size is not None]):
+        emit('error', {"message": "Invalid file upload data"})
+        return
+    
+    try:
+        result = file_manager.start_upload(sender, receiver, file_name, file_size,
+                                           transfer_id, file_hash)
+    except (TypeError, ValueError):
+        result = {"success": False, "error": "Invalid file size"}
+    
+    if result['success']:
+        emit('file_upload_ready', {
+            "client_ref": client_ref,
+            "transfer_id": result['transfer_id'],
+            "offset": result['offset'],
+            "chunk_size": result['chunk_size']
+        })
+        logger.info(f"File upload ready: {file_name or transfer_id} from {sender} at offset {result['offset']}")
+    else:
+        emit('file_upload_error', {
+            "client_ref": client_ref,
+            "transfer_id": transfer_id,
+            "message": result['error']
+        })
+
+@socketio.on('file_upload_chunk')
+def handle_file_upload_chunk(data):
+    """Append one binary chunk to an upload and acknowledge the next offset"""
+    transfer_id = data.get('transfer_id')
+    
+    try:
+        offset = int(data.get('offset'))
+    except (TypeError, ValueError):
+        emit('file_upload_error', {"transfer_id": transfer_id, "message": "Invalid offset"})
+        return
+    
+    result = file_manager.write_chunk(transfer_id, offset, data.get('data'), current_user())
+    
+    if result['success']:
+        emit('file_upload_ack', {
+            "transfer_id": transfer_id,
+            "offset": result['offset']
+        })
+    else:
+        emit('file_upload_error', {
+            "transfer_id": transfer_id,
+            "message": result['error'],
+            "offset": result.get('offset')
+        })
+
+@socketio.on('file_upload_complete')
+def handle_file_upload_complete(data):
+    """Verify a finished upload and notify the receiver"""
+    transfer_id = data.get('transfer_id')
+    
+    result = file_manager.finish_upload(transfer_id, data.get('file_hash'), current_user())
+    
+    if not result['success']:
+        emit('file_upload_error', {
+            "transfer_id": transfer_id,
+            "message": result['error'],
+            "offset": result.get('offset')
+        })
+        return
+    
+    sender = result['sender']
+    receiver = result['receiver']
+    file_message = Envelope({
+        "type": "file",
+        "sender": sender,
+        "receiver": receiver,
+        "file_name": result['file_name'],
+        "file_size": result['file_size'],
+        "file_hash": result['file_hash'],
+        "download_url": file_download_url(result['file_hash'], result['file_name']),
+        "timestamp": datetime.now().isoformat()
+    })
+    
+    send_file_notice(receiver, file_message)
+    logger.info(f"File upload complete: {result['file_name']} from {sender} to {receiver}")
+    
+    emit('file_sent', {
+        "success": True,
+        "transfer_id": transfer_id,
+        "file_name": result['file_name'],
+        "receiver": receiver
+    })
+
 @socketio.on('typing')
 def handle_typing(data):
-    """Handle typing indicator"""
-    sender = data.get('sender')
+    """Handle typing indicator; only changes reach the receiver (see TypingCoalescer)"""
+    sender = current_user()
     receiver = data.get('receiver')
-    is_typing = data.get('is_typing', True)
     
-    receiver_socket = user_to_socket.get(receiver)
-    if receiver_socket:
-        emit('user_typing', {
-            "username": sender,
-            "is_typing": is_typing
-        }, room=receiver_socket)
+    if sender and receiver:
+        typing_coalescer.update(sender, receiver, bool(data.get('is_typing', True)))
 
 @socketio.on('initiate_voice_call')
 def handle_initiate_voice_call(data):
     """Handle voice call initiation"""
-    caller = data.get('caller')
+    caller = current_user()
     receiver = data.get('receiver')
     
     if not all([caller, receiver]):
         emit('error', {"message": "Invalid call data"})
         return
+    if not voice_manager.running:
+        emit('error', {"message": "Voice calls are not available on this server"})
+        return
     
     result = voice_manager.initiate_call(caller, receiver)
     
     if result['success']:
         # Notify receiver about incoming call
-        receiver_socket = user_to_socket.get(receiver)
+        receiver_socket = user_manager.get_user_socket(receiver)
         if receiver_socket:
             emit('incoming_call', {
                 "call_id": result['call_id'],
@@ -266,54 +626,62 @@ def handle_initiate_voice_call(data):
         # Send call initiated response to caller
         emit('call_initiated', result)
         logger.info(f"Voice call initiated: {caller} -> {receiver}")
+    elif result.get('busy'):
+        emit('call_busy', {"receiver": receiver, "message": result['error']})
     else:
-        emit('error', {"message": "Failed to initiate call"})
+        emit('error', {"message": result.get('error', "Failed to initiate call")})
 
 @socketio.on('accept_call')
 def handle_accept_call(data):
     """Handle call acceptance"""
     call_id = data.get('call_id')
-    accepter = data.get('username')
+    accepter = current_user()
     
-    result = voice_manager.accept_call(call_id)
+    result = voice_manager.accept_call(call_id, accepter)
     
     if result['success']:
-        call_info = voice_manager.active_calls.get(call_id)
-        if call_info:
-            caller = call_info['caller']
+        call = voice_manager.get_call(call_id)
+        if call:
+            caller = call.caller
             
             # Notify caller that call was accepted
-            caller_socket = user_to_socket.get(caller)
+            caller_socket = user_manager.get_user_socket(caller)
             if caller_socket:
                 emit('call_accepted', {
                     "call_id": call_id,
                     "status": "active",
-                    "udp_port": voice_manager.udp_port
+                    "udp_port": voice_manager.udp_port,
+                    "voice_token": voice_manager.get_voice_token(call_id, caller),
+                    "voice_key": voice_manager.get_voice_key(call_id, caller)
                 }, room=caller_socket)
             
             # Send acceptance confirmation to accepter
             emit('call_started', {
                 "call_id": call_id,
                 "status": "active",
-                "udp_port": voice_manager.udp_port
+                "udp_port": voice_manager.udp_port,
+                "voice_token": voice_manager.get_voice_token(call_id, accepter),
+                "voice_key": voice_manager.get_voice_key(call_id, accepter)
             })
             
             logger.info(f"Voice call accepted: {call_id}")
+    else:
+        emit('error', {"message": result['error']})
 
 @socketio.on('reject_call')
 def handle_reject_call(data):
     """Handle call rejection"""
     call_id = data.get('call_id')
     
-    result = voice_manager.reject_call(call_id)
+    result = voice_manager.reject_call(call_id, current_user())
     
     if result['success']:
-        call_info = voice_manager.active_calls.get(call_id)
-        if call_info:
-            caller = call_info['caller']
+        call = voice_manager.get_call(call_id)
+        if call:
+            caller = call.caller
             
             # Notify caller that call was rejected
-            caller_socket = user_to_socket.get(caller)
+            caller_socket = user_manager.get_user_socket(caller)
             if caller_socket:
                 emit('call_rejected', {
                     "call_id": call_id,
@@ -321,24 +689,23 @@ def handle_reject_call(data):
                 }, room=caller_socket)
             
             logger.info(f"Voice call rejected: {call_id}")
+    else:
+        emit('error', {"message": result['error']})
 
 @socketio.on('end_call')
 def handle_end_call(data):
     """Handle call termination"""
     call_id = data.get('call_id')
-    username = data.get('username')
+    username = current_user()
     
-    result = voice_manager.end_call(call_id)
+    result = voice_manager.end_call(call_id, username)
     
     if result['success']:
-        call_info = voice_manager.active_calls.get(call_id)
-        if call_info:
+        call = voice_manager.get_call(call_id)
+        if call:
             # Notify both parties
-            caller = call_info['caller']
-            receiver = call_info['receiver']
-            
-            other_user = receiver if username == caller else caller
-            other_socket = user_to_socket.get(other_user)
+            other_user = call.other(username)
+            other_socket = user_manager.get_user_socket(other_user)
             
             if other_socket:
                 emit('call_ended', {
@@ -352,11 +719,89 @@ def handle_end_call(data):
             })
             
             logger.info(f"Voice call ended: {call_id}")
+    else:
+        emit('error', {"message": result['error']})
+
+@socketio.on('start_conference')
+def handle_start_conference(data):
+    """Start a mixed conference call and invite participants"""
+    host = current_user()
+    participants = data.get('participants')
+    
+    if not host or not isinstance(participants, list) or len(participants) >= MAX_CONFERENCE_PARTICIPANTS \
+            or not all(isinstance(user, str) for user in participants):
+        emit('error', {"message": "Invalid conference data"})
+        return
+    invitees = set(participants) - {host}
+    if not invitees:
+        emit('error', {"message": "Invalid conference data"})
+        return
+    if not voice_manager.running:
+        emit('error', {"message": "Voice calls are not available on this server"})
+        return
+    
+    result = voice_manager.create_conference(host, invitees, MAX_CONFERENCE_PARTICIPANTS)
+    if not result['success']:
+        emit('error', {"message": result['error']})
+        return
+    
+    invite = Envelope({
+        "conference_id": result['conference_id'],
+        "host": host
+    })
+    for user in invitees:
+        user_socket = user_manager.get_user_socket(user)
+        if user_socket:
+            emit('conference_invite', invite, room=user_socket)
+    
+    emit('conference_started', {**result, "udp_port": voice_manager.udp_port})
+    logger.info(f"Conference started by {host}: {result['conference_id']}")
+
+@socketio.on('join_conference')
+def handle_join_conference(data):
+    """Join a conference call"""
+    conference_id = data.get('conference_id')
+    username = current_user()
+    
+    result = voice_manager.join_conference(conference_id, username)
+    if not result['success']:
+        emit('error', {"message": result['error']})
+        return
+    
+    emit('conference_joined', {**result, "udp_port": voice_manager.udp_port})
+    _notify_conference(conference_id, result['participants'], username, 'conference_participant_joined')
+    logger.info(f"{username} joined conference {conference_id}")
+
+@socketio.on('leave_conference')
+def handle_leave_conference(data):
+    """Leave a conference call"""
+    conference_id = data.get('conference_id')
+    username = current_user()
+    
+    result = voice_manager.leave_conference(conference_id, username)
+    if result['success']:
+        emit('conference_left', {"conference_id": conference_id})
+        _notify_conference(conference_id, result['participants'], username, 'conference_participant_left')
+        logger.info(f"{username} left conference {conference_id}")
+
+def _notify_conference(conference_id, participants, username, event):
+    """Tell the other participants that username joined or left"""
+    notice = Envelope({
+        "conference_id": conference_id,
+        "username": username,
+        "participants": participants
+    })
+    for user in participants:
+        if user == username:
+            continue
+        user_socket = user_manager.get_user_socket(user)
+        if user_socket:
+            emit(event, notice, room=user_socket)
 
 @socketio.on('register_udp')
 def handle_register_udp(data):
     """Register UDP address for voice chat"""
-    username = data.get('username')
+    username = current_user()
     
     if username:
         # Client will send UDP registration packet separately
@@ -364,26 +809,189 @@ def handle_register_udp(data):
             "udp_port": voice_manager.udp_port
         })
 
+def _room_id(data):
+    """Integer room id from an event payload, or None"""
+    try:
+        return int(data.get('room_id'))
+    except (TypeError, ValueError):
+        return None
+
+def update_channel_locally(username, channel, joined):
+    """Subscribe or unsubscribe every socket username has open on this worker"""
+    for sid, _ in list(socketio.server.manager.get_participants('/', user_channel(username))):
+        if joined:
+            socketio.server.enter_room(sid, channel, namespace='/')
+        else:
+            socketio.server.leave_room(sid, channel, namespace='/')
+
+presence.channel_handler = update_channel_locally
+
+@socketio.on('create_room')
+def handle_create_room(data):
+    """Create a group chat room and subscribe its online members"""
+    owner = current_user()
+    members = data.get('members', [])
+    
+    if not owner or not isinstance(members, list) or len(members) > MAX_ROOM_MEMBERS \
+            or not all(isinstance(user, str) for user in members):
+        emit('error', {"message": "Invalid room data"})
+        return
+    
+    result = user_manager.rooms.create_room(data.get('name'), owner, members)
+    if not result['success']:
+        emit('error', {"message": result['error']})
+        return
+    
+    # The same bytes go to every member and back to the owner
+    room = Envelope(result['room'])
+    for user in room['members']:
+        if user_manager.is_user_online(user):
+            # Every tab the member has open, on any worker
+            presence.join_channel(user, room_channel(room['id']))
+            if user != owner:
+                emit('room_added', room, to=user_channel(user))
+    
+    emit('room_created', room)
+    logger.info(f"Room {room['id']} created by {owner} with {len(room['members'])} members")
+
+@socketio.on('add_room_member')
+def handle_add_room_member(data):
+    """Add a user to a room the caller belongs to"""
+    username = current_user()
+    room_id = _room_id(data)
+    new_member = data.get('username')
+    
+    if not username or room_id is None or not new_member or not isinstance(new_member, str):
+        emit('error', {"message": "Invalid room data"})
+        return
+    
+    result = user_manager.rooms.add_member(room_id, new_member, username)
+    if not result['success']:
+        emit('error', {"message": result['error']})
+        return
+    
+    if user_manager.is_user_online(new_member):
+        presence.join_channel(new_member, room_channel(room_id))
+        emit('room_added', user_manager.rooms.get_room(room_id), to=user_channel(new_member))
+    emit('room_member_added', result, to=room_channel(room_id))
+    logger.info(f"{username} added {new_member} to room {room_id}")
+
+@socketio.on('leave_room')
+def handle_leave_room(data):
+    """Leave a group chat room"""
+    username = current_user()
+    room_id = _room_id(data)
+    
+    if not username or room_id is None:
+        emit('error', {"message": "Invalid room data"})
+        return
+    
+    result = user_manager.rooms.remove_member(room_id, username)
+    if not result['success']:
+        emit('error', {"message": result['error']})
+        return
+    
+    # Every tab the user has open, on any worker, stops receiving the room
+    presence.leave_channel(username, room_channel(room_id))
+    emit('room_left', {"room_id": room_id})
+    emit('room_member_left', result, to=room_channel(room_id))
+    logger.info(f"{username} left room {room_id}")
+
+@socketio.on('get_rooms')
+def handle_get_rooms():
+    """Rooms the caller belongs to"""
+    username = current_user()
+    
+    if username:
+        emit('rooms', {"rooms": user_manager.rooms.get_user_rooms(username)})
+
+@socketio.on('room_message')
+def handle_room_message(data):
+    """Send a message to every member of a room with one write and one emit"""
+    sender = current_user()
+    room_id = _room_id(data)
+    message = data.get('message')
+    timestamp = data.get('timestamp', datetime.now().isoformat())
+    
+    if not sender or room_id is None or not message:
+        emit('error', {"message": "Invalid message data"})
+        return
+    
+    if not user_manager.rooms.is_member(room_id, sender):
+        emit('error', {"message": "Not a member of this room"})
+        return
+    
+    # One chat_history row for the whole room; offline members catch up from room history
+    if not user_manager.save_room_message(sender, room_id, message):
+        logger.warning(f"Message queue full, rejecting room message from {sender}")
+        emit('error', {"message": "Server busy, message not sent"})
+        return
+    
+    # The packet is encoded once and written to every member socket in the room
+    emit('room_message', Envelope({
+        "sender": sender,
+        "room_id": room_id,
+        "message": message,
+        "timestamp": timestamp,
+        "type": "text"
+    }), to=room_channel(room_id), include_self=False)
+    
+    emit('message_sent', {
+        "success": True,
+        "timestamp": timestamp,
+        "room_id": room_id
+    })
+
+@socketio.on('get_room_history')
+def handle_get_room_history(data):
+    """Get one page of a room's messages"""
+    username = current_user()
+    room_id = _room_id(data)
+    
+    if not username or room_id is None or not user_manager.rooms.is_member(room_id, username):
+        emit('error', {"message": "Not a member of this room"})
+        return
+    
+    try:
+        page = user_manager.get_room_history_page(room_id, data.get('limit', 50), data.get('before_id'))
+    except (TypeError, ValueError):
+        emit('error', {"message": "Invalid history cursor"})
+        return
+    emit('room_history', {"room_id": room_id, **page})
+
 @socketio.on('get_chat_history')
+@metrics.timed('handler_seconds', 'Socket.IO event and HTTP handler time', handler='get_chat_history')
 def handle_get_chat_history(data):
-    """Get chat history between two users"""
-    user1 = data.get('user1')
+    """Get one page of chat history between two users"""
+    user1 = current_user()
     user2 = data.get('user2')
+    before_id = data.get('before_id')
+    limit = data.get('limit', 50)
     
     if user1 and user2:
-        history = user_manager.get_chat_history(user1, user2)
+        try:
+            page = user_manager.get_chat_history_page(user1, user2, limit, before_id)
+        except (TypeError, ValueError):
+            emit('error', {"message": "Invalid history cursor"})
+            return
         emit('chat_history', {
-            "messages": history
+            "user": user2,
+            "messages": page["messages"],
+            "has_more": page["has_more"],
+            "next_before_id": page["next_before_id"]
         })
 
 if __name__ == '__main__':
     logger.info("Starting ChatterBox Server...")
     logger.info(f"Socket.IO server on port 5000")
-    logger.info(f"Voice chat UDP server on port 5001")
+    logger.info(f"Voice chat UDP server on port {voice_manager.udp_port}")
+    logger.info("Development server; use serve.py for production")
     
+    start_services()
     try:
         socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
     except KeyboardInterrupt:
         logger.info("Shutting down server...")
-        voice_manager.stop_udp_server()
+    finally:
+        stop_services()
         logger.info("Server stopped")
@@ -0,0 +1,105 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+class SessionManager:
+    """Signed session tokens backed by the sessions table, with a verified-session cache
+
+    A token is an HMAC-signed (session id, username) pair. Validation checks
+    the signature first, then the cache; only a cache miss costs a database
+    lookup, so socket reconnects never touch bcrypt and rarely touch SQLite.
+    Cached sessions are re-checked after cache_ttl seconds, which bounds how
+    long a session revoked on another worker stays usable here.
+    """
+
+    def __init__(self, db, secret_key, ttl=7 * 24 * 3600, cache_size=10000, cache_ttl=300):
+        self.db = db
+        self.serializer = URLSafeTimedSerializer(secret_key, salt="chatterbox-session")
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache = OrderedDict()  # {session_id: (username, expires_at, cached_at)}
+        self.lock = threading.Lock()
+        self.stats = {"issued": 0, "cache_hits": 0, "cache_misses": 0, "rejected": 0}
+
+    def issue(self, username):
+        """Create a session for username and return its signed token"""
+        session_id = secrets.token_urlsafe(16)
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO sessions (id, username, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (session_id, username, now, now + self.ttl)
+        )
+        self._remember(session_id, username, now + self.ttl)
+        with self.lock:
+            self.stats["issued"] += 1
+        return self.serializer.dumps({"sid": session_id, "user": username})
+
+    def validate(self, token):
+        """Username for a valid, unrevoked token, or None"""
+        session_id, username = self._unsign(token)
+        if session_id is None:
+            return self._reject()
+
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(session_id)
+            if cached and now - cached[2] < self.cache_ttl and cached[1] > now:
+                self.cache.move_to_end(session_id)
+                self.stats["cache_hits"] += 1
+                return cached[0]
+            self.stats["cache_misses"] += 1
+
+        row = self.db.fetchone(
+            "SELECT username, expires_at FROM sessions WHERE id = ?", (session_id,)
+        )
+        if row is None or row[0] != username or row[1] <= now:
+            with self.lock:
+                self.cache.pop(session_id, None)
+            return self._reject()
+
+        self._remember(session_id, row[0], row[1])
+        return row[0]
+
+    def revoke(self, token):
+        """End the session behind token; returns whether it existed"""
+        session_id, _ = self._unsign(token)
+        if session_id is None:
+            return False
+        with self.lock:
+            self.cache.pop(session_id, None)
+        with self.db.transaction() as conn:
+            return conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def purge_expired(self):
+        """Delete expired sessions; returns how many were removed"""
+        with self.db.transaction() as conn:
+            return conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _unsign(self, token):
+        if not token or not isinstance(token, str):
+            return None, None
+        try:
+            payload = self.serializer.loads(token, max_age=self.ttl)
+            return payload["sid"], payload["user"]
+        except (BadSignature, KeyError, TypeError):
+            return None, None
+
+    def _remember(self, session_id, username, expires_at):
+        with self.lock:
+            self.cache[session_id] = (username, expires_at, time.time())
+            self.cache.move_to_end(session_id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _reject(self):
+        with self.lock:
+            self.stats["rejected"] += 1
+        return None
+
+    def get_stats(self):
+        """Issue/validation counters and current cache size"""
+        with self.lock:
+            return {**self.stats, "cached": len(self.cache)}
@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import queue
+import os
+import time
+from contextlib import contextmanager
+
+class Database:
+    """Thread-safe pool of tuned SQLite connections shared by the managers"""
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA foreign_keys=ON",
+    )
+
+    def __init__(self, db_path, pool_size=8, statement_cache_size=128, observe=None):
+        self.db_path = db_path
+        # observe(operation, seconds) after every query and transaction, e.g. for /metrics
+        self.observe = observe
+        self.pool_size = pool_size
+        self.statement_cache_size = statement_cache_size
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        """Open a new connection with the pool's pragmas applied"""
+        # sqlite3 keeps a per-connection LRU of compiled statements keyed by
+        # SQL text, so reusing pooled connections also reuses prepared statements
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+            isolation_level=None
+        )
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        """Take an idle connection, opening a new one while under pool_size"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._pool.get()
+
+    def _release(self, conn):
+        """Return a connection to the pool, closing it if the pool is shut down"""
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._pool.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection in autocommit mode"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Borrow a pooled connection wrapped in a single transaction"""
+        start = time.perf_counter() if self.observe else None
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        if start is not None:
+            # Includes waiting for the write lock, which is what callers feel
+            self.observe("transaction", time.perf_counter() - start)
+
+    def _observed(self, operation, start):
+        if start is not None:
+            self.observe(operation, time.perf_counter() - start)
+
+    def execute(self, sql, params=()):
+        """Run a single write statement and return the cursor's lastrowid"""
+        start = time.perf_counter() if self.observe else None
+        with self.connection() as conn:
+            lastrowid = conn.execute(sql, params).lastrowid
+        self._observed("execute", start)
+        return lastrowid
+
+    def executemany(self, sql, seq_of_params):
+        """Run a statement for every parameter set inside one transaction"""
+        with self.transaction() as conn:
+            conn.executemany(sql, seq_of_params)
+
+    def fetchone(self, sql, params=()):
+        """Run a query and return its first row"""
+        start = time.perf_counter() if self.observe else None
+        with self.connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+        self._observed("fetchone", start)
+        return row
+
+    def fetchall(self, sql, params=()):
+        """Run a query and return all rows"""
+        start = time.perf_counter() if self.observe else None
+        with self.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        self._observed("fetchall", start)
+        return rows
+
+    def close(self):
+        """Close every idle connection and stop pooling new ones"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
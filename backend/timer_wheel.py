@@ -0,0 +1,59 @@
+import math
+import time
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule and cancel, expiry checked once per tick
+
+    Deadlines are rounded up to whole ticks and hashed into `slots` buckets
+    by tick number; advance() visits only the buckets for the ticks that
+    have passed, so many thousands of timers cost nothing until they are
+    due. Each key holds at most one timer; scheduling it again moves it.
+    Not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self, tick=0.1, slots=512, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.slots = [{} for _ in range(slots)]  # {key: deadline tick}
+        self.timers = {}  # {key: deadline tick}
+        self.current = int(clock() / tick)  # last tick processed
+
+    def schedule(self, key, delay):
+        """(Re)arm key to expire delay seconds from now"""
+        deadline = max(self.current + 1, math.ceil((self.clock() + delay) / self.tick))
+        previous = self.timers.get(key)
+        if previous is not None:
+            if previous == deadline:
+                return
+            del self.slots[previous % len(self.slots)][key]
+        self.slots[deadline % len(self.slots)][key] = deadline
+        self.timers[key] = deadline
+
+    def cancel(self, key):
+        """Disarm key; False if it had no timer"""
+        deadline = self.timers.pop(key, None)
+        if deadline is None:
+            return False
+        del self.slots[deadline % len(self.slots)][key]
+        return True
+
+    def advance(self):
+        """Keys whose deadline has passed, removed from the wheel"""
+        target = int(self.clock() / self.tick)
+        # After a long stall one lap visits every bucket; deadlines decide what is due
+        steps = min(target - self.current, len(self.slots))
+        expired = []
+        for step in range(1, steps + 1):
+            bucket = self.slots[(self.current + step) % len(self.slots)]
+            if not bucket:
+                continue
+            due = [key for key, deadline in bucket.items() if deadline <= target]
+            for key in due:
+                del bucket[key]
+                del self.timers[key]
+            expired.extend(due)
+        self.current = max(self.current, target)
+        return expired
+
+    def __len__(self):
+        return len(self.timers)
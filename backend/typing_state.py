@@ -0,0 +1,122 @@
+import threading
+import time
+
+from timer_wheel import TimerWheel
+
+class TypingCoalescer:
+    """Turns keystroke-rate typing events into typing state transitions
+
+    Clients send typing on every keystroke; nearly all of those repeat what
+    the receiver already knows. update() only records the latest state per
+    (sender, receiver) pair, and flush(), every `window` seconds, sends a
+    pair's state only when it differs from what the receiver was last told,
+    so a burst of keystrokes costs one "started" and one "stopped". "Is
+    typing" expires `timeout` seconds after the last keystroke through one
+    timer wheel shared by every pair, so a client that never sends false
+    (closed tab, lost connection) does not leave the indicator on. With a
+    window of 0 every event is passed straight through, as before.
+    """
+
+    def __init__(self, send, window=0.25, timeout=5.0, clock=time.monotonic):
+        # send(sender, receiver, is_typing) -> False to retry on the next flush
+        self.send = send
+        self.window = window
+        self.timeout = timeout
+        self.wheel = TimerWheel(tick=window or 1.0, clock=clock)
+        self.typing = {}  # {sender: set of receivers}, per the latest events
+        self.shown = set()  # (sender, receiver) pairs the receiver was last told are typing
+        self.dirty = set()  # pairs changed since the last flush
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {"events": 0, "sent": 0, "expired": 0, "retried": 0}
+
+    def update(self, sender, receiver, is_typing):
+        """Record a typing event; nothing is sent until the next flush"""
+        pair = (sender, receiver)
+        if not self.window:
+            with self.lock:
+                self.stats["events"] += 1
+                self.stats["sent"] += 1
+            self.send(sender, receiver, is_typing)
+            return
+        with self.lock:
+            self.stats["events"] += 1
+            if is_typing:
+                self.typing.setdefault(sender, set()).add(receiver)
+                self.wheel.schedule(pair, self.timeout)
+            else:
+                self._stop(pair)
+                self.wheel.cancel(pair)
+            self.dirty.add(pair)
+
+    def forget(self, sender):
+        """Stop everything a disconnected sender was typing"""
+        with self.lock:
+            for receiver in self.typing.pop(sender, ()):
+                pair = (sender, receiver)
+                self.wheel.cancel(pair)
+                self.dirty.add(pair)
+
+    def _stop(self, pair):
+        receivers = self.typing.get(pair[0])
+        if receivers is not None:
+            receivers.discard(pair[1])
+            if not receivers:
+                del self.typing[pair[0]]
+
+    def flush(self):
+        """Expire stale pairs and send every pair whose state changed; returns the transitions"""
+        with self.lock:
+            for pair in self.wheel.advance():
+                self._stop(pair)
+                self.dirty.add(pair)
+                self.stats["expired"] += 1
+            if not self.dirty:
+                return []
+            transitions = []
+            for pair in self.dirty:
+                is_typing = pair[1] in self.typing.get(pair[0], ())
+                if is_typing != (pair in self.shown):
+                    transitions.append((pair, is_typing))
+            self.dirty = set()
+
+        failed = []
+        for pair, is_typing in transitions:
+            try:
+                delivered = self.send(pair[0], pair[1], is_typing) is not False
+            except Exception as e:
+                print(f"Error sending typing state: {e}")
+                delivered = True
+            if not delivered:
+                failed.append(pair)
+                continue
+            with self.lock:
+                if is_typing:
+                    self.shown.add(pair)
+                else:
+                    self.shown.discard(pair)
+                self.stats["sent"] += 1
+
+        if failed:
+            # The receiver still has the old state; compare again next window
+            with self.lock:
+                self.dirty.update(failed)
+                self.stats["retried"] += len(failed)
+        return transitions
+
+    def run(self, sleep):
+        """Flush loop; start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = bool(self.window)
+        while self.running:
+            sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing typing state: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "typing_pairs": len(self.wheel), "shown_pairs": len(self.shown)}
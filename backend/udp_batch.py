@@ -0,0 +1,182 @@
+import ctypes
+import ctypes.util
+import errno
+import select
+import socket
+import struct
+import sys
+
+MSG_WAITFORONE = 0x10000
+SOCKADDR_SIZE = 16  # struct sockaddr_in
+SOCKADDR_IN = struct.Struct("=H2s4s8x")  # family (host order), port and address (network order)
+UINT = struct.Struct("I")
+IOVEC = struct.Struct("PN")
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+_libc = _load_libc()
+# Hot-path fields are read and written through memoryviews rather than ctypes attributes
+MMSGHDR_SIZE = ctypes.sizeof(_MMsgHdr)
+MSG_LEN_OFFSET = _MMsgHdr.msg_len.offset
+MSG_NAMELEN_OFFSET = _MMsgHdr.msg_hdr.offset + _MsgHdr.msg_namelen.offset
+
+def available():
+    """Whether recvmmsg/sendmmsg can be used on this platform"""
+    return _libc is not None
+
+class MessageBatch:
+    """Preallocated recvmmsg/sendmmsg vectors over one contiguous buffer
+
+    recv() fills up to `size` slots of `packet_size` bytes with a single
+    syscall. Packets are read through `view` at offset(i) and can be queued
+    for sending straight out of their receive slot with queue(); flush()
+    sends everything queued with a single sendmmsg.
+    """
+
+    def __init__(self, size=32, packet_size=4096):
+        if _libc is None:
+            raise OSError("recvmmsg/sendmmsg are not available on this platform")
+        self.size = size
+        self.packet_size = packet_size
+        self.buffer = (ctypes.c_char * (size * packet_size))()
+        self.view = memoryview(self.buffer).cast("B")
+        base = ctypes.addressof(self.buffer)
+
+        self.names = (ctypes.c_char * (size * SOCKADDR_SIZE))()
+        self.names_view = memoryview(self.names).cast("B")
+        self.recv_iov = (_IOVec * size)()
+        self.recv_msgs = (_MMsgHdr * size)()
+        names_base = ctypes.addressof(self.names)
+        for i in range(size):
+            self.recv_iov[i].iov_base = base + i * packet_size
+            self.recv_iov[i].iov_len = packet_size
+            hdr = self.recv_msgs[i].msg_hdr
+            hdr.msg_name = names_base + i * SOCKADDR_SIZE
+            hdr.msg_iov = ctypes.pointer(self.recv_iov[i])
+            hdr.msg_iovlen = 1
+        self.recv_msgs_view = memoryview(self.recv_msgs).cast("B")
+
+        self.send_names = (ctypes.c_char * (size * SOCKADDR_SIZE))()
+        self.send_names_view = memoryview(self.send_names).cast("B")
+        self.send_iov = (_IOVec * size)()
+        self.send_msgs = (_MMsgHdr * size)()
+        send_names_base = ctypes.addressof(self.send_names)
+        for i in range(size):
+            hdr = self.send_msgs[i].msg_hdr
+            hdr.msg_name = send_names_base + i * SOCKADDR_SIZE
+            hdr.msg_namelen = SOCKADDR_SIZE
+            hdr.msg_iov = ctypes.pointer(self.send_iov[i])
+            hdr.msg_iovlen = 1
+        self.send_iov_view = memoryview(self.send_iov).cast("B")
+
+        self.base = base
+        self.filled = size
+        self.queued = 0
+        self.sockaddrs = {}  # {(ip, port): packed sockaddr_in}
+        self.addresses = {}  # {packed port + ip: (ip, port)}
+        self.stats = {"recv_calls": 0, "send_calls": 0, "send_errors": 0}
+
+    def recv(self, fd):
+        """Block for at least one datagram and return how many slots were filled"""
+        # The kernel shrinks msg_namelen in the slots it filled last time
+        for i in range(self.filled):
+            UINT.pack_into(self.recv_msgs_view, i * MMSGHDR_SIZE + MSG_NAMELEN_OFFSET, SOCKADDR_SIZE)
+        while True:
+            count = _libc.recvmmsg(fd, self.recv_msgs, self.size, MSG_WAITFORONE, None)
+            self.stats["recv_calls"] += 1
+            if count >= 0:
+                self.filled = count
+                return count
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err == errno.EAGAIN:
+                # Non-blocking (green) socket: wait cooperatively, and let the caller recheck shutdown
+                select.select([fd], [], [], 1.0)
+                self.filled = 0
+                return 0
+            raise OSError(err, f"recvmmsg: {errno.errorcode.get(err, err)}")
+
+    def length(self, i):
+        """Size of the datagram in slot i"""
+        return UINT.unpack_from(self.recv_msgs_view, i * MMSGHDR_SIZE + MSG_LEN_OFFSET)[0]
+
+    def lengths(self, count):
+        """Sizes of the datagrams in the first count slots"""
+        view = self.recv_msgs_view
+        return [UINT.unpack_from(view, i * MMSGHDR_SIZE + MSG_LEN_OFFSET)[0] for i in range(count)]
+
+    def offset(self, i):
+        """Start of slot i in view"""
+        return i * self.packet_size
+
+    def address(self, i):
+        """(ip, port) the datagram in slot i came from"""
+        start = i * SOCKADDR_SIZE + 2
+        raw = self.names_view[start:start + 6].tobytes()
+        address = self.addresses.get(raw)
+        if address is None:
+            if len(self.addresses) > 4096:
+                self.addresses.clear()
+            address = (socket.inet_ntoa(raw[2:]), int.from_bytes(raw[:2], "big"))
+            self.addresses[raw] = address
+        return address
+
+    def queue(self, start, length, address):
+        """Queue view[start:start + length] to be sent to address on the next flush"""
+        sockaddr = self.sockaddrs.get(address)
+        if sockaddr is None:
+            if len(self.sockaddrs) > 4096:
+                self.sockaddrs.clear()
+            sockaddr = SOCKADDR_IN.pack(socket.AF_INET, address[1].to_bytes(2, "big"), socket.inet_aton(address[0]))
+            self.sockaddrs[address] = sockaddr
+        slot = self.queued
+        self.send_names_view[slot * SOCKADDR_SIZE:(slot + 1) * SOCKADDR_SIZE] = sockaddr
+        IOVEC.pack_into(self.send_iov_view, slot * IOVEC.size, self.base + start, length)
+        self.queued += 1
+
+    def flush(self, fd):
+        """Send everything queued; returns how many datagrams went out"""
+        sent = 0
+        delivered = 0
+        while sent < self.queued:
+            count = _libc.sendmmsg(fd, ctypes.byref(self.send_msgs[sent]), self.queued - sent, 0)
+            self.stats["send_calls"] += 1
+            if count < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                # The first pending datagram failed (e.g. full buffer or bad route); skip it
+                self.stats["send_errors"] += 1
+                count = 1
+            else:
+                delivered += count
+            sent += count
+        self.queued = 0
+        return delivered
@@ -1,22 +1,55 @@
 import sqlite3
-import bcrypt
-import json
-from datetime import datetime
-import os
+from datetime import datetime, timezone
+import secrets
+from storage import Database
+from message_writer import MessageWriter
+from presence import LocalPresence
+from hashing import PasswordHasher, HasherBusy
+from sessions import SessionManager
+from history_cache import HistoryCache
+from rooms import RoomManager, room_key
+
+def conversation_key(user1, user2):
+    """Order-independent key shared by both directions of a 1:1 conversation"""
+    # \x1f (unit separator) cannot appear in a username typed into the UI
+    return f"{user1}\x1f{user2}" if user1 < user2 else f"{user2}\x1f{user1}"
 
 class UserManager:
-    def __init__(self, db_path="database/users.db"):
+    # Bumped whenever a migration is appended to _migrate
+    SCHEMA_VERSION = 2
+    MAX_HISTORY_PAGE = 200
+    OFFLINE_BATCH_SIZE = 500
+    
+    def __init__(self, db_path="database/users.db", pool_size=8, presence=None, hasher=None,
+                 secret_key=None, history_cache_bytes=32 * 1024 * 1024, cache_room_members=True,
+                 db_observer=None):
         self.db_path = db_path
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = Database(db_path, pool_size=pool_size, observe=db_observer)
         self.init_database()
-        self.online_users = {}  # {username: socket_info}
+        # Shared with other workers when the server runs behind a message queue
+        self.presence = presence or LocalPresence()
+        # bcrypt runs off the request path so logins cannot stall message delivery
+        self.hasher = hasher or PasswordHasher()
+        # Without a configured key, tokens only survive until the process restarts
+        self.sessions = SessionManager(self.db, secret_key or secrets.token_hex(32))
+        self.sessions.purge_expired()
+        # Recent messages of active conversations; 0 disables it (e.g. several workers share the db)
+        self.history_cache = HistoryCache(history_cache_bytes) if history_cache_bytes else None
+        self.writer = MessageWriter(
+            self.db, on_commit=self._cache_committed if self.history_cache else None
+        )
+        self.writer.start()
+        self.rooms = RoomManager(self.db, cache_members=cache_room_members)
         
     def init_database(self):
         """Initialize the SQLite database with users table"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        with self.db.transaction() as conn:
+            self._create_tables(conn)
+            self._migrate(conn)
+    
+    def _create_tables(self, conn):
+        """Create the base tables if they do not exist yet"""
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
@@ -26,7 +59,7 @@ class UserManager:
             )
         ''')
         
-        cursor.execute('''
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS chat_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 sender TEXT NOT NULL,
@@ -36,26 +69,84 @@ class UserManager:
             )
         ''')
         
-        conn.commit()
-        conn.close()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+        
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rooms (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # One row per member; a room's messages are stored once under its room_key
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS room_members (
+                room_id INTEGER NOT NULL,
+                username TEXT NOT NULL,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (room_id, username)
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_room_members_username ON room_members (username)")
+    
+    def _migrate(self, conn):
+        """Apply schema migrations newer than the database's user_version"""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        
+        if version < 1:
+            # Canonical conversation key so history is one index range, not an OR scan
+            conn.execute("ALTER TABLE chat_history ADD COLUMN conversation TEXT")
+            conn.execute('''
+                UPDATE chat_history SET conversation = CASE
+                    WHEN sender < receiver THEN sender || char(31) || receiver
+                    ELSE receiver || char(31) || sender
+                END
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_chat_history_conversation
+                ON chat_history (conversation, id)
+            ''')
+        
+        if version < 2:
+            # Delivery state for the offline queue; rows written before it count as delivered
+            conn.execute("ALTER TABLE chat_history ADD COLUMN delivered INTEGER NOT NULL DEFAULT 1")
+            # Partial index: only the (small) undelivered backlog is indexed
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_chat_history_undelivered
+                ON chat_history (receiver, id) WHERE delivered = 0
+            ''')
+        
+        if version < self.SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
         
     def register_user(self, username, password):
         """Register a new user with hashed password"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            # Skip the bcrypt work for names that are obviously taken
+            if self.db.fetchone("SELECT 1 FROM users WHERE username = ?", (username,)):
+                return {"success": False, "message": "Username already exists"}
             
             # Hash the password
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            password_hash = self.hasher.hash(password)
             
-            cursor.execute(
+            self.db.execute(
                 "INSERT INTO users (username, password_hash) VALUES (?, ?)",
                 (username, password_hash)
             )
             
-            conn.commit()
-            conn.close()
             return {"success": True, "message": "User registered successfully"}
+        except HasherBusy as e:
+            return {"success": False, "busy": True, "message": str(e)}
         except sqlite3.IntegrityError:
             return {"success": False, "message": "Username already exists"}
         except Exception as e:
@@ -64,106 +155,242 @@ class UserManager:
     def login_user(self, username, password):
         """Authenticate user credentials"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(
+            result = self.db.fetchone(
                 "SELECT password_hash FROM users WHERE username = ?",
                 (username,)
             )
             
-            result = cursor.fetchone()
-            
             if result is None:
                 return {"success": False, "message": "Username not found"}
             
             password_hash = result[0]
             
             # Verify password
-            if bcrypt.checkpw(password.encode('utf-8'), password_hash):
+            if self.hasher.check(password, password_hash):
                 # Update last login
-                cursor.execute(
+                self.db.execute(
                     "UPDATE users SET last_login = ? WHERE username = ?",
-                    (datetime.now(), username)
+                    (datetime.now().isoformat(" "), username)
                 )
-                conn.commit()
-                conn.close()
-                return {"success": True, "message": "Login successful", "username": username}
+                self._upgrade_hash(username, password, password_hash)
+                return {
+                    "success": True,
+                    "message": "Login successful",
+                    "username": username,
+                    "token": self.sessions.issue(username)
+                }
             else:
-                conn.close()
                 return {"success": False, "message": "Incorrect password"}
                 
+        except HasherBusy as e:
+            return {"success": False, "busy": True, "message": str(e)}
         except Exception as e:
             return {"success": False, "message": f"Login failed: {str(e)}"}
     
+    def authenticate_token(self, token):
+        """Username behind a session token, or None if it is invalid or revoked"""
+        return self.sessions.validate(token)
+    
+    def logout_user(self, token):
+        """Revoke a session token"""
+        if self.sessions.revoke(token):
+            return {"success": True, "message": "Logged out"}
+        return {"success": False, "message": "Unknown session"}
+    
+    def _upgrade_hash(self, username, password, password_hash):
+        """Re-hash a password stored with an old work factor while we have it in hand"""
+        if not self.hasher.needs_rehash(password_hash):
+            return
+        try:
+            self.db.execute(
+                "UPDATE users SET password_hash = ? WHERE username = ?",
+                (self.hasher.hash(password), username)
+            )
+        except HasherBusy:
+            pass  # Try again on a quieter login
+    
     def set_user_online(self, username, socket_id):
         """Mark user as online"""
-        self.online_users[username] = {
-            "socket_id": socket_id,
-            "connected_at": datetime.now().isoformat()
-        }
+        self.presence.add(username, socket_id)
         
     def set_user_offline(self, username):
         """Mark user as offline"""
-        if username in self.online_users:
-            del self.online_users[username]
+        self.presence.remove_user(username)
+    
+    def set_socket_offline(self, socket_id):
+        """Mark the user behind a disconnected socket offline; returns that user"""
+        return self.presence.remove_socket(socket_id)
     
     def get_online_users(self):
         """Get list of currently online users"""
-        return list(self.online_users.keys())
+        return self.presence.get_online_users()
     
     def is_user_online(self, username):
         """Check if a user is currently online"""
-        return username in self.online_users
+        return self.presence.is_online(username)
     
     def get_user_socket(self, username):
         """Get socket ID for a user"""
-        return self.online_users.get(username, {}).get("socket_id")
+        return self.presence.get_socket(username)
     
-    def save_message(self, sender, receiver, message):
-        """Save chat message to database"""
+    def get_socket_user(self, socket_id):
+        """Get the username bound to a socket on this worker"""
+        return self.presence.get_user(socket_id)
+    
+    def save_message(self, sender, receiver, message, delivered=True):
+        """Queue chat message for a batched write; False if the queue stays full"""
+        # Match CURRENT_TIMESTAMP, which the row would have received on a direct insert
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        return self.writer.submit(
+            (sender, receiver, message, timestamp, conversation_key(sender, receiver), int(delivered))
+        )
+    
+    def save_room_message(self, sender, room_id, message):
+        """Queue one chat_history row for a room message, however many members it has"""
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        key = room_key(room_id)
+        # Members read it through room history, so it never enters the offline queue
+        return self.writer.submit((sender, key, message, timestamp, key, 1))
+    
+    def _cache_committed(self, batch, first_id):
+        """Writer hook: append a committed batch to the cached conversations"""
+        self.history_cache.append_committed(
+            (conversation, {
+                "id": first_id + i,
+                "sender": sender,
+                "receiver": receiver,
+                "message": message,
+                "timestamp": timestamp
+            })
+            for i, (sender, receiver, message, timestamp, conversation, delivered) in enumerate(batch)
+        )
+    
+    def flush_messages(self, timeout=5.0):
+        """Wait until every queued message has been committed"""
+        return self.writer.flush(timeout)
+    
+    def get_chat_history(self, user1, user2, limit=50, before_id=None):
+        """Retrieve chat history between two users"""
+        return self.get_chat_history_page(user1, user2, limit, before_id)["messages"]
+    
+    def get_chat_history_page(self, user1, user2, limit=50, before_id=None):
+        """Retrieve one page of history older than before_id, oldest first"""
+        return self._history_page(conversation_key(user1, user2), limit, before_id)
+    
+    def get_room_history_page(self, room_id, limit=50, before_id=None):
+        """Retrieve one page of a room's messages older than before_id, oldest first"""
+        page = self._history_page(room_key(room_id), limit, before_id)
+        page["messages"] = [
+            {
+                "id": msg["id"],
+                "sender": msg["sender"],
+                "room_id": room_id,
+                "message": msg["message"],
+                "timestamp": msg["timestamp"]
+            }
+            for msg in page["messages"]
+        ]
+        return page
+    
+    def _history_page(self, key, limit, before_id):
+        limit = max(1, min(int(limit), self.MAX_HISTORY_PAGE))
+        if before_id is not None:
+            before_id = int(before_id)
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            # Read-your-writes: make sure recently sent messages are on disk
+            self.writer.flush()
             
-            cursor.execute(
-                "INSERT INTO chat_history (sender, receiver, message) VALUES (?, ?, ?)",
-                (sender, receiver, message)
-            )
+            if before_id is None and self.history_cache:
+                cached = self.history_cache.get(key, limit)
+                if cached:
+                    messages, has_more = cached
+                    return {
+                        "messages": messages,
+                        "has_more": has_more,
+                        "next_before_id": messages[0]["id"] if has_more else None
+                    }
+                generation = self.history_cache.get_generation()
             
-            conn.commit()
-            conn.close()
-            return True
+            # Keyset pagination over (conversation, id): cost is O(page), not O(table)
+            if before_id is None:
+                rows = self.db.fetchall('''
+                    SELECT id, sender, receiver, message, timestamp
+                    FROM chat_history
+                    WHERE conversation = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (key, limit + 1))
+            else:
+                rows = self.db.fetchall('''
+                    SELECT id, sender, receiver, message, timestamp
+                    FROM chat_history
+                    WHERE conversation = ? AND id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (key, before_id, limit + 1))
+            
+            has_more = len(rows) > limit
+            messages = [
+                {
+                    "id": msg[0],
+                    "sender": msg[1],
+                    "receiver": msg[2],
+                    "message": msg[3],
+                    "timestamp": msg[4]
+                }
+                for msg in reversed(rows[:limit])
+            ]
+            if before_id is None and self.history_cache:
+                self.history_cache.put_page(key, messages, has_more, generation)
+            return {
+                "messages": messages,
+                "has_more": has_more,
+                "next_before_id": messages[0]["id"] if has_more else None
+            }
         except Exception as e:
-            print(f"Error saving message: {e}")
-            return False
+            print(f"Error retrieving chat history: {e}")
+            return {"messages": [], "has_more": False, "next_before_id": None}
     
-    def get_chat_history(self, user1, user2, limit=50):
-        """Retrieve chat history between two users"""
+    def get_undelivered_messages(self, username, after_id=0, limit=None):
+        """Messages queued for username while offline, oldest first, after after_id"""
+        limit = limit or self.OFFLINE_BATCH_SIZE
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT sender, receiver, message, timestamp 
-                FROM chat_history 
-                WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
-                ORDER BY timestamp DESC
+            # Messages sent a moment ago may still be in the write queue
+            self.writer.flush()
+            rows = self.db.fetchall('''
+                SELECT id, sender, receiver, message, timestamp
+                FROM chat_history
+                WHERE receiver = ? AND delivered = 0 AND id > ?
+                ORDER BY id
                 LIMIT ?
-            ''', (user1, user2, user2, user1, limit))
-            
-            messages = cursor.fetchall()
-            conn.close()
-            
+            ''', (username, after_id, limit))
             return [
                 {
-                    "sender": msg[0],
-                    "receiver": msg[1],
-                    "message": msg[2],
-                    "timestamp": msg[3]
+                    "id": msg[0],
+                    "sender": msg[1],
+                    "receiver": msg[2],
+                    "message": msg[3],
+                    "timestamp": msg[4]
                 }
-                for msg in reversed(messages)
+                for msg in rows
             ]
         except Exception as e:
-            print(f"Error retrieving chat history: {e}")
+            print(f"Error retrieving offline messages: {e}")
             return []
+    
+    def mark_delivered(self, username, up_to_id):
+        """Mark username's queued messages up to and including up_to_id as delivered"""
+        try:
+            with self.db.transaction() as conn:
+                return conn.execute('''
+                    UPDATE chat_history SET delivered = 1
+                    WHERE receiver = ? AND delivered = 0 AND id <= ?
+                ''', (username, up_to_id)).rowcount
+        except Exception as e:
+            print(f"Error marking messages delivered: {e}")
+            return 0
+    
+    def close(self):
+        """Flush queued messages and release pooled database connections"""
+        self.writer.stop()
+        self.db.close()
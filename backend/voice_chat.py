@@ -1,77 +1,412 @@
 import socket
+import secrets
+import heapq
+import hmac
+import hashlib
+import struct
 import threading
-import json
+import time
 from datetime import datetime
+import udp_batch
+from conference import Conference, FRAME_INTERVAL
+from voice_quality import StreamStats, AdaptiveJitterBuffer
+
+# Binary relay protocol. Clients send [kind:1][route token:8][payload]; the
+# relay forwards [PACKET_RELAYED:1][payload] to the call peer. Tokens are
+# handed out per participant when a call is accepted. Conference legs get
+# [PACKET_MIXED:1][pcm] from the mixer instead of a relayed peer frame.
+# Sequenced frames, [PACKET_VOICE_SEQ:1][token:8][seq:2][timestamp ms:4][payload],
+# feed per-call loss/jitter stats and are relayed as
+# [PACKET_RELAYED_SEQ:1][seq:2][timestamp ms:4][payload].
+# A bare [PACKET_REGISTER:1][token:8] binds a route to its sender's address
+# only on first contact or from the same IP. Moving to a different IP takes
+# [PACKET_REGISTER:1][token:8][counter:8][mac:16], where mac is the first 16
+# bytes of HMAC-SHA256(voice key, token + counter) and counter only grows.
+PACKET_REGISTER = 0x01
+PACKET_VOICE = 0x02
+PACKET_RELAYED = 0x03
+PACKET_MIXED = 0x04
+PACKET_VOICE_SEQ = 0x05
+PACKET_RELAYED_SEQ = 0x06
+HEADER = struct.Struct("!BQ")
+SEQ_HEADER = struct.Struct("!BQHI")
+REGISTER_PROOF = struct.Struct("!BQQ16s")
+MAX_PACKET = 4096
+MAX_CONFERENCE_PARTICIPANTS = 16  # Legs mixed per conference, host included
+
+class VoiceRoute:
+    """One participant's side of a call, precomputed for the relay loop"""
+    __slots__ = ("token", "key", "register_counter", "username", "call_id", "addr", "peer", "conference",
+                 "quality", "jitter")
+
+    def __init__(self, token, username, call_id, conference=None):
+        self.token = token
+        # Never sent over UDP; proves a re-register from a new IP comes from the session's owner
+        self.key = secrets.token_bytes(16)
+        self.register_counter = 0
+        self.username = username
+        self.call_id = call_id
+        self.addr = None  # Learned from the participant's register packet
+        self.peer = None
+        self.conference = conference  # Set instead of peer for conference legs
+        self.quality = StreamStats()  # Of the frames this participant sends
+        self.jitter = None  # Server-side playout buffer towards the peer, when enabled
+
+class Call:
+    """State of one 1:1 call"""
+    __slots__ = ("call_id", "caller", "receiver", "status", "started_at", "accepted_at", "ended_at", "tokens")
+
+    def __init__(self, call_id, caller, receiver):
+        self.call_id = call_id
+        self.caller = caller
+        self.receiver = receiver
+        self.status = "calling"
+        self.started_at = datetime.now().isoformat()
+        self.accepted_at = None
+        self.ended_at = None
+        self.tokens = {}  # {username: relay token}, once accepted
+
+    def other(self, username):
+        """The participant who is not username"""
+        return self.receiver if username == self.caller else self.caller
+
+    def to_dict(self):
+        """Public view of the call, without relay tokens"""
+        info = {
+            "call_id": self.call_id,
+            "caller": self.caller,
+            "receiver": self.receiver,
+            "status": self.status,
+            "started_at": self.started_at
+        }
+        if self.accepted_at:
+            info["accepted_at"] = self.accepted_at
+        if self.ended_at:
+            info["ended_at"] = self.ended_at
+        return info
 
 class VoiceChatManager:
-    def __init__(self, udp_port=5001):
+    def __init__(self, udp_port=5001, shards=1, batch_size=0, jitter_buffer=False,
+                 ring_timeout=45, ended_retention=5, legacy_protocol=False):
         self.udp_port = udp_port
-        self.active_calls = {}  # {call_id: {caller, receiver, status}}
+        # Receiver sockets sharing udp_port via SO_REUSEPORT, each with its own thread
+        self.shards = shards if hasattr(socket, "SO_REUSEPORT") else 1
+        # Datagrams per recvmmsg/sendmmsg call; 0 (or no Linux) relays one recvfrom/sendto at a time
+        self.batch_size = batch_size if udp_batch.available() else 0
+        self.batches = []
+        self.active_calls = {}  # {call_id: Call}, including recently finished calls
+        self.user_calls = {}  # {username: Call} while calling or active
+        # One reaper thread expires unanswered calls and forgets finished ones on a deadline heap
+        self.ring_timeout = ring_timeout
+        self.ended_retention = ended_retention
+        self.calls_lock = threading.RLock()
+        self.reaper_wake = threading.Condition(self.calls_lock)
+        self.reap_heap = []  # [(deadline, call_id, status when scheduled)]
+        self.reaper_thread = None
+        self.call_stats = {"started": 0, "missed": 0, "reaped": 0}
         self.user_udp_addresses = {}  # {username: (ip, port)}
+        # Unauthenticated REGISTER:/VOICE: text packets; off unless old clients need them
+        self.legacy_protocol = legacy_protocol
+        # Shared by every shard; relay threads only read it, call handlers swap entries in and out
+        self.routes = {}  # {token: VoiceRoute}
+        self.conferences = {}  # {conference_id: Conference}
+        # Smooth 1:1 calls on the server (adds 20-60 ms) instead of forwarding frames as they arrive
+        self.jitter_buffer = jitter_buffer
+        self.playout = {}  # {token: VoiceRoute} with a jitter buffer
         self.udp_socket = None
+        self.udp_sockets = []
         self.running = False
+        self.shard_stats = []
         
     def start_udp_server(self):
         """Start UDP server for voice chat"""
         try:
-            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.udp_socket.bind(('0.0.0.0', self.udp_port))
+            for shard in range(self.shards):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if self.shards > 1:
+                    # The kernel hashes each sender's address to one of the sockets
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                sock.bind(('0.0.0.0', self.udp_port))
+                if self.udp_port == 0:
+                    # Ephemeral port (tests): the other shards join the one we got
+                    self.udp_port = sock.getsockname()[1]
+                self.udp_sockets.append(sock)
+                self.shard_stats.append({"relayed": 0, "relayed_bytes": 0, "buffered": 0, "mixed": 0,
+                                         "dropped": 0, "legacy": 0, "rebinds": 0})
+            self.udp_socket = self.udp_sockets[0]
             self.running = True
             
-            print(f"Voice chat UDP server started on port {self.udp_port}")
+            io_mode = f"batches of {self.batch_size}" if self.batch_size else "unbatched"
+            print(f"Voice chat UDP server started on port {self.udp_port} ({self.shards} shards, {io_mode})")
             
-            # Start listening thread
-            listen_thread = threading.Thread(target=self.listen_for_voice_data, daemon=True)
-            listen_thread.start()
+            # Start one listening thread per socket
+            listen = self.listen_for_voice_data_batched if self.batch_size else self.listen_for_voice_data
+            for shard, sock in enumerate(self.udp_sockets):
+                listen_thread = threading.Thread(
+                    target=listen, args=(sock, self.shard_stats[shard]),
+                    name=f"voice-relay-{shard}", daemon=True
+                )
+                listen_thread.start()
+            threading.Thread(target=self.run_mixer, name="voice-mixer", daemon=True).start()
             
             return True
         except Exception as e:
             print(f"Error starting UDP server: {e}")
+            for sock in self.udp_sockets:
+                sock.close()
+            self.udp_sockets = []
+            self.shard_stats = []
             return False
     
-    def listen_for_voice_data(self):
-        """Listen for incoming voice data and relay to recipient"""
+    def listen_for_voice_data(self, sock, stats):
+        """Listen for incoming voice data on one shard and relay to recipient"""
+        # One receive buffer for the life of the thread; frames are relayed from it in place
+        buf = bytearray(MAX_PACKET)
+        view = memoryview(buf)
+        routes = self.routes
+        header_size = HEADER.size
+        
         while self.running:
             try:
-                data, address = self.udp_socket.recvfrom(4096)
+                size, address = sock.recvfrom_into(buf)
+                kind = buf[0]
                 
-                # Check if it's a registration message
-                if data.startswith(b'REGISTER:'):
-                    username = data.decode('utf-8').split(':', 1)[1]
-                    self.user_udp_addresses[username] = address
-                    print(f"Registered UDP address for {username}: {address}")
-                    continue
+                if kind == PACKET_VOICE and size >= header_size:
+                    route = routes.get(HEADER.unpack_from(buf)[1])
+                    # Only the route's learned endpoint may speak for it
+                    if route is None or (route.addr != address and not self._learn_address(route, address, stats)):
+                        stats["dropped"] += 1
+                        continue
+                    if route.peer is None:
+                        # Conference leg: buffered for the mixer rather than forwarded
+                        route.conference.receive(route.token, bytes(view[header_size:size]))
+                        stats["mixed"] += 1
+                        continue
+                    if route.peer.addr is None:
+                        stats["dropped"] += 1
+                        continue
+                    # Overwrite the token's last byte with the relayed marker and send from there
+                    buf[header_size - 1] = PACKET_RELAYED
+                    sock.sendto(view[header_size - 1:size], route.peer.addr)
+                    stats["relayed"] += 1
+                    stats["relayed_bytes"] += size - header_size + 1
+                elif kind == PACKET_VOICE_SEQ:
+                    self._relay_sequenced(sock, view, 0, size, address, stats)
+                elif kind == PACKET_REGISTER and size >= header_size:
+                    if not self._register_route(sock, view, 0, size, address):
+                        stats["dropped"] += 1
+                elif self.legacy_protocol:
+                    stats["legacy"] += 1
+                    self._handle_legacy_packet(sock, bytes(view[:size]), address)
+                else:
+                    # Not a call packet: dropped without parsing
+                    stats["dropped"] += 1
                 
-                # Check if it's voice data with routing info
-                if data.startswith(b'VOICE:'):
-                    parts = data.split(b':', 3)
-                    if len(parts) >= 4:
-                        sender = parts[1].decode('utf-8')
-                        receiver = parts[2].decode('utf-8')
-                        voice_data = parts[3]
-                        
-                        # Relay voice data to receiver
-                        if receiver in self.user_udp_addresses:
-                            receiver_address = self.user_udp_addresses[receiver]
-                            # Send with sender info
-                            relay_data = f"FROM:{sender}:".encode() + voice_data
-                            self.udp_socket.sendto(relay_data, receiver_address)
+            except Exception as e:
+                if self.running:
+                    print(f"Error in UDP listener: {e}")
+    
+    def listen_for_voice_data_batched(self, sock, stats):
+        """Same relay as listen_for_voice_data, with one recvmmsg and one sendmmsg per batch"""
+        batch = udp_batch.MessageBatch(self.batch_size, MAX_PACKET)
+        self.batches.append(batch)
+        view = batch.view
+        fd = sock.fileno()
+        routes = self.routes
+        header_size = HEADER.size
+        packet_size = batch.packet_size
+        
+        while self.running:
+            try:
+                count = batch.recv(fd)
+                for i, size in enumerate(batch.lengths(count)):
+                    start = i * packet_size
+                    kind = view[start]
+                    
+                    if kind == PACKET_VOICE and size >= header_size:
+                        route = routes.get(HEADER.unpack_from(view, start)[1])
+                        address = batch.address(i)
+                        if route is None or (route.addr != address and not self._learn_address(route, address, stats)):
+                            stats["dropped"] += 1
+                            continue
+                        if route.peer is None:
+                            route.conference.receive(route.token, bytes(view[start + header_size:start + size]))
+                            stats["mixed"] += 1
+                            continue
+                        if route.peer.addr is None:
+                            stats["dropped"] += 1
+                            continue
+                        # Relayed in place from the receive slot, as in the unbatched loop
+                        view[start + header_size - 1] = PACKET_RELAYED
+                        batch.queue(start + header_size - 1, size - header_size + 1, route.peer.addr)
+                        stats["relayed"] += 1
+                        stats["relayed_bytes"] += size - header_size + 1
+                    elif kind == PACKET_VOICE_SEQ:
+                        self._relay_sequenced(sock, view, start, size, batch.address(i), stats, batch)
+                    elif kind == PACKET_REGISTER and size >= header_size:
+                        if not self._register_route(sock, view, start, size, batch.address(i)):
+                            stats["dropped"] += 1
+                    elif self.legacy_protocol:
+                        stats["legacy"] += 1
+                        self._handle_legacy_packet(sock, bytes(view[start:start + size]), batch.address(i))
+                    else:
+                        stats["dropped"] += 1
+                if batch.queued:
+                    batch.flush(fd)
                 
             except Exception as e:
+                batch.queued = 0
                 if self.running:
                     print(f"Error in UDP listener: {e}")
     
+    def _relay_sequenced(self, sock, view, start, size, address, stats, batch=None):
+        """Relay a sequenced frame from view[start:start + size], recording its sender's stream quality"""
+        if size < SEQ_HEADER.size:
+            stats["dropped"] += 1
+            return
+        _, token, seq, media_ms = SEQ_HEADER.unpack_from(view, start)
+        route = self.routes.get(token)
+        if route is None or (route.addr != address and not self._learn_address(route, address, stats)):
+            stats["dropped"] += 1
+            return
+        route.quality.update(seq, media_ms, time.monotonic() * 1000)
+        
+        if route.peer is None:
+            route.conference.receive(token, bytes(view[start + SEQ_HEADER.size:start + size]), seq)
+            stats["mixed"] += 1
+            return
+        peer_addr = route.peer.addr
+        if peer_addr is None:
+            stats["dropped"] += 1
+            return
+        
+        # As with PACKET_VOICE: the token's last byte becomes the relayed kind
+        relay_start = start + HEADER.size - 1
+        view[relay_start] = PACKET_RELAYED_SEQ
+        if route.jitter is not None:
+            route.jitter.push(seq, bytes(view[relay_start:start + size]))
+            stats["buffered"] += 1
+        elif batch is not None:
+            batch.queue(relay_start, size - HEADER.size + 1, peer_addr)
+            stats["relayed"] += 1
+        else:
+            sock.sendto(view[relay_start:start + size], peer_addr)
+            stats["relayed"] += 1
+        stats["relayed_bytes"] += size - HEADER.size + 1
+    
+    def _register_route(self, sock, view, start, size, address):
+        """Bind a call participant's token to the address its packets come from
+
+        Once bound, a register from a different IP must carry a proof made
+        with the route's voice key; the token alone is seen on the wire.
+        """
+        token = HEADER.unpack_from(view, start)[1]
+        route = self.routes.get(token)
+        if route is None:
+            return False
+        if route.addr is not None and route.addr[0] != address[0] and \
+           not self._check_register_proof(route, view, start, size):
+            return False
+        route.addr = address
+        self.user_udp_addresses[route.username] = address
+        sock.sendto(HEADER.pack(PACKET_REGISTER, token), address)
+        print(f"Registered UDP route for {route.username}: {address}")
+        return True
+    
+    def _check_register_proof(self, route, view, start, size):
+        """Whether a register packet carries a fresh MAC over its token and counter"""
+        if size < REGISTER_PROOF.size:
+            return False
+        _, _, counter, mac = REGISTER_PROOF.unpack_from(view, start)
+        signed = bytes(view[start + 1:start + REGISTER_PROOF.size - 16])
+        expected = hmac.new(route.key, signed, hashlib.sha256).digest()[:16]
+        # A captured proof cannot be replayed once a newer one was accepted
+        if counter <= route.register_counter or not hmac.compare_digest(mac, expected):
+            return False
+        route.register_counter = counter
+        return True
+    
+    def _learn_address(self, route, address, stats):
+        """Accept a valid-token frame from a new address when it is a first contact or a NAT port change
+
+        A client that never sent PACKET_REGISTER is learned from its first
+        voice frame. A new port on the same IP is a NAT rebinding and is
+        followed. A different IP (e.g. wifi to mobile) has to re-register with
+        a voice key proof, so a leaked token alone cannot point the peer's
+        stream at a third party.
+        """
+        if route.addr is not None and route.addr[0] != address[0]:
+            return False
+        if route.addr is not None:
+            stats["rebinds"] += 1
+        route.addr = address
+        self.user_udp_addresses[route.username] = address
+        return True
+    
+    def _handle_legacy_packet(self, sock, data, address):
+        """Text protocol (REGISTER:<user>:<voice token> / VOICE:<from>:<to>:<data>) for older clients
+
+        Registering needs the user's hex voice token and follows the same
+        address rules as a bare binary register. Voice is only relayed
+        between the two sides of an active call, and only from the address
+        the sender registered, so it cannot be used to send traffic to
+        arbitrary users.
+        """
+        # Check if it's a registration message
+        if data.startswith(b'REGISTER:'):
+            parts = data.decode('utf-8', 'replace').split(':')
+            if len(parts) != 3:
+                return
+            try:
+                route = self.routes.get(int(parts[2], 16))
+            except ValueError:
+                return
+            if route is None or route.username != parts[1] or \
+               (route.addr is not None and route.addr[0] != address[0]):
+                return
+            route.addr = address
+            self.user_udp_addresses[route.username] = address
+            print(f"Registered UDP address for {route.username}: {address}")
+            return
+        
+        # Check if it's voice data with routing info
+        if data.startswith(b'VOICE:'):
+            parts = data.split(b':', 3)
+            if len(parts) >= 4:
+                sender = parts[1].decode('utf-8', 'replace')
+                receiver = parts[2].decode('utf-8', 'replace')
+                voice_data = parts[3]
+                
+                call = self.user_calls.get(sender)
+                if call is None or call.status != "active" or call.other(sender) != receiver or \
+                   self.user_udp_addresses.get(sender) != address:
+                    return
+                
+                # Relay voice data to receiver
+                if receiver in self.user_udp_addresses:
+                    receiver_address = self.user_udp_addresses[receiver]
+                    # Send with sender info
+                    relay_data = f"FROM:{sender}:".encode() + voice_data
+                    sock.sendto(relay_data, receiver_address)
+    
     def initiate_call(self, caller, receiver):
         """Initiate a voice call between two users"""
-        call_id = f"{caller}_{receiver}_{datetime.now().timestamp()}"
+        if caller == receiver:
+            return {"success": False, "error": "Cannot call yourself"}
+        call_id = f"call_{secrets.token_urlsafe(16)}"
         
-        self.active_calls[call_id] = {
-            "caller": caller,
-            "receiver": receiver,
-            "status": "calling",
-            "started_at": datetime.now().isoformat()
-        }
+        with self.calls_lock:
+            # Never displace a call either side is already in
+            if caller in self.user_calls or receiver in self.user_calls:
+                return {"success": False, "busy": True, "error": "User is busy"}
+            call = Call(call_id, caller, receiver)
+            self.active_calls[call_id] = call
+            self.user_calls[caller] = call
+            self.user_calls[receiver] = call
+            self.call_stats["started"] += 1
+            # Unanswered calls ring out after ring_timeout
+            self._schedule(call, self.ring_timeout)
         
         return {
             "success": True,
@@ -81,65 +416,264 @@ class VoiceChatManager:
             "status": "calling"
         }
     
-    def accept_call(self, call_id):
-        """Accept an incoming call"""
-        if call_id in self.active_calls:
-            self.active_calls[call_id]["status"] = "active"
-            self.active_calls[call_id]["accepted_at"] = datetime.now().isoformat()
-            
-            return {
-                "success": True,
-                "call_id": call_id,
-                "status": "active"
-            }
+    def get_call(self, call_id):
+        """Call record for call_id (kept briefly after it finishes), or None"""
+        return self.active_calls.get(call_id)
+    
+    def accept_call(self, call_id, username):
+        """Accept an incoming call; only its receiver may"""
+        with self.calls_lock:
+            call = self.active_calls.get(call_id)
+            if call is not None and call.status == "calling" and call.receiver == username:
+                call.status = "active"
+                call.accepted_at = datetime.now().isoformat()
+                self._create_routes(call)
+                
+                return {
+                    "success": True,
+                    "call_id": call_id,
+                    "status": "active"
+                }
         return {
             "success": False,
             "error": "Call not found"
         }
     
-    def reject_call(self, call_id):
-        """Reject an incoming call"""
-        if call_id in self.active_calls:
-            self.active_calls[call_id]["status"] = "rejected"
-            return {
-                "success": True,
-                "call_id": call_id,
-                "status": "rejected"
-            }
+    def reject_call(self, call_id, username):
+        """Reject an incoming call; only its receiver may"""
+        with self.calls_lock:
+            call = self.active_calls.get(call_id)
+            if call is not None and call.status == "calling" and call.receiver == username:
+                self._finish(call, "rejected")
+                return {
+                    "success": True,
+                    "call_id": call_id,
+                    "status": "rejected"
+                }
         return {
             "success": False,
             "error": "Call not found"
         }
     
-    def end_call(self, call_id):
-        """End an active call"""
-        if call_id in self.active_calls:
-            self.active_calls[call_id]["status"] = "ended"
-            self.active_calls[call_id]["ended_at"] = datetime.now().isoformat()
-            
-            # Remove from active calls after a short delay
-            threading.Timer(5.0, lambda: self.active_calls.pop(call_id, None)).start()
-            
-            return {
-                "success": True,
-                "call_id": call_id,
-                "status": "ended"
-            }
+    def end_call(self, call_id, username):
+        """End an active call; only a participant may"""
+        with self.calls_lock:
+            call = self.active_calls.get(call_id)
+            if call is not None and call.status in ("calling", "active") and \
+               username in (call.caller, call.receiver):
+                call.ended_at = datetime.now().isoformat()
+                self._finish(call, "ended")
+                
+                return {
+                    "success": True,
+                    "call_id": call_id,
+                    "status": "ended"
+                }
         return {
             "success": False,
             "error": "Call not found"
         }
     
+    def _finish(self, call, status):
+        """Move a call out of the user index; the record itself lingers for ended_retention"""
+        call.status = status
+        self._remove_routes(call)
+        for username in (call.caller, call.receiver):
+            if self.user_calls.get(username) is call:
+                del self.user_calls[username]
+                self.user_udp_addresses.pop(username, None)
+        self._schedule(call, self.ended_retention)
+    
+    def _schedule(self, call, delay):
+        """Have the reaper look at call again after delay seconds (caller holds calls_lock)"""
+        entry = (time.monotonic() + delay, call.call_id, call.status)
+        heapq.heappush(self.reap_heap, entry)
+        if self.reaper_thread is None:
+            self.reaper_thread = threading.Thread(target=self._run_reaper, name="call-reaper", daemon=True)
+            self.reaper_thread.start()
+        elif self.reap_heap[0] is entry:
+            # New earliest deadline: wake the reaper so it does not oversleep
+            self.reaper_wake.notify()
+    
+    def _run_reaper(self):
+        with self.reaper_wake:
+            while self.reaper_thread is threading.current_thread():
+                now = time.monotonic()
+                while self.reap_heap and self.reap_heap[0][0] <= now:
+                    _, call_id, status = heapq.heappop(self.reap_heap)
+                    call = self.active_calls.get(call_id)
+                    # Entries for calls that moved on since they were scheduled are stale
+                    if call is None or call.status != status:
+                        continue
+                    if status == "calling":
+                        self.call_stats["missed"] += 1
+                        self._finish(call, "missed")
+                    elif status != "active":
+                        del self.active_calls[call_id]
+                        self.call_stats["reaped"] += 1
+                timeout = self.reap_heap[0][0] - now if self.reap_heap else None
+                self.reaper_wake.wait(timeout)
+    
+    def stop_reaper(self):
+        """Stop the call reaper thread"""
+        with self.reaper_wake:
+            thread, self.reaper_thread = self.reaper_thread, None
+            self.reaper_wake.notify()
+        if thread is not None:
+            thread.join(timeout=5)
+    
+    def _create_routes(self, call):
+        """Give both participants a relay token pointing at each other"""
+        caller = VoiceRoute(secrets.randbits(64), call.caller, call.call_id)
+        receiver = VoiceRoute(secrets.randbits(64), call.receiver, call.call_id)
+        caller.peer, receiver.peer = receiver, caller
+        call.tokens = {caller.username: caller.token, receiver.username: receiver.token}
+        if self.jitter_buffer:
+            for route in (caller, receiver):
+                route.jitter = AdaptiveJitterBuffer(route.quality)
+                self.playout[route.token] = route
+        self.routes[caller.token] = caller
+        self.routes[receiver.token] = receiver
+    
+    def _remove_routes(self, call):
+        """Stop relaying for a call"""
+        for token in call.tokens.values():
+            self.routes.pop(token, None)
+            self.playout.pop(token, None)
+    
+    def create_conference(self, host, invitees, max_participants=MAX_CONFERENCE_PARTICIPANTS):
+        """Start a mixed conference call with host as its first participant; only invitees may join"""
+        # Unguessable, although join_conference checks the invite list anyway
+        conference_id = f"conf_{secrets.token_urlsafe(16)}"
+        self.conferences[conference_id] = Conference(conference_id, host, max_participants,
+                                                     invited=invitees)
+        result = self.join_conference(conference_id, host)
+        if not result["success"]:
+            self.conferences.pop(conference_id, None)
+            return result
+        return {**result, "host": host, "status": "active"}
+    
+    def join_conference(self, conference_id, username):
+        """Add username to a conference and hand out its relay token"""
+        conference = self.conferences.get(conference_id)
+        if conference is None:
+            return {"success": False, "error": "Conference not found"}
+        if not conference.may_join(username):
+            return {"success": False, "error": "Not invited to this conference"}
+        # Rejoining replaces the old leg, e.g. after a reconnect
+        self._leave_conference(conference, username)
+        route = VoiceRoute(secrets.randbits(64), username, conference_id, conference)
+        if not conference.add(route):
+            return {"success": False, "error": "Conference is full"}
+        self.routes[route.token] = route
+        return {
+            "success": True,
+            "conference_id": conference_id,
+            "voice_token": f"{route.token:016x}",
+            "voice_key": route.key.hex(),
+            "participants": conference.get_info()["participants"]
+        }
+    
+    def leave_conference(self, conference_id, username):
+        """Remove username from a conference, closing it once empty"""
+        conference = self.conferences.get(conference_id)
+        if conference is None or not self._leave_conference(conference, username):
+            return {"success": False, "error": "Not in conference"}
+        remaining = conference.get_info()["participants"]
+        if not remaining:
+            self.conferences.pop(conference_id, None)
+        return {"success": True, "conference_id": conference_id, "participants": remaining}
+    
+    def _leave_conference(self, conference, username):
+        for token, (route, _) in list(conference.members.items()):
+            if route.username == username:
+                self.routes.pop(token, None)
+                conference.remove(token)
+                return True
+        return False
+    
+    def get_conference(self, conference_id):
+        """Participants and mixer stats for a conference, or None"""
+        conference = self.conferences.get(conference_id)
+        return conference.get_info() if conference else None
+    
+    def run_mixer(self):
+        """Once per frame period, mix every conference and play out jitter-buffered calls"""
+        deadline = time.monotonic()
+        prefix = bytes([PACKET_MIXED])
+        while self.running:
+            deadline += FRAME_INTERVAL
+            for route in list(self.playout.values()):
+                frame = route.jitter.pop()
+                if frame is not None and route.peer.addr is not None:
+                    try:
+                        self.udp_socket.sendto(frame, route.peer.addr)
+                    except OSError as e:
+                        if self.running:
+                            print(f"Error playing out voice for {route.username}: {e}")
+            for conference in list(self.conferences.values()):
+                try:
+                    for address, pcm in conference.tick():
+                        self.udp_socket.sendto(prefix + pcm, address)
+                except Exception as e:
+                    if self.running:
+                        print(f"Error mixing conference {conference.conference_id}: {e}")
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind (overload or a stall); skip the missed ticks instead of bursting
+                deadline = time.monotonic()
+    
+    def get_voice_token(self, call_id, username):
+        """Hex relay token for username's side of call_id, or None"""
+        call = self.active_calls.get(call_id)
+        token = call and call.tokens.get(username)
+        return f"{token:016x}" if token is not None else None
+    
+    def get_voice_key(self, call_id, username):
+        """Hex key username signs cross-IP re-registers with, or None"""
+        call = self.active_calls.get(call_id)
+        route = call and self.routes.get(call.tokens.get(username))
+        return route.key.hex() if route is not None else None
+    
+    def get_stats(self):
+        """Relay packet counters, summed over shards"""
+        totals = {"relayed": 0, "relayed_bytes": 0, "buffered": 0, "mixed": 0, "dropped": 0,
+                  "legacy": 0, "rebinds": 0}
+        for stats in self.shard_stats:
+            for key in totals:
+                totals[key] += stats[key]
+        if self.batch_size:
+            for key in ("recv_calls", "send_calls", "send_errors"):
+                totals[key] = sum(batch.stats[key] for batch in self.batches)
+        with self.calls_lock:
+            live = len({call.call_id for call in self.user_calls.values()})
+        return {**totals, "shards": self.shards, "batch_size": self.batch_size,
+                "routes": len(self.routes), "conferences": len(self.conferences),
+                "calls": {**self.call_stats, "tracked": len(self.active_calls),
+                          "in_progress": len(self.user_calls),
+                          # Calls still ringing or active; tracked keeps ended ones too
+                          "live": live}}
+    
     def get_active_call(self, username):
-        """Get active call for a user"""
-        for call_id, call_info in self.active_calls.items():
-            if (call_info["caller"] == username or call_info["receiver"] == username) and \
-               call_info["status"] in ["calling", "active"]:
-                return {
-                    "call_id": call_id,
-                    **call_info
-                }
-        return None
+        """Get active call for a user, with per-direction voice quality once it is active"""
+        call = self.user_calls.get(username)
+        if call is None:
+            return None
+        return {**call.to_dict(), "quality": self._call_quality(call)}
+    
+    def _call_quality(self, call):
+        """{sender: stream stats} for each side of a call, plus playout stats when buffered"""
+        quality = {}
+        for username, token in call.tokens.items():
+            route = self.routes.get(token)
+            if route is None:
+                continue
+            quality[username] = route.quality.get_stats()
+            if route.jitter is not None:
+                quality[username]["playout"] = route.jitter.get_stats()
+        return quality
     
     def register_udp_client(self, username, ip, port):
         """Register UDP address for a client"""
@@ -154,6 +688,10 @@ class VoiceChatManager:
     def stop_udp_server(self):
         """Stop the UDP server"""
         self.running = False
-        if self.udp_socket:
-            self.udp_socket.close()
+        self.stop_reaper()
+        for sock in self.udp_sockets:
+            sock.close()
+        self.udp_sockets = []
+        self.udp_socket = None
+        self.batches = []
         print("Voice chat UDP server stopped")
@@ -0,0 +1,149 @@
+import math
+import threading
+
+SEQ_MODULO = 1 << 16  # sequence numbers are 16-bit and wrap
+FRAME_MS = 20
+
+def seq_behind(seq, reference):
+    """Whether seq comes before reference, allowing for wraparound"""
+    return 0 < (reference - seq) % SEQ_MODULO < SEQ_MODULO // 2
+
+class StreamStats:
+    """Loss, reordering and interarrival jitter of one sender's frames (RFC 3550 style)"""
+    __slots__ = ("received", "lost", "reordered", "duplicates", "highest", "transit", "jitter")
+
+    def __init__(self):
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.highest = None
+        self.transit = None
+        self.jitter = 0.0  # ms
+
+    def update(self, seq, media_ms, arrival_ms):
+        """Account for one frame; media_ms is the sender's timestamp, if it sent one"""
+        self.received += 1
+        if self.highest is None:
+            self.highest = seq
+        else:
+            ahead = (seq - self.highest) % SEQ_MODULO
+            if ahead == 0:
+                self.duplicates += 1
+                return
+            if ahead < SEQ_MODULO // 2:
+                self.lost += ahead - 1
+                self.highest = seq
+            else:
+                # A frame we had counted as lost turned up out of order
+                self.reordered += 1
+                if self.lost:
+                    self.lost -= 1
+
+        if media_ms is None:
+            return
+        # Only changes in transit time matter, so sender and relay clocks need not agree
+        transit = arrival_ms - media_ms
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) / 16
+        self.transit = transit
+
+    def get_stats(self):
+        """Counters plus loss rate and smoothed jitter"""
+        expected = self.received - self.duplicates + self.lost
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "loss_rate": round(self.lost / expected, 4) if expected else 0.0,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "jitter_ms": round(self.jitter, 2)
+        }
+
+class AdaptiveJitterBuffer:
+    """Reorders one sender's frames and plays them out one per tick
+
+    Playout starts once `target` frames are buffered. The target is 1 to
+    max_frames frames (20-60 ms at the default frame size), re-chosen from
+    the stream's measured jitter whenever playout (re)starts. Frames that
+    arrive after their slot was played are discarded as late, and a cushion
+    that grows past the target is trimmed so added delay stays bounded.
+    """
+    __slots__ = ("frames", "quality", "max_frames", "frame_ms", "target", "next_seq",
+                 "arrival_seq", "primed", "lock", "stats")
+
+    def __init__(self, quality=None, max_frames=3, frame_ms=FRAME_MS):
+        self.frames = {}  # {seq: frame}
+        self.quality = quality
+        self.max_frames = max_frames
+        self.frame_ms = frame_ms
+        self.target = min(2, max_frames)
+        self.next_seq = None
+        self.arrival_seq = 0  # stands in for seq on unsequenced frames
+        self.primed = False
+        self.lock = threading.Lock()  # push runs on a relay thread, pop on the mixer thread
+        self.stats = {"received": 0, "played": 0, "concealed": 0, "late": 0, "trimmed": 0, "underruns": 0}
+
+    def push(self, seq, frame):
+        """Buffer a frame; seq=None takes frames in arrival order"""
+        with self.lock:
+            self._push(seq, frame)
+
+    def _push(self, seq, frame):
+        if seq is None:
+            seq = self.arrival_seq
+            self.arrival_seq = (seq + 1) % SEQ_MODULO
+        if self.primed and seq_behind(seq, self.next_seq):
+            self.stats["late"] += 1
+            return
+        if not self.primed and (self.next_seq is None or seq_behind(seq, self.next_seq)):
+            self.next_seq = seq
+        self.frames[seq] = frame
+        self.stats["received"] += 1
+        # A stalled consumer must not let the buffer (and the delay) grow without bound
+        while len(self.frames) > 2 * self.max_frames:
+            if self.frames.pop(self.next_seq, None) is not None:
+                self.stats["trimmed"] += 1
+            self.next_seq = (self.next_seq + 1) % SEQ_MODULO
+
+    def pop(self):
+        """Next frame to play, or None for silence/concealment"""
+        with self.lock:
+            return self._pop()
+
+    def _pop(self):
+        if not self.primed:
+            if len(self.frames) < self.target:
+                return None
+            self.primed = True
+
+        frame = self.frames.pop(self.next_seq, None)
+        self.next_seq = (self.next_seq + 1) % SEQ_MODULO
+        if frame is None:
+            if not self.frames:
+                # Ran dry: a talk pause or a jitter spike. Re-prime, sized to the latest jitter.
+                self.primed = False
+                self.next_seq = None
+                self.target = self._choose_target()
+                self.stats["underruns"] += 1
+            else:
+                self.stats["concealed"] += 1
+            return None
+
+        self.stats["played"] += 1
+        # Everything left waits at least one more tick; more than target - 1 frames means extra delay
+        while len(self.frames) >= self.target:
+            if self.frames.pop(self.next_seq, None) is not None:
+                self.stats["trimmed"] += 1
+            self.next_seq = (self.next_seq + 1) % SEQ_MODULO
+        return frame
+
+    def _choose_target(self):
+        if self.quality is None:
+            return self.target
+        # One frame for reordering, plus enough to cover about two jitter deviations
+        return max(1, min(self.max_frames, 1 + math.ceil(2 * self.quality.jitter / self.frame_ms)))
+
+    def get_stats(self):
+        """Playout counters and the current added delay"""
+        return {**self.stats, "buffered": len(self.frames), "delay_ms": self.target * self.frame_ms}
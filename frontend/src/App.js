@@ -8,37 +8,54 @@ import {
 import Login from "./components/Login";
 import Register from "./components/Register";
 import Dashboard from "./components/Dashboard";
-import { SocketProvider } from "./context/SocketContext";
+import axios from "axios";
+import { SocketProvider, SERVER_URL } from "./context/SocketContext";
 import "./App.css";
 
 function App() {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [currentUser, setCurrentUser] = useState(null);
+  const [sessionToken, setSessionToken] = useState(null);
 
   useEffect(() => {
     // Check if user is already logged in (from localStorage)
     const storedUser = localStorage.getItem("chatterbox_user");
-    if (storedUser) {
+    const storedToken = localStorage.getItem("chatterbox_token");
+    if (storedUser && storedToken) {
       setCurrentUser(storedUser);
+      setSessionToken(storedToken);
       setIsAuthenticated(true);
     }
   }, []);
 
-  const handleLogin = (username) => {
+  const handleLogin = (username, token) => {
     setCurrentUser(username);
+    setSessionToken(token);
     setIsAuthenticated(true);
     localStorage.setItem("chatterbox_user", username);
+    localStorage.setItem("chatterbox_token", token);
   };
 
   const handleLogout = () => {
+    if (sessionToken) {
+      axios
+        .post(`${SERVER_URL}/api/logout`, { token: sessionToken })
+        .catch(() => {});
+    }
     setCurrentUser(null);
+    setSessionToken(null);
     setIsAuthenticated(false);
     localStorage.removeItem("chatterbox_user");
+    localStorage.removeItem("chatterbox_token");
   };
 
   return (
     <Router>
-      <SocketProvider currentUser={currentUser}>
+      <SocketProvider
+        currentUser={currentUser}
+        sessionToken={sessionToken}
+        onAuthError={handleLogout}
+      >
         <div className="App">
           <Routes>
             <Route
@@ -1,10 +1,11 @@
 import React, { useState, useEffect, useRef } from "react";
-import { useSocket } from "../context/SocketContext";
+import { useSocket, SERVER_URL } from "../context/SocketContext";
 import FileUpload from "./FileUpload";
 import "./ChatWindow.css";
 
 const ChatWindow = ({ currentUser, selectedUser, onBack }) => {
-  const { messages, sendMessage, sendFile, initiateCall } = useSocket();
+  const { messages, sendMessage, sendFile, initiateCall, sessionToken } =
+    useSocket();
   const [messageInput, setMessageInput] = useState("");
   const [showFileUpload, setShowFileUpload] = useState(false);
   const messagesEndRef = useRef(null);
@@ -27,13 +28,8 @@ const ChatWindow = ({ currentUser, selectedUser, onBack }) => {
   };
 
   const handleFileSelect = (file) => {
-    const reader = new FileReader();
-    reader.onload = (e) => {
-      const base64Data = e.target.result.split(",")[1];
-      sendFile(selectedUser, file.name, file.size, base64Data);
-      setShowFileUpload(false);
-    };
-    reader.readAsDataURL(file);
+    sendFile(selectedUser, file);
+    setShowFileUpload(false);
   };
 
   const handleVoiceCall = () => {
@@ -54,13 +50,39 @@ const ChatWindow = ({ currentUser, selectedUser, onBack }) => {
     return (bytes / (1024 * 1024)).toFixed(2) + " MB";
   };
 
-  const downloadFile = (fileName, fileData) => {
+  const saveAs = (href, fileName) => {
     const link = document.createElement("a");
-    link.href = `data:application/octet-stream;base64,${fileData}`;
+    link.href = href;
     link.download = fileName;
     link.click();
   };
 
+  const downloadFile = async (msg) => {
+    if (!msg.download_url) {
+      saveAs(
+        `data:application/octet-stream;base64,${msg.file_data}`,
+        msg.file_name
+      );
+      return;
+    }
+    // Stored files are only served to their sender and receiver, so send the session token
+    try {
+      const response = await fetch(`${SERVER_URL}${msg.download_url}`, {
+        headers: { Authorization: `Bearer ${sessionToken}` },
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      const url = URL.createObjectURL(await response.blob());
+      saveAs(url, msg.file_name);
+      // Give the browser a moment to start the download before freeing the blob
+      setTimeout(() => URL.revokeObjectURL(url), 1000);
+    } catch (error) {
+      console.error("Download failed:", error);
+      alert("Download failed");
+    }
+  };
+
   return (
     <div className="chat-window">
       {/* Chat Header */}
@@ -127,9 +149,7 @@ const ChatWindow = ({ currentUser, selectedUser, onBack }) => {
                       </div>
                       <button
                         className="download-btn"
-                        onClick={() =>
-                          downloadFile(msg.file_name, msg.file_data)
-                        }
+                        onClick={() => downloadFile(msg)}
                       >
                         ⬇️
                       </button>
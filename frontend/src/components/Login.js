@@ -22,7 +22,7 @@ const Login = ({ onLogin }) => {
       });
 
       if (response.data.success) {
-        onLogin(username);
+        onLogin(username, response.data.token);
         navigate("/dashboard");
       } else {
         setError(response.data.message || "Login failed");
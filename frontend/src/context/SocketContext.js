@@ -1,28 +1,53 @@
-import React, { createContext, useContext, useEffect, useState } from "react";
+import React, {
+  createContext,
+  useContext,
+  useEffect,
+  useRef,
+  useState,
+} from "react";
 import { io } from "socket.io-client";
 
 const SocketContext = createContext();
 
+export const SERVER_URL = "http://localhost:5000";
+
+const toHex = (buffer) =>
+  Array.from(new Uint8Array(buffer))
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+
 export const useSocket = () => {
   return useContext(SocketContext);
 };
 
-export const SocketProvider = ({ children, currentUser }) => {
+export const SocketProvider = ({
+  children,
+  currentUser,
+  sessionToken,
+  onAuthError,
+}) => {
   const [socket, setSocket] = useState(null);
   const [connected, setConnected] = useState(false);
   const [onlineUsers, setOnlineUsers] = useState([]);
   const [messages, setMessages] = useState({});
   const [incomingCall, setIncomingCall] = useState(null);
   const [activeCall, setActiveCall] = useState(null);
+  // Chunked uploads keyed by client_ref, kept across reconnects for resume
+  const uploadsRef = useRef({});
 
   useEffect(() => {
+    // The server only accepts sockets that present a session token
+    if (!sessionToken) {
+      return undefined;
+    }
+
     // Initialize socket connection
-    const SERVER_URL = "http://localhost:5000";
     const newSocket = io(SERVER_URL, {
       transports: ["websocket", "polling"],
       reconnection: true,
       reconnectionAttempts: 5,
       reconnectionDelay: 1000,
+      auth: { token: sessionToken },
     });
 
     newSocket.on("connect", () => {
@@ -33,6 +58,24 @@ export const SocketProvider = ({ children, currentUser }) => {
       if (currentUser) {
         newSocket.emit("user_online", { username: currentUser });
       }
+
+      // Resume uploads interrupted by the disconnect
+      Object.entries(uploadsRef.current).forEach(([clientRef, upload]) => {
+        if (upload.transferId) {
+          newSocket.emit("file_upload_start", {
+            client_ref: clientRef,
+            sender: currentUser,
+            transfer_id: upload.transferId,
+          });
+        }
+      });
+    });
+
+    newSocket.on("connect_error", (err) => {
+      // Expired or revoked session: reconnecting will not help, log in again
+      if (err.message === "unauthorized" && onAuthError) {
+        onAuthError();
+      }
     });
 
     newSocket.on("disconnect", () => {
@@ -44,14 +87,34 @@ export const SocketProvider = ({ children, currentUser }) => {
       console.log("Connection response:", data);
     });
 
+    // Last presence delta applied per server worker; a gap means we missed one
+    let presenceSeqs = {};
+
     newSocket.on("online_users", (data) => {
       console.log("Online users:", data.users);
+      presenceSeqs = { [data.source]: data.seq };
       setOnlineUsers(data.users.filter((user) => user !== currentUser));
     });
 
-    newSocket.on("user_status_changed", (data) => {
-      console.log("User status changed:", data);
-      setOnlineUsers(data.online_users.filter((user) => user !== currentUser));
+    newSocket.on("presence_delta", (data) => {
+      const lastSeq = presenceSeqs[data.source];
+      if (lastSeq !== undefined && data.seq <= lastSeq) {
+        // Stale or duplicate: already covered by what we have applied
+        return;
+      }
+      presenceSeqs[data.source] = data.seq;
+      if (lastSeq !== undefined && data.seq > lastSeq + 1) {
+        // Missed an update: resync from a full snapshot
+        newSocket.emit("get_online_users");
+        return;
+      }
+      setOnlineUsers((users) => {
+        const online = new Set(users);
+        data.left.forEach((user) => online.delete(user));
+        data.joined.forEach((user) => online.add(user));
+        online.delete(currentUser);
+        return Array.from(online);
+      });
     });
 
     newSocket.on("private_message", (data) => {
@@ -63,6 +126,28 @@ export const SocketProvider = ({ children, currentUser }) => {
       }));
     });
 
+    newSocket.on("offline_messages", (data, ack) => {
+      console.log("Offline messages received:", data.messages.length);
+      setMessages((prev) => {
+        const next = { ...prev };
+        const seen = {};
+        data.messages.forEach((msg) => {
+          const chatKey = msg.sender;
+          if (!seen[chatKey]) {
+            next[chatKey] = [...(next[chatKey] || [])];
+            seen[chatKey] = new Set(next[chatKey].map((m) => m.id));
+          }
+          // Batches are re-sent if the ack was lost, so skip ones we already have
+          if (!seen[chatKey].has(msg.id)) {
+            seen[chatKey].add(msg.id);
+            next[chatKey].push(msg);
+          }
+        });
+        return next;
+      });
+      if (ack) ack();
+    });
+
     newSocket.on("file_received", (data) => {
       console.log("File received:", data);
       const chatKey = data.sender;
@@ -72,6 +157,60 @@ export const SocketProvider = ({ children, currentUser }) => {
       }));
     });
 
+    const sendChunk = (clientRef, offset) => {
+      const upload = uploadsRef.current[clientRef];
+      if (!upload) return;
+      if (offset >= upload.buffer.byteLength) {
+        newSocket.emit("file_upload_complete", {
+          transfer_id: upload.transferId,
+          file_hash: upload.fileHash,
+        });
+        return;
+      }
+      newSocket.emit("file_upload_chunk", {
+        transfer_id: upload.transferId,
+        offset,
+        data: upload.buffer.slice(offset, offset + upload.chunkSize),
+      });
+    };
+
+    const findUpload = (transferId) =>
+      Object.keys(uploadsRef.current).find(
+        (ref) => uploadsRef.current[ref].transferId === transferId
+      );
+
+    newSocket.on("file_upload_ready", (data) => {
+      const upload = uploadsRef.current[data.client_ref];
+      if (!upload) return;
+      upload.transferId = data.transfer_id;
+      upload.chunkSize = data.chunk_size;
+      sendChunk(data.client_ref, data.offset);
+    });
+
+    newSocket.on("file_upload_ack", (data) => {
+      const clientRef = findUpload(data.transfer_id);
+      if (clientRef) sendChunk(clientRef, data.offset);
+    });
+
+    newSocket.on("file_upload_error", (data) => {
+      console.error("File upload error:", data);
+      const clientRef = data.client_ref || findUpload(data.transfer_id);
+      const upload = clientRef && uploadsRef.current[clientRef];
+      if (!upload) return;
+      // Offset errors are recoverable: restart from where the server is
+      if (data.offset !== undefined && data.offset !== null && upload.retries < 3) {
+        upload.retries += 1;
+        sendChunk(clientRef, data.offset);
+      } else {
+        delete uploadsRef.current[clientRef];
+      }
+    });
+
+    newSocket.on("file_sent", (data) => {
+      const clientRef = findUpload(data.transfer_id);
+      if (clientRef) delete uploadsRef.current[clientRef];
+    });
+
     newSocket.on("incoming_call", (data) => {
       console.log("Incoming call:", data);
       setIncomingCall(data);
@@ -89,6 +228,11 @@ export const SocketProvider = ({ children, currentUser }) => {
       setIncomingCall(null);
     });
 
+    newSocket.on("call_busy", (data) => {
+      console.log("Call busy:", data);
+      setActiveCall(null);
+    });
+
     newSocket.on("call_ended", (data) => {
       console.log("Call ended:", data);
       setActiveCall(null);
@@ -104,7 +248,7 @@ export const SocketProvider = ({ children, currentUser }) => {
     return () => {
       newSocket.close();
     };
-  }, [currentUser]);
+  }, [currentUser, sessionToken]);
 
   const sendMessage = (receiver, message) => {
     if (socket && connected) {
@@ -129,14 +273,27 @@ export const SocketProvider = ({ children, currentUser }) => {
     }
   };
 
-  const sendFile = (receiver, fileName, fileSize, fileData) => {
+  const sendFile = async (receiver, file) => {
     if (socket && connected) {
-      socket.emit("file_transfer", {
+      // Hash up front so the server can verify the reassembled file
+      const buffer = await file.arrayBuffer();
+      const fileHash = toHex(await crypto.subtle.digest("SHA-256", buffer));
+      const clientRef = `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+
+      uploadsRef.current[clientRef] = {
+        buffer,
+        fileHash,
+        transferId: null,
+        retries: 0,
+      };
+      socket.emit("file_upload_start", {
+        client_ref: clientRef,
         sender: currentUser,
         receiver,
-        file_name: fileName,
-        file_size: fileSize,
-        file_data: fileData,
+        file_name: file.name,
+        file_size: file.size,
+        // Lets the server skip the upload when it already stores this content
+        file_hash: fileHash,
       });
     }
   };
@@ -186,6 +343,7 @@ export const SocketProvider = ({ children, currentUser }) => {
 
   const value = {
     socket,
+    sessionToken,
     connected,
     onlineUsers,
     messages,